@@ -39,6 +39,7 @@ from . import log_conf, report
 from .coregistration import Coregistration
 from .dem_processing import DemProcessing
 from .dem_tools import (
+    DEFAULT_ROI_MARGIN,
     compute_and_save_image_plots,
     compute_dem_slope,
     load_dem,
@@ -52,6 +53,7 @@ from .helpers_init import (
     save_config_file,
 )
 from .internal_typing import ConfigType
+from .output_writer import DEFAULT_OUTPUT_WRITERS, OutputWriter
 from .stats_dataset import StatsDataset
 from .stats_processing import StatsProcessing
 
@@ -68,6 +70,7 @@ __email__ = "cars@cnes.fr"
 def run(
     json_file_path: str,
     loglevel: int = logging.WARNING,
+    input_ref: xr.Dataset = None,
 ):
     """
     Demcompare RUN execution.
@@ -76,6 +79,10 @@ def run(
     :type json_file_path: str
     :param loglevel: Choose Loglevel (default: WARNING)
     :type loglevel: int
+    :param input_ref: optional input ref already loaded from the
+        input_ref configuration, as done by demcompare_batch
+        for all its secondary dems. Loaded from the cfg if None.
+    :type input_ref: xr.Dataset or None
     """
 
     # Initialization
@@ -102,7 +109,7 @@ def run(
     logging.debug("Demcompare configuration: %s", cfg)
 
     # Get input ref and input sec dem datasets from cfg
-    input_ref, input_sec = load_input_dems(cfg)
+    input_ref, input_sec = load_input_dems(cfg, input_ref)
 
     logging.info("Input Reference DEM (REF): %s", input_ref.input_img)
     # if two references, show input secondary DEM
@@ -112,182 +119,207 @@ def run(
     # Create list of datasets
     stats_datasets: List[StatsDataset] = []
 
-    # If coregistration step is present
-    if "coregistration" in cfg:
-        # update cfg coregistration output (created in coreg sub pipeline)
-        cfg["coregistration"]["output_dir"] = os.path.join(
-            cfg["output_dir"], "coregistration"
-        )
-        # Do coregistration and obtain initial
-        # and final intermediate dems for stats computation
-        (
-            input_stats_sec,
-            input_stats_ref,
-        ) = run_coregistration(cfg["coregistration"], input_ref, input_sec)
-
-    else:
-        # If input_sec is not None, reproject DEMs
-        if input_sec:
-            input_stats_sec, input_stats_ref, _ = reproject_dems(
-                input_sec,
-                input_ref,
-                sampling_source=(
-                    cfg["sampling_source"] if "sampling_source" in cfg else None
-                ),
+    # Output rasters and figures are written in the background
+    # while the computation continues. The writings are waited for
+    # when leaving the block, before saving the final config and the
+    # report using them, and the writing threads are always stopped
+    with OutputWriter(
+        cfg["output_writers"]
+        if "output_writers" in cfg
+        else DEFAULT_OUTPUT_WRITERS
+    ) as output_writer:
+        # If coregistration step is present
+        if "coregistration" in cfg:
+            # update cfg coregistration output (created in coreg sub pipeline)
+            cfg["coregistration"]["output_dir"] = os.path.join(
+                cfg["output_dir"], "coregistration"
             )
-        # If input_sec is None, input_stats_sec=None
-        else:
-            input_stats_ref, input_stats_sec = input_ref, None
-
-    # If only stats is present
-    if "statistics" in cfg:
-        logging.info("[Stats]")
-        logging.info("Altimetric stats generation")
-
-        # Loop over the DEM processing methods in cfg["statistics"]
-        for dem_processing_method in cfg["statistics"]:
-            # create directory for dem processing method stats
-            os.makedirs(
-                cfg["statistics"][dem_processing_method]["output_dir"],
-                exist_ok=True,
-            )
-
-            # Create a DEM processing object for each DEM processing method
-            dem_processing_object = DemProcessing(dem_processing_method)
-
-            # Obtain output paths for initial dem diff without coreg
+            # Do coregistration and obtain initial
+            # and final intermediate dems for stats computation
             (
-                dem_path,
-                plot_file_path,
-                plot_path_cdf,
-                csv_path_cdf,
-                plot_path_pdf,
-                csv_path_pdf,
-                plot_path_svf,
-                plot_path_hillshade,
-            ) = get_output_files_paths(
-                cfg["output_dir"], dem_processing_method, "dem_for_stats"
+                input_stats_sec,
+                input_stats_ref,
+            ) = run_coregistration(
+                cfg["coregistration"], input_ref, input_sec, output_writer
             )
 
-            # Compute slope and add it as a classification_layer
-            # in case a classification of type slope is required
-            # The ref is considered the main classification,
-            # the slope of the sec dem will be used for the
-            # intersection-exclusion
-            input_stats_ref = compute_dem_slope(input_stats_ref)
-            if input_stats_sec:
-                input_stats_sec = compute_dem_slope(input_stats_sec)
-
-            # If defined, verify fusion layers according to the cfg
-            if (
-                "classification_layer"
-                in cfg["statistics"][dem_processing_method]
-            ):
+        else:
+            # If input_sec is not None, reproject DEMs
+            if input_sec:
+                input_stats_sec, input_stats_ref, _ = reproject_dems(
+                    input_sec,
+                    input_ref,
+                    sampling_source=(
+                        cfg["sampling_source"]
+                        if "sampling_source" in cfg
+                        else None
+                    ),
+                )
+            # If input_sec is None, input_stats_sec=None
+            else:
+                input_stats_ref, input_stats_sec = input_ref, None
+
+        # If only stats is present
+        if "statistics" in cfg:
+            logging.info("[Stats]")
+            logging.info("Altimetric stats generation")
+
+            # Loop over the DEM processing methods in cfg["statistics"]
+            for dem_processing_method in cfg["statistics"]:
+                # create directory for dem processing method stats
+                os.makedirs(
+                    cfg["statistics"][dem_processing_method]["output_dir"],
+                    exist_ok=True,
+                )
+
+                # Create a DEM processing object for each DEM processing method
+                dem_processing_object = DemProcessing(dem_processing_method)
+
+                # Obtain output paths for initial dem diff without coreg
+                (
+                    dem_path,
+                    plot_file_path,
+                    plot_path_cdf,
+                    csv_path_cdf,
+                    plot_path_pdf,
+                    csv_path_pdf,
+                    plot_path_svf,
+                    plot_path_hillshade,
+                ) = get_output_files_paths(
+                    cfg["output_dir"], dem_processing_method, "dem_for_stats"
+                )
+
+                # Compute slope and add it as a classification_layer
+                # in case a classification of type slope is required
+                # The ref is considered the main classification,
+                # the slope of the sec dem will be used for the
+                # intersection-exclusion
+                input_stats_ref = compute_dem_slope(input_stats_ref)
+                if input_stats_sec:
+                    input_stats_sec = compute_dem_slope(input_stats_sec)
+
+                # If defined, verify fusion layers according to the cfg
                 if (
-                    "fusion"
-                    in cfg["statistics"][dem_processing_method][
-                        "classification_layers"
-                    ]
+                    "classification_layer"
+                    in cfg["statistics"][dem_processing_method]
                 ):
-                    verify_fusion_layers(
-                        input_stats_ref,
-                        cfg["statistics"][dem_processing_method][
+                    if (
+                        "fusion"
+                        in cfg["statistics"][dem_processing_method][
                             "classification_layers"
-                        ],
-                        support="ref",
-                    )
-                    if input_stats_sec:
+                        ]
+                    ):
                         verify_fusion_layers(
-                            input_stats_sec,
+                            input_stats_ref,
                             cfg["statistics"][dem_processing_method][
                                 "classification_layers"
                             ],
-                            support="sec",
+                            support="ref",
                         )
-            logging.info(" Dem processing: %s ", dem_processing_object.type)
-            stats_dem = dem_processing_object.process_dem(
-                input_stats_ref, input_stats_sec
-            )
-
-            # Save stats_dem for two states
-            save_dem(stats_dem, dem_path)
-
-            # Compute and save initial altitude diff image plots
-            compute_and_save_image_plots(
-                stats_dem,
-                plot_file_path,
-                fig_title=dem_processing_object.fig_title,
-                colorbar_title=dem_processing_object.colorbar_title,
-                cmap=dem_processing_object.cmap,
-                vmin_plot=(
-                    cfg["statistics"][dem_processing_method]["vmin_plot"]
-                    if "vmin_plot" in cfg["statistics"][dem_processing_method]
-                    else None
-                ),
-                vmax_plot=(
-                    cfg["statistics"][dem_processing_method]["vmax_plot"]
-                    if "vmax_plot" in cfg["statistics"][dem_processing_method]
-                    else None
-                ),
-            )
-
-            # Create StatsComputation object
-            stats_processing = StatsProcessing(
-                cfg["statistics"][dem_processing_method],
-                stats_dem,
-                dem_processing_method=dem_processing_method,
-            )
-
-            # For the initial_dh, compute cdf and pdf stats
-            # on the global classification layer only (diff, pdf, cdf)
-            plot_metrics = [
-                {
-                    "cdf": {
-                        "remove_outliers": cfg["statistics"][
-                            dem_processing_method
-                        ]["remove_outliers"],
-                        "output_plot_path": plot_path_cdf,
-                        "output_csv_path": csv_path_cdf,
-                    }
-                },
-                {
-                    "pdf": {
-                        "remove_outliers": cfg["statistics"][
-                            dem_processing_method
-                        ]["remove_outliers"],
-                        "output_plot_path": plot_path_pdf,
-                        "output_csv_path": csv_path_pdf,
-                    }
-                },
-                {
-                    "svf": {
-                        "remove_outliers": cfg["statistics"][
-                            dem_processing_method
-                        ]["remove_outliers"],
-                        "plot_path": plot_path_svf,
-                    }
-                },
-                {
-                    "hillshade": {
-                        "remove_outliers": cfg["statistics"][
-                            dem_processing_method
-                        ]["remove_outliers"],
-                        "plot_path": plot_path_hillshade,
-                    }
-                },
-            ]
-
-            # generate intermediate stats results CDF and PDF for report
-            # refacto type hinting standardize metrics input type
-            stats_processing.compute_stats(
-                classification_layer=["global"],
-                metrics=plot_metrics,  # type: ignore
-            )
-
-            # Compute stats according to the input stats configuration
-            stats_dataset = stats_processing.compute_stats()
-
-            stats_datasets.append(stats_dataset)
+                        if input_stats_sec:
+                            verify_fusion_layers(
+                                input_stats_sec,
+                                cfg["statistics"][dem_processing_method][
+                                    "classification_layers"
+                                ],
+                                support="sec",
+                            )
+                logging.info(" Dem processing: %s ", dem_processing_object.type)
+                stats_dem = dem_processing_object.process_dem(
+                    input_stats_ref, input_stats_sec
+                )
+
+                # Save stats_dem for two states
+                output_writer.submit(
+                    save_dem,
+                    stats_dem,
+                    dem_path,
+                    output_profile=(
+                        cfg["output_profile"]
+                        if "output_profile" in cfg
+                        else None
+                    ),
+                )
+
+                # Compute and save initial altitude diff image plots
+                output_writer.submit(
+                    compute_and_save_image_plots,
+                    stats_dem,
+                    plot_file_path,
+                    fig_title=dem_processing_object.fig_title,
+                    colorbar_title=dem_processing_object.colorbar_title,
+                    cmap=dem_processing_object.cmap,
+                    vmin_plot=(
+                        cfg["statistics"][dem_processing_method]["vmin_plot"]
+                        if "vmin_plot"
+                        in cfg["statistics"][dem_processing_method]
+                        else None
+                    ),
+                    vmax_plot=(
+                        cfg["statistics"][dem_processing_method]["vmax_plot"]
+                        if "vmax_plot"
+                        in cfg["statistics"][dem_processing_method]
+                        else None
+                    ),
+                )
+
+                # Create StatsComputation object
+                stats_processing = StatsProcessing(
+                    cfg["statistics"][dem_processing_method],
+                    stats_dem,
+                    dem_processing_method=dem_processing_method,
+                )
+
+                # For the initial_dh, compute cdf and pdf stats
+                # on the global classification layer only (diff, pdf, cdf)
+                plot_metrics = [
+                    {
+                        "cdf": {
+                            "remove_outliers": cfg["statistics"][
+                                dem_processing_method
+                            ]["remove_outliers"],
+                            "output_plot_path": plot_path_cdf,
+                            "output_csv_path": csv_path_cdf,
+                        }
+                    },
+                    {
+                        "pdf": {
+                            "remove_outliers": cfg["statistics"][
+                                dem_processing_method
+                            ]["remove_outliers"],
+                            "output_plot_path": plot_path_pdf,
+                            "output_csv_path": csv_path_pdf,
+                        }
+                    },
+                    {
+                        "svf": {
+                            "remove_outliers": cfg["statistics"][
+                                dem_processing_method
+                            ]["remove_outliers"],
+                            "plot_path": plot_path_svf,
+                        }
+                    },
+                    {
+                        "hillshade": {
+                            "remove_outliers": cfg["statistics"][
+                                dem_processing_method
+                            ]["remove_outliers"],
+                            "plot_path": plot_path_hillshade,
+                        }
+                    },
+                ]
+
+                # generate intermediate stats results CDF and PDF for report
+                # refacto type hinting standardize metrics input type
+                stats_processing.compute_stats(
+                    classification_layer=["global"],
+                    metrics=plot_metrics,  # type: ignore
+                )
+
+                # Compute stats according to the input stats configuration
+                stats_dataset = stats_processing.compute_stats()
+
+                stats_datasets.append(stats_dataset)
 
     # Save full final config
     # with inputs absolute paths into output_dir
@@ -305,12 +337,16 @@ def run(
 
 def load_input_dems(
     cfg: ConfigType,
+    input_ref: xr.Dataset = None,
 ) -> Tuple[xr.Dataset, Union[None, xr.Dataset]]:
     """
     Loads the input dems according to the input cfg
 
     :param cfg: input configuration
     :type cfg: ConfigType
+    :param input_ref: optional input ref already loaded from
+        cfg["input_ref"], only the input sec is loaded if given
+    :type input_ref: xr.Dataset or None
     :return: input_ref and input_dem datasets or None
     :rtype:   Tuple(xr.Dataset, xr.Dataset)
           The xr.Datasets containing :
@@ -319,74 +355,65 @@ def load_input_dems(
           - trans: 1D (trans_len) xarray.DataArray
     """
     # Create input datasets
-    ref = load_dem(
-        cfg["input_ref"]["path"],
-        nodata=(
-            cfg["input_ref"]["nodata"] if "nodata" in cfg["input_ref"] else None
-        ),
+    if input_ref is not None:
+        ref = input_ref
+    else:
+        ref = load_input_dem(cfg["input_ref"])
+    if "input_sec" in cfg:
+        sec = load_input_dem(cfg["input_sec"])
+    else:
+        sec = None
+
+    return ref, sec
+
+
+def load_input_dem(input_dem_cfg: ConfigType) -> xr.Dataset:
+    """
+    Loads an input dem according to its input_ref or input_sec cfg
+
+    :param input_dem_cfg: input dem configuration
+    :type input_dem_cfg: ConfigType
+    :return: input dem dataset
+    :rtype: xr.Dataset
+          The xr.Dataset containing :
+
+          - im : 2D (row, col) xarray.DataArray float32
+          - trans: 1D (trans_len) xarray.DataArray
+    """
+    return load_dem(
+        input_dem_cfg["path"],
+        nodata=(input_dem_cfg["nodata"] if "nodata" in input_dem_cfg else None),
         geoid_georef=(
-            cfg["input_ref"]["geoid_georef"]
-            if "geoid_georef" in cfg["input_ref"]
+            input_dem_cfg["geoid_georef"]
+            if "geoid_georef" in input_dem_cfg
             else False
         ),
         geoid_path=(
-            cfg["input_ref"]["geoid_path"]
-            if "geoid_path" in cfg["input_ref"]
+            input_dem_cfg["geoid_path"]
+            if "geoid_path" in input_dem_cfg
             else None
         ),
-        zunit=(
-            cfg["input_ref"]["zunit"] if "zunit" in cfg["input_ref"] else "m"
-        ),
-        input_roi=(
-            cfg["input_ref"]["roi"] if "roi" in cfg["input_ref"] else False
+        zunit=(input_dem_cfg["zunit"] if "zunit" in input_dem_cfg else "m"),
+        input_roi=(input_dem_cfg["roi"] if "roi" in input_dem_cfg else False),
+        roi_margin=(
+            input_dem_cfg["roi_margin"]
+            if "roi_margin" in input_dem_cfg
+            else DEFAULT_ROI_MARGIN
         ),
+        chunks=(input_dem_cfg["chunks"] if "chunks" in input_dem_cfg else None),
         classification_layers=(
-            cfg["input_ref"]["classification_layers"]
-            if "classification_layers" in cfg["input_ref"]
+            input_dem_cfg["classification_layers"]
+            if "classification_layers" in input_dem_cfg
             else None
         ),
     )
-    if "input_sec" in cfg:
-        sec = load_dem(
-            cfg["input_sec"]["path"],
-            nodata=(
-                cfg["input_sec"]["nodata"]
-                if "nodata" in cfg["input_sec"]
-                else None
-            ),
-            geoid_georef=(
-                cfg["input_sec"]["geoid_georef"]
-                if "geoid_georef" in cfg["input_sec"]
-                else False
-            ),
-            geoid_path=(
-                cfg["input_sec"]["geoid_path"]
-                if "geoid_path" in cfg["input_sec"]
-                else None
-            ),
-            zunit=(
-                cfg["input_sec"]["zunit"]
-                if "zunit" in cfg["input_sec"]
-                else "m"
-            ),
-            input_roi=(
-                cfg["input_sec"]["roi"] if "roi" in cfg["input_sec"] else False
-            ),
-            classification_layers=(
-                cfg["input_sec"]["classification_layers"]
-                if "classification_layers" in cfg["input_sec"]
-                else None
-            ),
-        )
-
-    else:
-        sec = None
-
-    return ref, sec
 
 
 def run_coregistration(
-    cfg: ConfigType, input_ref: xr.Dataset, input_sec: xr.Dataset
+    cfg: ConfigType,
+    input_ref: xr.Dataset,
+    input_sec: xr.Dataset,
+    output_writer: OutputWriter = None,
 ) -> Tuple[xr.Dataset, xr.Dataset]:
     """
     Runs the dems coregistration
@@ -403,6 +430,9 @@ def run_coregistration(
 
                 - im : 2D (row, col) xarray.DataArray float32
                 - trans: 1D (trans_len) xarray.DataArray
+    :param output_writer: optional output writer writing the
+        coregistration internal dems in the background
+    :type output_writer: OutputWriter or None
     :return: reproj_coreg_sec, reproj_coreg_ref
     :rtype:   Tuple(xr.Dataset, xr.Dataset)
              The xr.Datasets containing :
@@ -415,7 +445,9 @@ def run_coregistration(
     coregistration_ = Coregistration(cfg)
 
     # Compute coregistration
-    _ = coregistration_.compute_coregistration(input_sec, input_ref)
+    _ = coregistration_.compute_coregistration(
+        input_sec, input_ref, output_writer
+    )
 
     # Get coregistration_results dict
     coregistration_results = coregistration_.coregistration_results
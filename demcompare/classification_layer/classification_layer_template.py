@@ -26,7 +26,6 @@ A classification_layer defines a way to classify the DEMs alti differences.
 
 # Standard imports
 import collections
-import copy
 import logging
 import os
 from abc import ABCMeta, abstractmethod
@@ -39,12 +38,17 @@ import xarray as xr
 from json_checker import Checker, Or
 
 # DEMcompare imports
+from demcompare.dataset_tools import get_classification_layer_nodata
 from demcompare.dem_tools import DEFAULT_NODATA, create_dem, save_dem
 from demcompare.img_tools import remove_nan_and_flatten
+from demcompare.lazy_tools import compute_if_lazy, is_lazy_array
 from demcompare.metric import Metric
+from demcompare.metric.grouped_data import GroupedData
+from demcompare.metric.metrics_plan import MetricsPlan
 
 from ..internal_typing import ConfigType
 from ..stats_dataset import StatsDataset
+from ..stats_masks import StatsMasks, compute_nonan_mask
 
 
 # pylint:disable=too-many-instance-attributes
@@ -135,6 +139,8 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         self.remove_outliers: bool = self.cfg["remove_outliers"]
         # Output directory
         self.output_dir: Union[str, None] = self.cfg["output_dir"]
+        # Output GeoTIFF profile
+        self.output_profile: Union[Dict, None] = self.cfg["output_profile"]
         # Output directory for stats
         self._stats_dir: Union[str, None] = None
         # Create output dir (where to store classification_layer results & data)
@@ -150,6 +156,8 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         self.map_image: Dict = {"ref": None, "sec": None}
         # Init sets masks dict
         self.classes_masks: Dict = {"ref": [], "sec": []}
+        # Metrics execution plans by input metrics
+        self._metrics_plans: Dict[str, MetricsPlan] = {}
 
         # Init outliers free mask
         self.outliers_free_mask: np.ndarray = None
@@ -173,11 +181,14 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
             cfg["remove_outliers"] = False
         if "output_dir" not in cfg:
             cfg["output_dir"] = None
+        if "output_profile" not in cfg:
+            cfg["output_profile"] = None
         # Configuration schema
         self.schema = {
             "type": Or("slope", "segmentation", "global", "fusion"),
             "remove_outliers": bool,
             "output_dir": Or(str, None),
+            "output_profile": Or(dict, None),
             "nodata": Or(int, float),
             "metrics": list,
         }
@@ -202,6 +213,7 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         data: xr.Dataset,
         stats_dataset: StatsDataset,
         metrics: List[Union[dict, str]] = None,
+        stats_masks: StatsMasks = None,
     ):
         """
         Stats are computed based on the classification layers, which define
@@ -229,26 +241,37 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :type stats_dataset: StatsDataset
         :param metrics: metrics to be computed
         :type metrics: List[Union[dict, str]]
+        :param stats_masks: validity and outliers masks of the data
+            image shared by the classification layers, computed if None
+        :type stats_masks: StatsMasks or None
         :return: stats, masks, names per mode
         :rtype: List, List List
         """
+        if stats_masks is None:
+            stats_masks = StatsMasks(data["image"].data, data.attrs["nodata"])
         # Get outliers free mask (array of True where value is no outlier)
-        self.outliers_free_mask = self._get_outliers_free_mask(
-            copy.deepcopy(data["image"].data), data.attrs["nodata"]
-        )
+        self.outliers_free_mask = stats_masks.outliers_free_mask
+        self.no_data_location = stats_masks.no_data_location
         # Get mode masks and names
-        mode_masks, mode_names = self._create_mode_masks(data)
+        mode_masks, mode_names = self._create_mode_masks(
+            data, stats_masks.nonan_mask
+        )
+        # Get the class labels map shared by the modes
+        class_labels = None
+        if not is_lazy_array(data["image"].data):
+            class_labels = self._create_class_labels()
 
         # Compute stats for each mode
         for mode_idx, mode_name in enumerate(mode_names):
             # Compute stats for all classes of a single mode
             # and add them to the stats_dataset object
             stats_dataset = self._compute_mode_stats(
-                copy.deepcopy(data["image"].data),
+                data["image"].data,
                 stats_dataset,
                 mode_mask=mode_masks[mode_idx],
                 mode_name=mode_name,
                 metrics=metrics,
+                class_labels=class_labels,
             )
 
         # Save stats as plots, csv and json and do so for each mode
@@ -267,40 +290,27 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
             with outlier handling per metric
         :rtype: Tuple[Dict[str, Metric], List[bool]]
         """
-        # Metric objects dictionary
-        metrics = {}
-        # Initialize remove outliers list
-        remove_outliers_list = []
-        for input_metric in input_metrics:
-            # The input metric can be a dictionary or a str
-            # If dict, metric will have type and params
-            if isinstance(input_metric, dict):
-                # Get metric name
-                name = list(input_metric.keys())[0]
-                # Get metric params
-                params = input_metric[name]
-                # If outliers were specified for this metric
-                if "remove_outliers" in params:
-                    remove_outliers_list.append(params["remove_outliers"])
-                    # copy the params and suppress the
-                    # remove_outliers parameter as it is
-                    # not part of the metric class
-                    tmp_params = copy.deepcopy(params)
-                    tmp_params.pop("remove_outliers")
-                    # Create metric object and add it to the dictionary
-                    metrics[name] = Metric(name, tmp_params)
-                else:
-                    # If outliers were not specified for this metric,
-                    # add the value defined for the whole classification layer
-                    remove_outliers_list.append(self.remove_outliers)
-                    # Create metric object and add it to the dictionary
-                    metrics[name] = Metric(name, params)
-            else:
-                # Create the metric object and add it to the dictionary
-                metrics[input_metric] = Metric(input_metric)
-                # Add the outliers value defined for the whole classif layer
-                remove_outliers_list.append(self.remove_outliers)
-        return metrics, remove_outliers_list
+        metrics_plan = MetricsPlan(input_metrics, self.remove_outliers)
+        return metrics_plan.metrics, metrics_plan.remove_outliers_list
+
+    def _get_metrics_plan(
+        self, input_metrics: List[Union[dict, str]]
+    ) -> MetricsPlan:
+        """
+        Returns the execution plan of the input metrics, parsed
+        once for all the classes and modes of the layer
+
+        :param input_metrics: list of input metrics
+        :type input_metrics: List of Dict and str
+        :return: metrics execution plan
+        :rtype: MetricsPlan
+        """
+        key = repr(input_metrics)
+        if key not in self._metrics_plans:
+            self._metrics_plans[key] = MetricsPlan(
+                input_metrics, self.remove_outliers
+            )
+        return self._metrics_plans[key]
 
     def _get_outliers_free_mask(
         self, array: np.ndarray, nodata_value: Union[int, None] = None
@@ -317,20 +327,13 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :return: outliers free mask (array of True where value is no outlier)
         :rtype: np.ndarray
         """
-        # Get nonan and nodata mask
-        nodata_free_mask = self._get_nonan_mask(array, nodata_value)
-        self.no_data_location = ~nodata_free_mask
-        # Apply the nonan and nodata mask to the input array
-        array_without_nan = array[np.where(nodata_free_mask)]
-        # Compute mean and std of the input array
-        mu = np.mean(array_without_nan)
-        sigma = np.std(array_without_nan)
-        # Compute the outliers free mask on the input array
-        return np.apply_along_axis(
-            lambda x: (x > mu - 3 * sigma) * (x < mu + 3 * sigma), 0, array
-        )
+        stats_masks = StatsMasks(array, nodata_value)
+        self.no_data_location = stats_masks.no_data_location
+        return stats_masks.outliers_free_mask
 
-    def _create_mode_masks(self, alti_map: xr.Dataset):
+    def _create_mode_masks(
+        self, alti_map: xr.Dataset, nonan_mask: np.ndarray = None
+    ):
         """
         Compute Masks for every required modes :
 
@@ -352,6 +355,9 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
 
                 - image : 2D (row, col) xr.DataArray float32
                 - georef_transform: 1D (trans_len) xr.DataArray
+        :param nonan_mask: nan and nodata free mask of alti_map,
+            computed if None
+        :type nonan_mask: np.ndarray or None
         :return: list of masks, associated modes, and error_img read as array
         :rtype: List[np.ndarray]
         """
@@ -362,11 +368,11 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         # Starting with the 'standard' mask
         mode_names.append("standard")
         # Remove alti_map nodata and nan indices
-        mode_masks.append(
-            self._get_nonan_mask(
+        if nonan_mask is None:
+            nonan_mask = self._get_nonan_mask(
                 alti_map["image"].data, alti_map.attrs["nodata"]
             )
-        )
+        mode_masks.append(nonan_mask)
         # If both sets masks have been defined, compute
         # the cross classification (intersection & exclusion) masks
         if self.classes_masks["ref"] and self.classes_masks["sec"]:
@@ -409,13 +415,7 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :return: nan and nodata_value if exists mask on array.
         :rtype: np.ndarray
         """
-        # If no nodata value is specified, just detect nan values
-        if nodata_value is None:
-            return np.apply_along_axis(lambda x: (~np.isnan(x)), 0, array)
-        # If nodata value is specified, detect both nan and nodata values
-        return np.apply_along_axis(
-            lambda x: (~np.isnan(x)) * (x != nodata_value), 0, array
-        )
+        return compute_nonan_mask(array, nodata_value)
 
     def _compute_mode_stats(
         self,
@@ -424,9 +424,13 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         mode_mask: np.ndarray = None,
         mode_name: str = None,
         metrics: List[Union[dict, str]] = None,
+        class_labels: np.ndarray = None,
     ) -> StatsDataset:
         """
-        Get stats for a specific mode
+        Get stats for a specific mode.
+        If the class labels map is given, the grouped scalar metrics
+        are computed for all the classes at once, the other metrics
+        class by class.
 
         :param dz_values: alti map
         :type dz_values: np.ndarray
@@ -439,6 +443,9 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :type mode_name: str
         :param metrics: metrics to be computed
         :type metrics: List[Union[dict, str]]
+        :param class_labels: class index of each pixel, -1 out of
+            the classes, see _create_class_labels
+        :type class_labels: np.ndarray or None
         :return: StatsDataset with computed metrics (set_name, nbpts,
                  %(out_of_all_pts), max, min, mean, std, rmse, ...)
         :rtype: StatsDataset
@@ -462,63 +469,101 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         else:
             class_masks = self.classes_masks["sec"]
 
+        # Compute the grouped metrics of all the classes at once
+        grouped_results: Dict[str, np.ndarray] = {}
+        class_metrics = metrics
+        nb_grouped_points = None
+        mode_class_labels = None
+        if class_masks is not None and class_labels is not None:
+            # Class index of each pixel of the mode, -1 elsewhere
+            mode_class_labels = np.where(mode_mask, class_labels, -1).astype(
+                class_labels.dtype
+            )
+            (
+                grouped_results,
+                class_metrics,
+                nb_grouped_points,
+            ) = self._grouped_stats_computation(
+                dz_values, mode_class_labels, metrics
+            )
+
         # Compute stats for each class
         if class_masks is not None:
             for idx, (class_name, class_item) in enumerate(
                 self.classes.items()
             ):
-                # Class altitude values
-                # class_alti_values is a 2D matrix
-                class_alti_values = np.where(
-                    (class_masks[idx] * mode_mask), dz_values, np.nan
-                )
-                # flatten the data and remove NaNs values
-                class_alti_values_1d_no_nan = remove_nan_and_flatten(
-                    class_alti_values
-                )
-                # Class outliers free mask
-                class_outliers_free_mask = (
-                    class_masks[idx] * mode_mask * self.outliers_free_mask
-                )
-                # Class outliers free altitude values
-                # class_outliers_free_alti_values is a 2D matrix
-                class_outliers_free_alti_values = np.where(
-                    class_outliers_free_mask, dz_values, np.nan
-                )
-                # Do stats computation and obtain class_stats dictionary
-                class_stats = self.stats_computation(
-                    class_alti_values,
-                    class_outliers_free_alti_values,
-                    metrics,
-                )
-                # Masks altitude values not corresponding to the
-                # class and its mode
-                # and save it as the dz_values stats
-                class_dz_values = copy.deepcopy(dz_values)
-                class_dz_values[
-                    np.where((class_masks[idx] * mode_mask) == 0)
-                ] = np.nan
-                class_stats["dz_values"] = class_dz_values
+                class_stats = {
+                    metric_name: round(float(metric_values[idx]), 5)
+                    for metric_name, metric_values in grouped_results.items()
+                }
+                nb_class_points = None
+                if nb_grouped_points is not None:
+                    nb_class_points = nb_grouped_points[idx]
+                if class_metrics or nb_class_points is None:
+                    # Class altitude values
+                    # class_alti_values is a 2D matrix
+                    class_alti_values = np.where(
+                        (class_masks[idx] * mode_mask), dz_values, np.nan
+                    )
+                    # Class outliers free mask
+                    class_outliers_free_mask = (
+                        class_masks[idx] * mode_mask * self.outliers_free_mask
+                    )
+                    # Class outliers free altitude values
+                    # class_outliers_free_alti_values is a 2D matrix
+                    class_outliers_free_alti_values = np.where(
+                        class_outliers_free_mask, dz_values, np.nan
+                    )
+                    # Do stats computation and obtain class_stats dictionary
+                    class_stats.update(
+                        self.stats_computation(
+                            class_alti_values,
+                            class_outliers_free_alti_values,
+                            class_metrics,
+                        )
+                    )
+                if nb_class_points is None:
+                    # flatten the data and remove NaNs values
+                    nb_class_points = remove_nan_and_flatten(
+                        class_alti_values
+                    ).size
+                    if is_lazy_array(class_alti_values):
+                        # The lazy flattened values have an unknown size
+                        (nb_class_points,) = compute_if_lazy(
+                            np.count_nonzero(~np.isnan(class_alti_values))
+                        )
+                # Keep the input metrics order
+                class_stats = {
+                    metric_name: class_stats[metric_name]
+                    for metric_name in map(self._get_metric_name, metrics)
+                    if metric_name in class_stats
+                }
+                if mode_class_labels is None:
+                    # Masks altitude values not corresponding to the
+                    # class and its mode
+                    # and save it as the dz_values stats
+                    # (np.where does not modify dz_values, that can be lazy)
+                    class_stats["dz_values"] = np.where(
+                        (class_masks[idx] * mode_mask) == 0, np.nan, dz_values
+                    )
                 # Add nbpts value
-                class_stats["nbpts"] = class_alti_values_1d_no_nan.size
+                class_stats["nbpts"] = int(nb_class_points)
                 # Add class name
                 class_stats["class_name"] = class_name + ":" + str(class_item)
                 # Add percent_valid_points value
                 class_stats["percent_valid_points"] = round(
-                    (
-                        100
-                        * class_alti_values_1d_no_nan.size
-                        / float(nb_total_points)
-                    ),
+                    (100 * nb_class_points / float(nb_total_points)),
                     5,
                 )
                 # Add the class_stats dictionary to the stats_list
-                # Need to copy, otherwise the array dz_values is overwritten
-                stats_list.append(copy.deepcopy(class_stats))
+                stats_list.append(class_stats)
 
         # Add the obtained stats on the stats_dataset object
         stats_dataset.add_classif_layer_and_mode_stats(
-            classif_name=self.name, input_stats=stats_list, mode_name=mode_name
+            classif_name=self.name,
+            input_stats=stats_list,
+            mode_name=mode_name,
+            class_labels=mode_class_labels,
         )
         return stats_dataset
 
@@ -540,33 +585,122 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
                 img_to_classify = self.map_image[support]
                 # For each class on the classification layer
                 for _, class_value in self.classes.items():
-                    # Obtain the positions where the map image
-                    # has the class value
-                    if isinstance(class_value, list):
-                        if len(class_value) == 1:
-                            # transform it to value
-                            class_value = class_value[0]
-                    if isinstance(class_value, list):
-                        class_positions = np.where(
-                            np.logical_or(
-                                *[
-                                    np.equal(img_to_classify, label_i)
-                                    for label_i in class_value
-                                ]
-                            )
-                        )
-
-                    else:
-                        class_positions = np.where(
-                            img_to_classify == class_value
-                        )
-                    # Initialize class mask and add class positions to True
-                    mask = np.ones(img_to_classify.shape) * False
-                    mask[class_positions] = True
+                    # The class mask indicates the positions where
+                    # the map image has one of the class values
+                    if not isinstance(class_value, list):
+                        class_value = [class_value]
                     # Add class mask to the support mask
-                    support_masks.append(mask)
+                    support_masks.append(np.isin(img_to_classify, class_value))
                 self.classes_masks[support] = support_masks
 
+    def _create_class_labels(self) -> Union[np.ndarray, None]:
+        """
+        Returns the class index of each pixel in the considered
+        classes masks ("ref" if present, "sec" otherwise),
+        -1 for the pixels out of all the classes.
+        None if a pixel belongs to several classes, their
+        stats being then computed class by class.
+
+        :return: class labels map or None
+        :rtype: np.ndarray or None
+        """
+        if self.classes_masks["ref"]:
+            class_masks = self.classes_masks["ref"]
+        else:
+            class_masks = self.classes_masks["sec"]
+        if not class_masks or is_lazy_array(class_masks[0]):
+            return None
+        # Smallest signed integer type holding the class indexes
+        class_labels = np.full(
+            np.shape(class_masks[0]),
+            -1,
+            dtype=np.min_scalar_type(-len(class_masks) - 1),
+        )
+        for idx, class_mask in enumerate(class_masks):
+            # Classes masks may be numeric, as the fusion ones
+            class_mask = np.asarray(class_mask, dtype=bool)
+            if np.any(class_mask & (class_labels >= 0)):
+                logging.debug(
+                    "Overlapping classes in %s, stats computed per class",
+                    self.name,
+                )
+                return None
+            class_labels[class_mask] = idx
+        return class_labels
+
+    def _grouped_stats_computation(
+        self,
+        dz_values: np.ndarray,
+        label_map: np.ndarray,
+        input_metrics: List[Union[str, Dict]],
+    ) -> Tuple[Dict[str, np.ndarray], List[Union[str, Dict]], np.ndarray]:
+        """
+        Compute the grouped scalar metrics of all the classes at once
+        from the classes label map, the values being grouped once for
+        all the metrics.
+
+        :param dz_values: alti map
+        :type dz_values: np.ndarray
+        :param label_map: class index of each pixel of the mode,
+            negative out of the classes and the mode
+        :type label_map: np.ndarray
+        :param input_metrics: input metrics to use
+        :type input_metrics: List[Union[str, Dict]]
+        :return: metric values of each class by metric name,
+            the remaining metrics to compute class by class and
+            the number of valid points of each class
+        :rtype: Tuple[Dict[str, np.ndarray], List[Union[str, Dict]],
+            np.ndarray]
+        """
+        metrics_plan = self._get_metrics_plan(input_metrics)
+        nb_groups = len(self.classes)
+        grouped_data = GroupedData.from_label_map(
+            dz_values, label_map, nb_groups
+        )
+        outliers_free_grouped_data = None
+        grouped_results = {}
+        for metric_name, metric_object in metrics_plan.metrics.items():
+            if (
+                metric_object.type != "scalar"
+                or not metric_object.GROUPED_COMPATIBLE
+            ):
+                continue
+            # Choose data according to outliers configuration of the metric
+            if metrics_plan.remove_outliers[metric_name]:
+                if outliers_free_grouped_data is None:
+                    outliers_free_grouped_data = GroupedData.from_label_map(
+                        dz_values,
+                        np.where(self.outliers_free_mask, label_map, -1),
+                        nb_groups,
+                    )
+                data = outliers_free_grouped_data
+            else:
+                data = grouped_data
+            grouped_results[metric_name] = metric_object.compute_grouped_metric(
+                data
+            )
+        remaining_metrics = [
+            input_metric
+            for input_metric in input_metrics
+            if self._get_metric_name(input_metric) not in grouped_results
+        ]
+        return grouped_results, remaining_metrics, grouped_data.count
+
+    @staticmethod
+    def _get_metric_name(input_metric: Union[str, Dict]) -> str:
+        """
+        Returns the name of an input metric
+
+        :param input_metric: input metric, its name or a dict
+            with its name as only key
+        :type input_metric: Union[str, Dict]
+        :return: metric name
+        :rtype: str
+        """
+        if isinstance(input_metric, dict):
+            return list(input_metric.keys())[0]
+        return input_metric
+
     @abstractmethod
     def _create_labelled_map(self):
         """
@@ -574,7 +708,7 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :return: None
         """
 
-    def stats_computation(
+    def stats_computation(  # noqa: C901
         self,
         data: np.ndarray,
         outliers_free_data: np.ndarray,
@@ -592,22 +726,46 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :return: dict with computed metric values
         :rtype: Dict
         """
-        # Create metrics and outliers indicator list
-        metrics, remove_outliers_list = self.create_metrics(input_metrics)
+        # Metrics execution plan, parsed once for all the classes
+        metrics_plan = self._get_metrics_plan(input_metrics)
         # Initialize metric results dict
         metric_results: Dict = {}
+        if is_lazy_array(data):
+            # Compute the lazy compatible metrics chunk by chunk,
+            # the remaining metrics are computed in memory
+            (
+                metric_results,
+                data,
+                outliers_free_data,
+            ) = self._lazy_stats_computation(
+                data,
+                outliers_free_data,
+                metrics_plan.metrics,
+                metrics_plan.remove_outliers_list,
+            )
+        # Input arrays shared by the metrics, each computed once:
+        # 2D arrays, 1D flattened arrays without nan, and
+        # whether the 2D arrays are null (same reference and second dems)
+        arrays = {False: data, True: outliers_free_data}
+        arrays_1d: Dict[bool, np.ndarray] = {}
+        null_arrays: Dict[bool, bool] = {}
         # Iterate over each metrics
-        for idx, (metric_name, metric_object) in enumerate(metrics.items()):
+        for metric_name, (
+            remove_outliers,
+            input_type,
+        ) in metrics_plan.inputs.items():
+            if metric_name in metric_results:
+                continue
+            metric_object = metrics_plan.get_metric(metric_name)
             if metric_name == "slope-orientation-histogram":
                 metric_object.dx = self.dx
                 metric_object.dy = self.dy
             # Choose array according to outliers configuration of the metric
-            if remove_outliers_list[idx]:
-                array = outliers_free_data
-            else:
-                array = data
-            # flatten the data and remove NaNs values
-            array_1d_no_nan = remove_nan_and_flatten(array)
+            array = arrays[remove_outliers]
+            if remove_outliers not in arrays_1d:
+                # flatten the data and remove NaNs values
+                arrays_1d[remove_outliers] = remove_nan_and_flatten(array)
+            array_1d_no_nan = arrays_1d[remove_outliers]
             if array_1d_no_nan.size:
                 # Format output list according to the metric type
                 # Round the float results
@@ -618,19 +776,28 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
                     metric_results[metric_name] = round(
                         float(computed_metric), 5
                     )
-                elif metric_object.type == "vector" and not np.all(
-                    np.round(array, decimals=6) == 0
-                ):
-                    if metric_object.input_type == "1D":
+                elif metric_object.type == "vector":
+                    if remove_outliers not in null_arrays:
+                        null_arrays[remove_outliers] = bool(
+                            np.all(np.round(array, decimals=6) == 0)
+                        )
+                    if null_arrays[remove_outliers]:
+                        logging.warning(
+                            "%s is not computed because reference and "
+                            "second DEMs are the same",
+                            metric_name,
+                        )
+                        continue
+                    if input_type == "1D":
                         computed_metric = metric_object.compute_metric(
                             array_1d_no_nan
                         )
-                    elif metric_object.input_type == "2D":
+                    elif input_type == "2D":
                         computed_metric = metric_object.compute_metric(array)
                     else:
                         logging.error(
                             "The metric input type: %s is not implemented",
-                            metric_object.input_type,
+                            input_type,
                         )
                         raise ValueError
                     for idx_vec, _ in enumerate(computed_metric[0]):
@@ -644,14 +811,6 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
                         computed_metric[0],
                         computed_metric[1],
                     )
-                elif metric_object.type == "vector" and np.all(
-                    np.round(array, decimals=6) == 0
-                ):
-                    logging.warning(
-                        "%s is not computed because reference and "
-                        "second DEMs are the same",
-                        metric_name,
-                    )
                 elif metric_object.type == "matrix2D":
                     metric_object.no_data_location = self.no_data_location
                     metric_object.bounds = self.bounds
@@ -665,7 +824,73 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
                     metric_results[metric_name] = (np.nan, np.nan)
                 elif metric_object.type == "matrix2D":
                     metric_results[metric_name] = None
-        return metric_results
+        # Keep the input metrics order
+        return {
+            metric_name: metric_results[metric_name]
+            for metric_name in metrics_plan.metrics
+            if metric_name in metric_results
+        }
+
+    @staticmethod
+    def _lazy_stats_computation(
+        data,
+        outliers_free_data,
+        metrics: Dict[str, Metric],
+        remove_outliers_list: List[bool],
+    ) -> Tuple[Dict, np.ndarray, np.ndarray]:
+        """
+        Compute the lazy compatible scalar metrics of lazy arrays,
+        chunk by chunk: a first pass counts the valid values,
+        a second one computes all the metrics of non empty arrays.
+        If other metrics remain, the arrays are then loaded in memory.
+
+        :param data: 2D lazy input data
+        :type data: dask.array.Array
+        :param outliers_free_data: lazy input outliers_free_data
+        :type outliers_free_data: dask.array.Array
+        :param metrics: metric objects
+        :type metrics: Dict[str, Metric]
+        :param remove_outliers_list: outliers indicator of each metric
+        :type remove_outliers_list: List[bool]
+        :return: dict with computed metric values, data and
+                 outliers_free_data (in memory if other metrics remain)
+        :rtype: Tuple[Dict, np.ndarray, np.ndarray]
+        """
+        nb_valid_data, nb_valid_outliers_free_data = compute_if_lazy(
+            np.count_nonzero(~np.isnan(data)),
+            np.count_nonzero(~np.isnan(outliers_free_data)),
+        )
+        metric_results: Dict = {}
+        lazy_metrics: Dict = {}
+        for idx, (metric_name, metric_object) in enumerate(metrics.items()):
+            if (
+                metric_object.type != "scalar"
+                or not metric_object.LAZY_COMPATIBLE
+            ):
+                continue
+            # Choose array according to outliers configuration of the metric
+            if remove_outliers_list[idx]:
+                array, nb_valid = (
+                    outliers_free_data,
+                    nb_valid_outliers_free_data,
+                )
+            else:
+                array, nb_valid = data, nb_valid_data
+            if nb_valid:
+                lazy_metrics[metric_name] = metric_object.compute_metric(
+                    remove_nan_and_flatten(array)
+                )
+            else:
+                # If the input array is empty, the metric is np.nan
+                metric_results[metric_name] = np.nan
+        # Compute all the metrics in a single pass
+        for metric_name, computed_metric in zip(
+            lazy_metrics, compute_if_lazy(*lazy_metrics.values())
+        ):
+            metric_results[metric_name] = round(float(computed_metric), 5)
+        if len(metric_results) < len(metrics):
+            data, outliers_free_data = compute_if_lazy(data, outliers_free_data)
+        return metric_results, data, outliers_free_data
 
     def save_map_img(self, map_img: np.ndarray, map_support: str):
         """
@@ -677,7 +902,14 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         :type map_support: str
         :return: None
         """
-
+        # Replace the nodata label of the classification layers
+        # by the output nodata
+        if np.issubdtype(map_img.dtype, np.integer):
+            map_img = np.where(
+                map_img == get_classification_layer_nodata(map_img.dtype),
+                self.nodata,
+                map_img,
+            )
         map_dataset = create_dem(
             map_img,
             self.dem.georef_transform.data,
@@ -687,4 +919,9 @@ class ClassificationLayerTemplate(metaclass=ABCMeta):
         map_path = os.path.join(
             self._stats_dir, map_support + "_rectified_support_map.tif"
         )
-        save_dem(map_dataset, map_path, nodata=self.nodata)
+        save_dem(
+            map_dataset,
+            map_path,
+            nodata=self.nodata,
+            output_profile=self.output_profile,
+        )
@@ -107,6 +107,7 @@ class FusionClassificationLayer(ClassificationLayerTemplate):
         cfg: Dict = {}
         cfg["remove_outliers"] = self.classification_layers[0].remove_outliers
         cfg["output_dir"] = self.classification_layers[0].output_dir
+        cfg["output_profile"] = self.classification_layers[0].output_profile
         cfg["type"] = "fusion"
         cfg["nodata"] = self.classification_layers[0].nodata
         # If metrics have been defined, add them
@@ -114,6 +115,7 @@ class FusionClassificationLayer(ClassificationLayerTemplate):
 
         self.schema = {
             "output_dir": Or(str, None),
+            "output_profile": Or(dict, None),
             "nodata": Or(float, int),
             "type": "fusion",
             "metrics": list,
@@ -134,9 +136,9 @@ class FusionClassificationLayer(ClassificationLayerTemplate):
         map_fusion = np.ones(dems_shape) * self.nodata
         for idx, (_, class_item) in enumerate(self.classes.items()):
             # Fill fusion map with classes masks
-            map_fusion[np.where(self.classes_masks[self.support][idx])] = (
-                class_item
-            )
+            map_fusion[
+                np.where(self.classes_masks[self.support][idx])
+            ] = class_item
         # Add map_fusion on the map_image
         self.map_image[self.support] = map_fusion
         # Save results
@@ -167,7 +169,7 @@ class FusionClassificationLayer(ClassificationLayerTemplate):
             # Iterate over all combined layers
             for combi in all_combi_labels:
                 # Initialize new layer mask
-                masks = np.ones(dems_shape) * True
+                masks = np.ones(dems_shape, dtype=bool)
                 for elm in combi:
                     layer_name = elm[0]
                     label_idx = elm[1]
@@ -177,7 +179,7 @@ class FusionClassificationLayer(ClassificationLayerTemplate):
 
                     # Resulting mask is the superposition of
                     # all combined layer's mask
-                    masks = masks * class_mask
+                    masks = np.logical_and(masks, class_mask)
 
                 # Append new classe's support mask
                 support_masks.append(masks)
@@ -23,7 +23,11 @@ Init file for coregistration module.
 Imports are used to simplify calls to module API Coregistration.
 """
 # Demcompare imports
-from . import nuth_kaab_internal
+from . import nuth_kaab_internal, phase_correlation
 from .coregistration import Coregistration
 
-__all__ = ["nuth_kaab_internal", "Coregistration"]  # To avoid flake8 F401
+__all__ = [
+    "nuth_kaab_internal",
+    "phase_correlation",
+    "Coregistration",
+]  # To avoid flake8 F401
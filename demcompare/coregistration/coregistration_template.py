@@ -23,12 +23,13 @@ This module contains the coregistration class template.
 It contains the structure for all coregistration methods in subclasses and
 generic coregistration code to avoid duplication.
 """
+# pylint:disable=too-many-lines
 
 # Standard imports
 import logging
 import os
 from abc import ABCMeta, abstractmethod
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Union
 
 # Third party imports
 import numpy as np
@@ -36,14 +37,20 @@ import xarray as xr
 from json_checker import And, Checker, Or
 
 # Demcompare imports
+from ..dataset_tools import get_classification_layer_nodata
 from ..dem_tools import (
+    DEFAULT_NODATA,
     SamplingSourceParameter,
+    compute_dem_slope,
     copy_dem,
+    create_dem,
+    plan_dems_reprojection,
     reproject_dems,
     save_dem,
 )
-from ..img_tools import compute_gdal_translate_bounds
+from ..img_tools import compute_gdal_translate_bounds, shift_image
 from ..internal_typing import ConfigType
+from ..output_writer import OutputWriter, write_output
 from ..transformation import Transformation
 
 
@@ -80,12 +87,23 @@ class CoregistrationTemplate(metaclass=ABCMeta):
            y shift. int or float. 0 by default,
          "output_dir": optional output directory. str. If given,
            the coreg_sec is saved,
+         "output_profile": optional output GeoTIFF profile. dict.
+           See img_tools.get_output_creation_options,
          "save_optional_outputs": optional. bool. Requires output_dir
            to be set. If activated, the outputs of the coregistration method
            (such as nuth et kaab iteration plots) are saved and the internal
            dems of the coregistration
            such as reproj_dem, reproj_ref, reproj_coreg_sec,
            reproj_coreg_ref are saved.
+         "stable_terrain": optional. dict. Stable terrain mask of the
+           pixels used to estimate the coregistration, None by default
+           for all the valid pixels. See compute_stable_terrain_mask:
+           {
+            "classification_layers": optional. dict. Classification
+              layer name -> list of its stable labels,
+            "slope_range": optional. [min, max[ sec slope range,
+              in the slope classification layer unit
+           }
         }
 
         :param cfg: configuration {'method_name': value}
@@ -94,6 +112,9 @@ class CoregistrationTemplate(metaclass=ABCMeta):
 
         # Original sec
         self.orig_sec: xr.Dataset = None
+        # Original sec full raster georef transform and shape,
+        # as the loaded orig_sec may only be an input ROI window
+        self.orig_sec_raster: Tuple[np.ndarray, Tuple[int, int]] = None
         # Reprojected and cropped dem to align
         self.reproj_sec: xr.Dataset = None
         # Reprojected and cropped ref
@@ -132,6 +153,10 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         self.save_optional_outputs = self.cfg["save_optional_outputs"]
         # Output directory to save results
         self.output_dir = self.cfg["output_dir"]
+        # Output GeoTIFF profile
+        self.output_profile = self.cfg["output_profile"]
+        # Stable terrain mask configuration
+        self.stable_terrain = self.cfg["stable_terrain"]
 
         if self.output_dir is not None:
             # create coreg module output directory if given in configuration
@@ -166,6 +191,10 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         if "save_optional_outputs" not in cfg:
             cfg["save_optional_outputs"] = self._SAVE_OPTIONAL_OUTPUTS
 
+        if "output_profile" not in cfg:
+            cfg["output_profile"] = None
+        if "stable_terrain" not in cfg:
+            cfg["stable_terrain"] = None
         if "output_dir" not in cfg:
             cfg["output_dir"] = None
             if cfg["save_optional_outputs"]:
@@ -189,10 +218,53 @@ class CoregistrationTemplate(metaclass=ABCMeta):
             "estimated_initial_shift_y": Or(int, float),
             "method_name": And(str, lambda input: "nuth_kaab_internal"),
             "output_dir": Or(str, None),
+            "output_profile": Or(dict, None),
             "save_optional_outputs": bool,
+            "stable_terrain": Or(dict, None),
         }
+        if cfg["stable_terrain"] is not None:
+            self.check_stable_terrain(cfg["stable_terrain"])
         return cfg
 
+    @staticmethod
+    def check_stable_terrain(stable_terrain_cfg: Dict) -> None:
+        """
+        Verify users configuration of the stable terrain mask
+
+        :param stable_terrain_cfg: stable terrain configuration
+        :type stable_terrain_cfg: Dict
+        :return: None
+        """
+        unknown_keys = set(stable_terrain_cfg) - {
+            "classification_layers",
+            "slope_range",
+        }
+        if unknown_keys:
+            raise ValueError(
+                f"Unknown stable_terrain parameters: {sorted(unknown_keys)}"
+            )
+        layers = stable_terrain_cfg.get("classification_layers", {})
+        if not isinstance(layers, dict) or not all(
+            isinstance(labels, list)
+            and all(isinstance(label, int) for label in labels)
+            for labels in layers.values()
+        ):
+            raise TypeError(
+                "Stable terrain classification_layers must map each layer"
+                " name to a list of int labels"
+            )
+        if "slope_range" in stable_terrain_cfg:
+            slope_range = stable_terrain_cfg["slope_range"]
+            if (
+                not isinstance(slope_range, list)
+                or len(slope_range) != 2
+                or slope_range[0] >= slope_range[1]
+            ):
+                raise ValueError(
+                    "Stable terrain slope_range must be a [min, max] list"
+                    " with min < max"
+                )
+
     def check_conf(self, cfg: ConfigType = None):
         """
         Check if the config is correct according
@@ -247,6 +319,17 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         logging.debug("Input Coregistration REF: %s", ref.attrs["input_img"])
         # Store the original sec prior to reprojection
         self.orig_sec = copy_dem(sec)
+        if sec.attrs.get("source_rasterio"):
+            src_sec = sec.attrs["source_rasterio"]["source_dem"]
+            self.orig_sec_raster = (
+                np.array(src_sec.transform.to_gdal()),
+                src_sec.shape,
+            )
+
+        # Plan the reprojection from the dems geometry only,
+        # before reading nor warping any pixel
+        plan = plan_dems_reprojection(sec, ref, self.sampling_source)
+        logging.debug("Planned coregistration DEMs shape: %s", plan["shape"])
 
         # Reproject and crop DEMs
         (
@@ -259,7 +342,12 @@ class CoregistrationTemplate(metaclass=ABCMeta):
             self.estimated_initial_shift_x,
             self.estimated_initial_shift_y,
             self.sampling_source,
+            plan,
         )
+        # The coregistration algorithms work on in-memory dems,
+        # lazy dems are only loaded once reprojected and cropped
+        self.reproj_sec = self.reproj_sec.compute()
+        self.reproj_ref = self.reproj_ref.compute()
         return (
             self.reproj_sec,
             self.reproj_ref,
@@ -271,6 +359,7 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         self,
         sec: xr.Dataset,
         ref: xr.Dataset,
+        output_writer: OutputWriter = None,
     ) -> Transformation:
         """
         Reproject and compute coregistration between the two input DEMs.
@@ -289,6 +378,9 @@ class CoregistrationTemplate(metaclass=ABCMeta):
                 - georef_transform: 1D (trans_len) xr.DataArray
                 - classification_layer_masks : 3D (row, col, indicator)
                   xr.DataArray
+        :param output_writer: optional output writer writing the
+            internal dems in the background
+        :type output_writer: OutputWriter or None
         :return: transformation
         :rtype: Transformation
         """
@@ -316,7 +408,7 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         self.save_results_dict()
         # Save internal_dems if the option was chosen
         if self.save_optional_outputs:
-            self.save_internal_outputs()
+            self.save_internal_outputs(output_writer)
 
         # Return the transform
         return self.transform
@@ -356,7 +448,260 @@ class CoregistrationTemplate(metaclass=ABCMeta):
         :rtype: Tuple[Transformation, xr.Dataset, xr.Dataset]
         """
 
-    def save_internal_outputs(self):
+    def compute_stable_terrain_mask(
+        self, sec: xr.Dataset, ref: xr.Dataset
+    ) -> Union[np.ndarray, None]:
+        """
+        Computes the stable terrain mask of the reprojected dems from
+        the stable_terrain configuration, None if not configured.
+
+        A pixel is stable if, for each configured classification
+        layer, its label is one of the layer stable labels, and if
+        the sec slope is in the slope_range. The classification layers
+        are taken from sec, or from ref if sec does not have them.
+        The mask is defined on the sec grid, the ref layers
+        not being shifted by the estimated offsets.
+
+        :param sec: reprojected sec xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type sec: xarray Dataset
+        :param ref: reprojected ref xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type ref: xarray Dataset
+        :return: stable terrain boolean mask or None
+        :rtype: np.ndarray or None
+        """
+        if self.stable_terrain is None:
+            return None
+        stable_mask = np.ones(sec["image"].shape, dtype=bool)
+        for layer_name, labels in self.stable_terrain.get(
+            "classification_layers", {}
+        ).items():
+            for dem in (sec, ref):
+                if "indicator" in dem.coords and layer_name in list(
+                    dem.coords["indicator"].data
+                ):
+                    layer = dem["classification_layer_masks"].sel(
+                        indicator=layer_name
+                    )
+                    stable_mask &= np.isin(layer.data, labels)
+                    break
+            else:
+                raise ValueError(
+                    f"Stable terrain classification layer {layer_name}"
+                    " is not a classification layer of the input dems"
+                )
+        if "slope_range" in self.stable_terrain:
+            slope_min, slope_max = self.stable_terrain["slope_range"]
+            slope = compute_dem_slope(sec, add_attribute=False)
+            stable_mask &= (slope >= slope_min) & (slope < slope_max)
+
+        logging.info(
+            "Stable terrain: %.2f %% of the coregistration pixels",
+            100 * np.count_nonzero(stable_mask) / stable_mask.size,
+        )
+        if not stable_mask.any():
+            raise ValueError(
+                "The stable terrain mask of the coregistration is empty"
+            )
+        return stable_mask
+
+    def create_coregistered_dems(  # pylint:disable=too-many-arguments
+        self,
+        sec: xr.Dataset,
+        ref: xr.Dataset,
+        coreg_sec: np.ndarray,
+        coreg_ref: np.ndarray,
+        x_offset: float,
+        y_offset: float,
+    ) -> Tuple[xr.Dataset, xr.Dataset]:
+        """
+        Creates the reprojected coregistered dems datasets from the
+        coregistered images, sec cropped and ref shifted and cropped
+        with the offsets, see crop_dem_with_offset.
+        The ref classification layers are shifted and cropped,
+        the sec ones are cropped.
+
+        :param sec: reprojected sec xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type sec: xarray Dataset
+        :param ref: reprojected ref xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type ref: xarray Dataset
+        :param coreg_sec: coregistered sec image
+        :type coreg_sec: np.ndarray
+        :param coreg_ref: coregistered ref image
+        :type coreg_ref: np.ndarray
+        :param x_offset: x offset in pixels
+        :type x_offset: float
+        :param y_offset: y offset in pixels, north oriented
+        :type y_offset: float
+        :return: coreg_sec_dataset, coreg_ref_dataset
+        :rtype: Tuple[xr.Dataset, xr.Dataset]
+        """
+        # Initialize coregistered classification layers
+        coreg_ref_classif = None
+        coreg_sec_classif = None
+        # If classification layers in ref, interpolate and crop them
+        # To have the same modifications as ref
+        if "indicator" in ref.coords:
+            coreg_ref_classif = self.interpolate_classif_layers(
+                ref.classification_layer_masks, x_offset, y_offset
+            )
+            coreg_ref_classif = self.crop_classif_layers(
+                coreg_ref_classif, x_offset, y_offset
+            )
+        if "indicator" in sec.coords:
+            coreg_sec_classif = self.crop_classif_layers(
+                sec.classification_layer_masks, x_offset, y_offset
+            )
+
+        reproj_bounds = compute_gdal_translate_bounds(
+            y_offset,
+            x_offset,
+            (coreg_sec.shape[0], coreg_sec.shape[1]),
+            sec.georef_transform.data,
+        )
+
+        # Generate the dataset dems
+        coreg_sec_dataset = create_dem(
+            coreg_sec,
+            transform=sec.georef_transform.data,
+            nodata=DEFAULT_NODATA,
+            img_crs=sec.crs,
+            classification_layer_masks=coreg_sec_classif,
+            bounds=reproj_bounds,
+        )
+        coreg_ref_dataset = create_dem(
+            coreg_ref,
+            transform=sec.georef_transform.data,
+            nodata=DEFAULT_NODATA,
+            img_crs=sec.crs,
+            classification_layer_masks=coreg_ref_classif,
+            bounds=reproj_bounds,
+        )
+        return coreg_sec_dataset, coreg_ref_dataset
+
+    @staticmethod
+    def interpolate_classif_layers(
+        dem_classif: xr.DataArray,
+        x_offset: float,
+        y_offset: float,
+    ) -> xr.DataArray:
+        """
+        interpolates the classification layers with the input offsets.
+        As the layers are labels, each pixel takes the label of its
+        nearest shifted pixel, the nodata label outside of the layers.
+        All the layers are shifted in one call, the input layers
+        are left unchanged.
+
+        :param dem_classif: input classification layers
+        :type dem_classif: xr.Dataarray
+        :param x_offset: x offset
+        :type x_offset: float
+        :param y_offset: y offset
+        :type y_offset: float
+        :return: interpolated classification layers
+        :rtype: xr.Dataarray
+        """
+        return dem_classif.copy(
+            data=shift_image(
+                dem_classif.data,
+                x_offset,
+                -y_offset,
+                "nearest",
+                fill_value=get_classification_layer_nodata(dem_classif.dtype),
+            )
+        )
+
+    @staticmethod
+    def crop_dem_with_offset(
+        dem: np.ndarray, x_offset: float, y_offset: float
+    ) -> np.ndarray:
+        """
+        Crops the input dem with the given offsets.
+        The crop is a view on the input dem.
+
+        :param dem: input dem image, or (row, col, indicator)
+            classification layers
+        :type dem: np.ndarray
+        :param x_offset: x offset
+        :type x_offset: float
+        :param y_offset: y offset
+        :type y_offset: float
+        :return: cropped dem
+        :rtype: np.ndarray
+        """
+        # Crop DEMs with offset
+        if x_offset >= 0:
+            cropped_dem = dem[:, 0 : dem.shape[1] - int(np.ceil(x_offset))]
+
+        else:
+            cropped_dem = dem[:, int(np.floor(-x_offset)) : dem.shape[1]]
+
+        if -y_offset >= 0:
+            cropped_dem = cropped_dem[
+                0 : dem.shape[0] - int(np.ceil(-y_offset)), :
+            ]
+
+        else:
+            cropped_dem = cropped_dem[int(np.floor(y_offset)) : dem.shape[0], :]
+
+        return cropped_dem
+
+    def crop_classif_layers(
+        self, dem_classif: xr.DataArray, x_offset, y_offset
+    ) -> xr.DataArray:
+        """
+        crop_classif_layers crops and updates the input classification layers
+        with the input offsets. The cropped layers are a view on the
+        input layers cube, with updated row and col coordinates.
+
+        :param dem_classif: classification layers
+        :type dem_classif: xr.Dataarray
+        :param x_offset: x offset
+        :type x_offset: float
+        :param y_offset: y offset
+        :type y_offset: float
+        :return: cropped classification layers
+        :rtype: xr.Dataarray
+        """
+        # All the layers are cropped at once on the row and col axes
+        cropped_classif = self.crop_dem_with_offset(
+            dem_classif.data, x_offset, y_offset
+        )
+        # Initialize new cropped classif coordinates
+        coords_classification_layers = {
+            "row": np.arange(cropped_classif.shape[0]),
+            "col": np.arange(cropped_classif.shape[1]),
+            "indicator": list(dem_classif.coords["indicator"].data),
+        }
+        # Create new xarray with the cropped classif
+        cropped_classifs = xr.DataArray(
+            data=cropped_classif,
+            coords=coords_classification_layers,
+            dims=["row", "col", "indicator"],
+        )
+
+        return cropped_classifs
+
+    def save_internal_outputs(self, output_writer: OutputWriter = None):
         """
         Save the dems obtained from the coregistration to .tif
         and updates its path on the coregistration_results file
@@ -369,33 +714,33 @@ class CoregistrationTemplate(metaclass=ABCMeta):
           coregistered ref
         - ./coregistration/coreg_sec.tif -> coregistered ref
 
+        :param output_writer: optional output writer writing the dems
+            in the background, written directly if None
+        :type output_writer: OutputWriter or None
         :return: None
         """
-        # Saves reprojected DEM to file system
-        self.reproj_sec = save_dem(
-            self.reproj_sec,
-            os.path.join(self.output_dir, "reproj_SEC.tif"),
-        )
-        # Saves reprojected REF to file system
-        self.reproj_ref = save_dem(
-            self.reproj_ref,
-            os.path.join(self.output_dir, "reproj_REF.tif"),
-        )
-        # Saves reprojected coregistered DEM to file system
-        self.reproj_coreg_sec = save_dem(
-            self.reproj_coreg_sec,
-            os.path.join(self.output_dir, "reproj_coreg_SEC.tif"),
-        )
-        # Saves reprojected coregistered REF to file system
-        self.reproj_coreg_ref = save_dem(
-            self.reproj_coreg_ref,
-            os.path.join(self.output_dir, "reproj_coreg_REF.tif"),
-        )
-        # Save the coregistered DEM
-        self.coreg_sec = save_dem(
-            self.coreg_sec,
-            os.path.join(self.output_dir, "coreg_SEC.tif"),
-        )
+        # Saves the internal dems to file system, their path
+        # is updated before a possible background writing
+        for dem, file_name in [
+            # reprojected DEM
+            (self.reproj_sec, "reproj_SEC.tif"),
+            # reprojected REF
+            (self.reproj_ref, "reproj_REF.tif"),
+            # reprojected coregistered DEM
+            (self.reproj_coreg_sec, "reproj_coreg_SEC.tif"),
+            # reprojected coregistered REF
+            (self.reproj_coreg_ref, "reproj_coreg_REF.tif"),
+            # coregistered DEM
+            (self.coreg_sec, "coreg_SEC.tif"),
+        ]:
+            dem.attrs["input_img"] = os.path.join(self.output_dir, file_name)
+            write_output(
+                output_writer,
+                save_dem,
+                dem,
+                dem.attrs["input_img"],
+                output_profile=self.output_profile,
+            )
         # Update path on coregistration_results file
         if self.coregistration_results:
             self.coregistration_results["coregistration_results"][
@@ -512,11 +857,16 @@ class CoregistrationTemplate(metaclass=ABCMeta):
 
         # -> for the coordinate bounds to apply the offsets
         #    to the original DSM with GDAL
+        if self.orig_sec_raster is not None:
+            orig_georef_transform, orig_shape = self.orig_sec_raster
+        else:
+            orig_georef_transform = self.orig_sec["georef_transform"].data
+            orig_shape = self.orig_sec["image"].shape
         ulx, uly, lrx, lry = compute_gdal_translate_bounds(
             self.transform.y_offset,
             self.transform.x_offset,
-            (self.orig_sec["image"].shape[0], self.orig_sec["image"].shape[1]),
-            self.orig_sec["georef_transform"].data,
+            (orig_shape[0], orig_shape[1]),
+            orig_georef_transform,
         )
         self.coregistration_results["coregistration_results"][
             "gdal_translate_bounds"
@@ -33,23 +33,23 @@ License : MIT
 # Standard imports
 import logging
 import os
-from typing import Tuple, Union
+import time
+from typing import Dict, Tuple, Union
 
 # Third party imports
 import matplotlib.pyplot as pl
 import numpy as np
 import xarray as xr
-from json_checker import And
-from scipy.interpolate import RectBivariateSpline
+from json_checker import And, Or
 from scipy.optimize import leastsq
 
 # Demcompare imports
-from ..dem_tools import DEFAULT_NODATA, create_dem
-from ..img_tools import compute_gdal_translate_bounds
+from ..img_tools import compute_block_mean, shift_image
 from ..internal_typing import ConfigType
 from ..transformation import Transformation
 from .coregistration import Coregistration
 from .coregistration_template import CoregistrationTemplate
+from .phase_correlation import estimate_phase_correlation_offsets
 
 
 @Coregistration.register("nuth_kaab_internal")
@@ -61,6 +61,18 @@ class NuthKaabInternal(CoregistrationTemplate):
 
     # Default parameters in case they are not specified in the cfg
     DEFAULT_ITERATIONS = 6
+    DEFAULT_SHIFT_METHOD = "bilinear"
+    DEFAULT_PYRAMID_LEVELS = 0
+    DEFAULT_PYRAMID_ITERATIONS = 2
+    DEFAULT_PYRAMID_FINAL_ITERATIONS = 2
+    # Minimum size in pixels of the pyramid coarsest level dems
+    PYRAMID_MIN_SIZE = 32
+    # Seed of the fit pixels samples, drawn among FIT_SAMPLE_OVERSAMPLING
+    # times max_fit_points uniformly drawn candidates
+    FIT_SAMPLE_SEED = 0
+    FIT_SAMPLE_OVERSAMPLING = 4
+    # Sub-pixel shift methods of the dem resampling
+    SHIFT_METHODS = ["bilinear", "bicubic", "fourier"]
     # Method name
     method_name = "nuth_kaab_internal"
 
@@ -72,7 +84,31 @@ class NuthKaabInternal(CoregistrationTemplate):
 
         coregistration = {
          "method_name": coregistration class name. str,
-         "number_of_iterations": number of iterations. int,
+         "number_of_iterations": maximum number of iterations. int,
+         "convergence_tolerance": optional. the iterations stop when
+           the iteration shift is below this tolerance in pixels.
+           float. None (no tolerance) by default,
+         "nmad_gain_tolerance": optional. the iterations stop when the
+           NMAD decrease is below this tolerance in percent of the
+           previous NMAD. float. None (no tolerance) by default,
+         "shift_method": optional. sub-pixel shift method of the dem
+           resampling at each iteration. str "bilinear" (default),
+           "bicubic" or "fourier". See img_tools.shift_image,
+         "pyramid_levels": optional. number of coarse levels, each
+           one decimated by 2, on which the offset is estimated from
+           the coarsest to the finest before the full resolution
+           iterations. int. 0 (no pyramid) by default,
+         "pyramid_iterations": optional. number of iterations on each
+           pyramid coarse level. int. 2 by default,
+         "pyramid_final_iterations": optional. number of full resolution
+           iterations after the pyramid levels, at most
+           number_of_iterations. int. 2 by default,
+         "phase_correlation_init": optional. if True, the offsets are
+           initialized by FFT phase correlation before the pyramid
+           and the iterations. bool. False by default,
+         "max_fit_points": optional. maximum number of pixels, sampled
+           by aspect slices, of each iteration fit and statistics.
+           int. None (all the pixels) by default,
          "sampling_source": optional. sampling source at which
            the dems are reprojected prior to coregistration. str
            "sec" (default) or "ref",
@@ -82,12 +118,18 @@ class NuthKaabInternal(CoregistrationTemplate):
            y shift. int or float. 0 by default,
          "output_dir": optional output directory. str. If given,
            the coreg_sec is saved,
+         "output_profile": optional output GeoTIFF profile. dict.
+           See img_tools.get_output_creation_options,
          "save_optional_outputs": optional. bool. Requires output_dir
            to be set. If activated, the outputs of the coregistration method
            (such as nuth et kaab iteration plots) are saved and
            the internal dems of the coregistration
            such as reproj_dem, reproj_ref, reproj_coreg_sec,
            reproj_coreg_ref, initial_dh and final_dh are saved.
+         "stable_terrain": optional. dict. Stable terrain mask of the
+           pixels of the iterations fit, statistics and final
+           altimetric offset. None (all the pixels) by default.
+           See CoregistrationTemplate.compute_stable_terrain_mask,
         }
 
         :param cfg: configuration
@@ -97,8 +139,25 @@ class NuthKaabInternal(CoregistrationTemplate):
         super().__init__(cfg)
         # Number of iterations specific to Nuth et kaab internal algorithm
         self.iterations = self.cfg["number_of_iterations"]
+        # Sub-pixel shift method of the dem resampling
+        self.shift_method = self.cfg["shift_method"]
+        # Coarse to fine pyramid levels and iterations per level
+        self.pyramid_levels = self.cfg["pyramid_levels"]
+        self.pyramid_iterations = self.cfg["pyramid_iterations"]
+        self.pyramid_final_iterations = self.cfg["pyramid_final_iterations"]
+        # Phase correlation offsets initialization
+        self.phase_correlation_init = self.cfg["phase_correlation_init"]
+        # Maximum number of pixels of each iteration fit
+        self.max_fit_points = self.cfg["max_fit_points"]
+        # Iterations convergence tolerances
+        self.convergence_tolerance = self.cfg["convergence_tolerance"]
+        self.nmad_gain_tolerance = self.cfg["nmad_gain_tolerance"]
+        # Per iteration results and stop reason of the iterations
+        self.convergence_results: Dict = {}
         # Aspect bounds for the Nuth et kaab internal algorithm
         self.aspect_bounds: Union[np.ndarray, None] = None
+        # Stable terrain mask of the reprojected dems, None for all
+        self.stable_mask: Union[np.ndarray, None] = None
 
     def fill_conf_and_schema(self, cfg: ConfigType = None) -> ConfigType:
         """
@@ -119,11 +178,47 @@ class NuthKaabInternal(CoregistrationTemplate):
             cfg["method_name"] = self.method_name
         if "number_of_iterations" not in cfg:
             cfg["number_of_iterations"] = self.DEFAULT_ITERATIONS
+        if "shift_method" not in cfg:
+            cfg["shift_method"] = self.DEFAULT_SHIFT_METHOD
+        if "pyramid_levels" not in cfg:
+            cfg["pyramid_levels"] = self.DEFAULT_PYRAMID_LEVELS
+        if "pyramid_iterations" not in cfg:
+            cfg["pyramid_iterations"] = self.DEFAULT_PYRAMID_ITERATIONS
+        if "pyramid_final_iterations" not in cfg:
+            cfg[
+                "pyramid_final_iterations"
+            ] = self.DEFAULT_PYRAMID_FINAL_ITERATIONS
+        if "phase_correlation_init" not in cfg:
+            cfg["phase_correlation_init"] = False
+        if "max_fit_points" not in cfg:
+            cfg["max_fit_points"] = None
+        if "convergence_tolerance" not in cfg:
+            cfg["convergence_tolerance"] = None
+        if "nmad_gain_tolerance" not in cfg:
+            cfg["nmad_gain_tolerance"] = None
 
         # Add subclass parameter to the default schema
         self.schema["number_of_iterations"] = And(
             int, lambda input: input < 16, lambda input: input > 0
         )
+        self.schema["shift_method"] = And(
+            str, lambda input: input in self.SHIFT_METHODS
+        )
+        self.schema["pyramid_levels"] = And(int, lambda input: 0 <= input < 8)
+        self.schema["pyramid_iterations"] = And(
+            int, lambda input: input < 16, lambda input: input > 0
+        )
+        self.schema["pyramid_final_iterations"] = And(
+            int, lambda input: input < 16, lambda input: input > 0
+        )
+        self.schema["phase_correlation_init"] = bool
+        self.schema["max_fit_points"] = And(
+            Or(int, None), lambda input: input is None or input > 0
+        )
+        self.schema["convergence_tolerance"] = And(
+            Or(int, float, None), lambda input: input is None or input >= 0
+        )
+        self.schema["nmad_gain_tolerance"] = Or(int, float, None)
         return cfg
 
     def _coregister_dems_algorithm(  # pylint:disable=too-many-locals
@@ -161,7 +256,7 @@ class NuthKaabInternal(CoregistrationTemplate):
         :rtype: Tuple[Transformation, xr.Dataset, xr.Dataset]
         """
         # create nuth and kaab optional output for algorithm detailed options
-        if self.save_optional_outputs and self.output_dir:
+        if self._save_plots():
             os.makedirs(
                 os.path.join(self.output_dir, "nuth_kaab_tmp_dir"),
                 exist_ok=True,
@@ -170,55 +265,245 @@ class NuthKaabInternal(CoregistrationTemplate):
         # Copy dataset and extract image array
         sec_im = sec["image"].data
         ref_im = ref["image"].data
+        # The dem shifted at each iteration, kept apart from
+        # coreg_ref which is unbiased in place
+        interp_ref_im = ref_im.astype(np.float64)
+
+        # Compute inital_dh, median, nmad and initial elevation
+        # difference plot, only used by the plots
+        if self._save_plots():
+            initial_dh = ref_im - sec_im
+            _, nmad_old = self._compute_median_nmad(initial_dh)
+            self._save_elevation_diff_plot(
+                initial_dh, nmad_old, "ElevationDiff_BeforeCoreg.png"
+            )
+        # Compute bounds for different aspect slices
+        self.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
+        # Only the stable terrain pixels are used to estimate the offsets
+        self.stable_mask = self.compute_stable_terrain_mask(sec, ref)
+        self.convergence_results = {"iterations": [], "stop_reason": None}
+        # Initialize offsets by phase correlation if asked, then
+        # estimated from coarse to fine on the pyramid levels if any
+        x_offset, y_offset = 0.0, 0.0
+        if self.phase_correlation_init:
+            x_offset, y_offset = estimate_phase_correlation_offsets(
+                (
+                    sec_im
+                    if self.stable_mask is None
+                    else np.where(self.stable_mask, sec_im, np.nan)
+                ),
+                ref_im,
+            )
+            logging.debug(
+                "Nuth & Kaab phase correlation initial offset in pixels : "
+                "( %.2f , %.2f )",
+                x_offset,
+                y_offset,
+            )
+        x_offset, y_offset = self._estimate_pyramid_offsets(
+            sec_im, interp_ref_im, (x_offset, y_offset)
+        )
+        # The pyramid offset only needs a few full resolution iterations
+        iterations = self.iterations
+        if self._get_pyramid_levels(sec_im.shape) > 0:
+            iterations = min(self.iterations, self.pyramid_final_iterations)
+        logging.debug("Nuth & Kaab iterations: %s", iterations)
+        (
+            x_offset,
+            y_offset,
+            coreg_sec,
+            coreg_ref,
+        ) = self._nuth_kaab_iterations(
+            sec_im,
+            ref_im,
+            interp_ref_im,
+            (x_offset, y_offset),
+            iterations,
+            plot_name="nuth_kaab_iter",
+        )
 
-        # Set target dem grid for interpolation purpose
-        xgrid = np.arange(sec_im.shape[1])
-        ygrid = np.arange(sec_im.shape[0])
-        # Set spline interpolation
-        spline_1, spline_2 = self.interpolate_dem_on_grid(ref_im, xgrid, ygrid)
+        # Generate the dataset dems
+        coreg_sec_dataset, coreg_ref_dataset = self.create_coregistered_dems(
+            sec, ref, coreg_sec, coreg_ref, x_offset, y_offset
+        )
+        logging.debug(
+            "Nuth & Kaab Final Offset in pixels (east, north): ( %.2f , %.2f )",
+            x_offset,
+            y_offset,
+        )
+        # Display
+        final_dh = coreg_ref - coreg_sec
+        if self._save_plots():
+            _, nmad_new = self._compute_median_nmad(final_dh)
+            self._save_elevation_diff_plot(
+                final_dh, nmad_new, "ElevationDiff_AfterCoreg.png"
+            )
+        z_offset = float(
+            np.nanmean(self._mask_unstable(final_dh, x_offset, y_offset))
+        )
+        transform = Transformation(
+            x_offset=x_offset,
+            y_offset=-y_offset,  # -y_offset because y_offset
+            # from nk is north oriented
+            z_offset=z_offset,
+            estimated_initial_shift_x=self.estimated_initial_shift_x,
+            estimated_initial_shift_y=self.estimated_initial_shift_y,
+            adapting_factor=self.adapting_factor,
+        )
+        return transform, coreg_sec_dataset, coreg_ref_dataset
 
-        # Compute inital_dh and initialize ref
-        initial_dh = ref_im - sec_im
-        coreg_ref = ref_im
+    def _estimate_pyramid_offsets(
+        self,
+        sec_im: np.ndarray,
+        interp_ref_im: np.ndarray,
+        offsets: Tuple[float, float] = (0.0, 0.0),
+    ) -> Tuple[float, float]:
+        """
+        Estimates the Nuth & Kaab offsets from the coarsest to the
+        finest pyramid level, each level being the dems block averaged
+        by a factor 2 more than the finer one. The offset estimated on
+        a level initializes the iterations of the finer one.
+        The levels whose dems would be smaller than PYRAMID_MIN_SIZE
+        are skipped.
+
+        :param sec_im: sec image
+        :type sec_im: np.ndarray
+        :param interp_ref_im: ref image
+        :type interp_ref_im: np.ndarray
+        :param offsets: initial x_offset, y_offset in pixels
+        :type offsets: Tuple[float, float]
+        :return: x_offset, y_offset in full resolution pixels
+        :rtype: Tuple[float, float]
+        """
+        x_offset, y_offset = offsets
+        levels = self._get_pyramid_levels(sec_im.shape)
+        if levels < self.pyramid_levels:
+            logging.debug(
+                "Nuth & Kaab pyramid levels reduced to %s for dems of size %s",
+                levels,
+                sec_im.shape,
+            )
+        for level in range(levels, 0, -1):
+            factor = 2**level
+            coarse_ref = compute_block_mean(interp_ref_im, factor)
+            coarse_stable_mask = None
+            if self.stable_mask is not None:
+                # Coarse pixels mostly made of stable pixels
+                coarse_stable_mask = (
+                    compute_block_mean(self.stable_mask, factor) >= 0.5
+                )
+            # The coarse ref is unbiased in place, its copy is shifted
+            coarse_x_offset, coarse_y_offset, _, _ = self._nuth_kaab_iterations(
+                compute_block_mean(sec_im, factor),
+                coarse_ref.copy(),
+                coarse_ref,
+                (x_offset / factor, y_offset / factor),
+                self.pyramid_iterations,
+                level=level,
+                stable_mask=coarse_stable_mask,
+            )
+            x_offset = coarse_x_offset * factor
+            y_offset = coarse_y_offset * factor
+            logging.debug(
+                "Nuth & Kaab pyramid level %s offset in pixels : "
+                "( %.2f , %.2f )",
+                level,
+                x_offset,
+                y_offset,
+            )
+        return x_offset, y_offset
 
-        # Compute median, nmad and initial elevation difference plot
-        median = np.median(initial_dh[np.isfinite(initial_dh)])
-        nmad_old = 1.4826 * np.median(
-            np.abs(initial_dh[np.isfinite(initial_dh)] - median)
-        )
-        maxval = 3 * nmad_old
-        pl.figure(1, figsize=(7.0, 8.0))
-        pl.imshow(initial_dh, vmin=-maxval, vmax=maxval)
-        color_bar = pl.colorbar()
-        color_bar.set_label("Elevation difference (m)")
-        if self.save_optional_outputs:
-            output_dir_ = os.path.join(self.output_dir, "./nuth_kaab_tmp_dir")
-            pl.savefig(
-                os.path.join(output_dir_, "ElevationDiff_BeforeCoreg.png"),
-                dpi=100,
-                bbox_inches="tight",
+    def _get_pyramid_levels(self, shape: Tuple[int, int]) -> int:
+        """
+        Returns the number of pyramid levels of dems of the input
+        shape, at most pyramid_levels, the levels whose dems would
+        be smaller than PYRAMID_MIN_SIZE being skipped.
+
+        :param shape: dems shape
+        :type shape: Tuple[int, int]
+        :return: number of pyramid levels
+        :rtype: int
+        """
+        levels = self.pyramid_levels
+        while levels > 0 and min(shape) // 2**levels < self.PYRAMID_MIN_SIZE:
+            levels -= 1
+        return levels
+
+    def _nuth_kaab_iterations(  # pylint:disable=too-many-arguments
+        self,
+        sec_im: np.ndarray,
+        ref_im: np.ndarray,
+        interp_ref_im: np.ndarray,
+        offsets: Tuple[float, float],
+        iterations: int,
+        plot_name: str = None,
+        level: int = 0,
+        stable_mask: np.ndarray = None,
+    ) -> Tuple[float, float, np.ndarray, np.ndarray]:
+        """
+        Runs at most iterations Nuth & Kaab iterations from the input
+        offsets, stopped earlier on convergence, see _get_stop_reason.
+        Without initial offsets, ref_im is unbiased in place.
+        The iterations results are added to convergence_results.
+
+        :param sec_im: sec image
+        :type sec_im: np.ndarray
+        :param ref_im: ref image
+        :type ref_im: np.ndarray
+        :param interp_ref_im: float64 ref image copy, shifted
+            at each iteration
+        :type interp_ref_im: np.ndarray
+        :param offsets: initial x_offset, y_offset in pixels
+        :type offsets: Tuple[float, float]
+        :param iterations: number of iterations
+        :type iterations: int
+        :param plot_name: iteration plots file name prefix, saved
+            if save_optional_outputs is set. None for no plots
+        :type plot_name: str
+        :param level: pyramid level of the dems, 0 for full resolution
+        :type level: int
+        :param stable_mask: stable terrain mask of the dems,
+            the full resolution stable_mask attribute if None
+        :type stable_mask: np.ndarray
+        :return: x_offset, y_offset, coreg_sec, coreg_ref
+        :rtype: Tuple[float, float, np.ndarray, np.ndarray]
+        """
+        x_offset, y_offset = offsets
+        if x_offset == 0 and y_offset == 0:
+            coreg_sec = sec_im
+            coreg_ref = ref_im
+        else:
+            coreg_ref = self.crop_dem_with_offset(
+                shift_image(
+                    interp_ref_im, x_offset, -y_offset, self.shift_method
+                ),
+                x_offset,
+                y_offset,
             )
-        pl.close()
-        # Initialize offsets
-        x_offset, y_offset = 0.0, 0.0
-        logging.debug("Nuth & Kaab iterations: %s", self.iterations)
-        coreg_sec = sec_im
+            coreg_sec = self.crop_dem_with_offset(sec_im, x_offset, y_offset)
+        median, nmad_old = self._compute_median_nmad(
+            self._mask_unstable(
+                coreg_ref - coreg_sec, x_offset, y_offset, stable_mask
+            )
+        )
 
-        # Compute bounds for different aspect slices
-        self.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
-        for i in range(self.iterations):
+        stop_reason = "max_iterations"
+        for i in range(iterations):
+            start_time = time.perf_counter()
             # Remove bias from ref
             coreg_ref -= median
-            # Compute new elevation difference
-            dh = coreg_sec - coreg_ref
+            # Compute new elevation difference on the stable terrain
+            dh = self._mask_unstable(
+                coreg_sec - coreg_ref, x_offset, y_offset, stable_mask
+            )
             # Compute slope and aspect
             slope, aspect = self._grad2d(coreg_sec)
 
-            if self.save_optional_outputs:
+            if self._save_plots() and plot_name:
                 output_dir_ = os.path.join(
                     self.output_dir, "./nuth_kaab_tmp_dir"
                 )
-                plotfile = os.path.join(output_dir_, f"nuth_kaab_iter#{i}.png")
+                plotfile = os.path.join(output_dir_, f"{plot_name}#{i}.png")
             else:
                 plotfile = None
 
@@ -238,27 +523,24 @@ class NuthKaabInternal(CoregistrationTemplate):
             x_offset += east
             y_offset += north
 
-            # Resample slave DEM in the new grid
-            # spline 1 : positive y shift moves south
-            znew = spline_1(ygrid - y_offset, xgrid + x_offset)
-            nanval_new = spline_2(ygrid - y_offset, xgrid + x_offset)
-
-            # We created nan_maskval so that non NaN values are set to 0.
-            # Interpolation "creates" values, and the values not affected
-            # by nan are the ones still equal to 0.
-            # Hence, all values different to 0 must be considered
-            # as invalid ones
-            znew[nanval_new != 0] = np.nan
+            # Resample slave DEM in the new grid,
+            # the NaN values being propagated by the shift
+            # positive y shift moves south
+            znew = shift_image(
+                interp_ref_im, x_offset, -y_offset, self.shift_method
+            )
 
             # Crop dems with offset
             coreg_ref = self.crop_dem_with_offset(znew, x_offset, y_offset)
             coreg_sec = self.crop_dem_with_offset(sec_im, x_offset, y_offset)
 
             # Logging of some statistics
-            diff = coreg_ref - coreg_sec
-            diff = diff[np.isfinite(diff)]
-            nmad_new = 1.4826 * np.median(np.abs(diff - np.median(diff)))
-            median = np.median(diff)
+            diff = self._mask_unstable(
+                coreg_ref - coreg_sec, x_offset, y_offset, stable_mask
+            )
+            median, nmad_new = self._compute_median_nmad(
+                diff, self.max_fit_points
+            )
 
             logging.debug(
                 "\t Median : %.2f, NMAD = %.2f",
@@ -271,238 +553,197 @@ class NuthKaabInternal(CoregistrationTemplate):
                     "\t Gain : %.2f",
                     (nmad_new - nmad_old) / nmad_old * 100,
                 )
-            # put new nmad to old for next iteration
-            nmad_old = nmad_new
-
-        # Initialize coregistered classification layers
-        coreg_ref_classif = None
-        coreg_sec_classif = None
-        # If classification layers in ref, interpolate and crop them
-        # To have the same modifications as ref
-        if "indicator" in ref.coords:
-            coreg_ref_classif = self.interpolate_classif_layers(
-                ref.classification_layer_masks, xgrid, ygrid, x_offset, y_offset
-            )
-            coreg_ref_classif = self.crop_classif_layers(
-                coreg_ref_classif, x_offset, y_offset
+            self.convergence_results["iterations"].append(
+                {
+                    "pyramid_level": level,
+                    "iteration": i + 1,
+                    "east": round(float(east) * 2**level, 5),
+                    "north": round(float(north) * 2**level, 5),
+                    "x_offset": round(float(x_offset) * 2**level, 5),
+                    "y_offset": round(float(y_offset) * 2**level, 5),
+                    "median": round(float(median), 5),
+                    "nmad": round(float(nmad_new), 5),
+                    "time": round(time.perf_counter() - start_time, 5),
+                }
             )
-        if "indicator" in sec.coords:
-            coreg_sec_classif = self.crop_classif_layers(
-                sec.classification_layer_masks, x_offset, y_offset
+            iteration_stop_reason = self._get_stop_reason(
+                np.hypot(east, north) * 2**level, nmad_old, nmad_new
             )
+            # put new nmad to old for next iteration
+            nmad_old = nmad_new
+            if iteration_stop_reason is not None:
+                stop_reason = iteration_stop_reason
+                logging.debug(
+                    "Nuth & Kaab iterations stopped after %s iterations: %s",
+                    i + 1,
+                    stop_reason,
+                )
+                break
 
-        reproj_bounds = compute_gdal_translate_bounds(
-            y_offset,
-            x_offset,
-            (coreg_sec.shape[0], coreg_sec.shape[1]),
-            sec.georef_transform.data,
-        )
-
-        # Generate the dataset dems
-        coreg_sec_dataset = create_dem(
-            coreg_sec,
-            transform=sec.georef_transform.data,
-            nodata=DEFAULT_NODATA,
-            img_crs=sec.crs,
-            classification_layer_masks=coreg_sec_classif,
-            bounds=reproj_bounds,
-        )
-        coreg_ref_dataset = create_dem(
-            coreg_ref,
-            transform=sec.georef_transform.data,
-            nodata=DEFAULT_NODATA,
-            img_crs=sec.crs,
-            classification_layer_masks=coreg_ref_classif,
-            bounds=reproj_bounds,
-        )
-        logging.debug(
-            "Nuth & Kaab Final Offset in pixels (east, north): ( %.2f , %.2f )",
-            x_offset,
-            y_offset,
-        )
-        # Display
-        final_dh = coreg_ref - coreg_sec
-        median = np.median(final_dh[np.isfinite(final_dh)])
-        nmad_old = 1.4826 * np.median(
-            np.abs(final_dh[np.isfinite(final_dh)] - median)
-        )
-        maxval = 3 * nmad_old
-        pl.figure(1, figsize=(7.0, 8.0))
-        pl.imshow(final_dh, vmin=-maxval, vmax=maxval)
-        color_bar = pl.colorbar()
-        color_bar.set_label("Elevation difference (m)")
-        if self.save_optional_outputs:
-            output_dir_ = os.path.join(self.output_dir, "./nuth_kaab_tmp_dir")
-            pl.savefig(
-                os.path.join(output_dir_, "ElevationDiff_AfterCoreg.png"),
-                dpi=100,
-                bbox_inches="tight",
-            )
-        pl.close()
-        z_offset = float(np.nanmean(final_dh))
-        transform = Transformation(
-            x_offset=x_offset,
-            y_offset=-y_offset,  # -y_offset because y_offset
-            # from nk is north oriented
-            z_offset=z_offset,
-            estimated_initial_shift_x=self.estimated_initial_shift_x,
-            estimated_initial_shift_y=self.estimated_initial_shift_y,
-            adapting_factor=self.adapting_factor,
-        )
-        return transform, coreg_sec_dataset, coreg_ref_dataset
-
-    @staticmethod
-    def interpolate_dem_on_grid(
-        interp_dem: np.ndarray, xgrid: np.ndarray, ygrid: np.ndarray
-    ) -> Tuple[RectBivariateSpline, RectBivariateSpline]:
-        """
-        interpolate_dem_on_grid, returns the RectBivariateSpline function
-        to do Bivariate spline approximation over a rectangular mesh.
-
-        :param interp_dem: input dem image
-        :type interp_dem: np.ndarray
-        :param xgrid: x axis grid
-        :type xgrid: np.ndarray
-        :param ygrid: x axis grid
-        :type ygrid: np.ndarray
-        :return: spline_1, spline_2,
-        :rtype: Tuple[RectBivariateSpline, RectBivariateSpline]
-        """
-        # Mask nan values to -9999
-        nan_maskval = np.isnan(interp_dem)
-        sec_from_filled = np.where(nan_maskval, -9999, interp_dem)
-        # Compute both splines
-        spline_1 = RectBivariateSpline(
-            ygrid, xgrid, sec_from_filled, kx=1, ky=1
-        )
-        spline_2 = RectBivariateSpline(ygrid, xgrid, nan_maskval, kx=1, ky=1)
-
-        return spline_1, spline_2
+        self.convergence_results["stop_reason"] = stop_reason
+        return x_offset, y_offset, coreg_sec, coreg_ref
 
-    def interpolate_classif_layers(
+    def _mask_unstable(
         self,
-        dem_classif: xr.DataArray,
-        xgrid: np.ndarray,
-        ygrid: np.ndarray,
+        diff: np.ndarray,
         x_offset: float,
         y_offset: float,
-    ):
-        """
-        interpolates the classification layers on the input
-        grids with the input offsets.
-
-        :param dem_classif: input dem image
-        :type dem_classif: xr.Dataarray
-        :param xgrid: x axis grid
-        :type xgrid: np.ndarray
-        :param ygrid: x axis grid
-        :type ygrid: np.ndarray
-        :param x_offset: x offset
-        :type x_offset: float
-        :param y_offset: y offset
-        :type y_offset: float
-        :return: interpolated classification layers
-        :rtype: xr.Dataarray
-        """
-        interp_classif = dem_classif.data
-        # For each existing classification layer
-        for idx in range(len(dem_classif.coords["indicator"])):
-            # Get classification data
-            classif_data = dem_classif.data[:, :, idx]
-            # Compute classif layer splines
-            spline_1, spline_2 = self.interpolate_dem_on_grid(
-                classif_data, xgrid, ygrid
-            )
-            # Apply spline interpolations
-            rectified_map = spline_1(ygrid - y_offset, xgrid + x_offset)
-            nanval_new = spline_2(ygrid - y_offset, xgrid + x_offset)
-            rectified_map[nanval_new != 0] = np.nan
-            interp_classif[:, :, idx] = rectified_map
-        # Update dataset's classification data
-        dem_classif.data = interp_classif
-        return dem_classif
-
-    @staticmethod
-    def crop_dem_with_offset(
-        dem: np.ndarray, x_offset: float, y_offset: float
+        stable_mask: np.ndarray = None,
     ) -> np.ndarray:
         """
-        Crops the input dem with the given offsets.
+        Sets to NaN the unstable terrain pixels of an elevation
+        difference cropped with the given offsets.
 
-        :param dem: input dem image
-        :type dem: np.ndarray
+        :param diff: elevation difference cropped with the offsets
+        :type diff: np.ndarray
         :param x_offset: x offset
         :type x_offset: float
         :param y_offset: y offset
         :type y_offset: float
-        :return: cropped dem
+        :param stable_mask: stable terrain mask of the uncropped dems,
+            the stable_mask attribute if None
+        :type stable_mask: np.ndarray
+        :return: masked elevation difference, diff itself
+            without stable terrain mask
         :rtype: np.ndarray
         """
-        # Crop DEMs with offset
-        if x_offset >= 0:
-            cropped_dem = dem[:, 0 : dem.shape[1] - int(np.ceil(x_offset))]
+        if stable_mask is None:
+            stable_mask = self.stable_mask
+        if stable_mask is None:
+            return diff
+        return np.where(
+            self.crop_dem_with_offset(stable_mask, x_offset, y_offset),
+            diff,
+            np.nan,
+        )
 
+    def _get_stop_reason(
+        self, shift: float, nmad_old: float, nmad_new: float
+    ) -> Union[str, None]:
+        """
+        Returns the reason to stop the iterations after an iteration,
+        None to continue:
+
+        - "convergence_tolerance" if the iteration shift is below
+          the convergence_tolerance
+        - "nmad_gain_tolerance" if the NMAD decrease is below the
+          nmad_gain_tolerance, in percent of the previous NMAD
+
+        :param shift: iteration shift in full resolution pixels
+        :type shift: float
+        :param nmad_old: NMAD before the iteration
+        :type nmad_old: float
+        :param nmad_new: NMAD after the iteration
+        :type nmad_new: float
+        :return: stop reason or None
+        :rtype: str or None
+        """
+        if (
+            self.convergence_tolerance is not None
+            and shift < self.convergence_tolerance
+        ):
+            return "convergence_tolerance"
+        if (
+            self.nmad_gain_tolerance is not None
+            and nmad_old != 0
+            and (nmad_old - nmad_new) / nmad_old * 100
+            < self.nmad_gain_tolerance
+        ):
+            return "nmad_gain_tolerance"
+        return None
+
+    def _compute_median_nmad(
+        self, diff: np.ndarray, max_points: int = None
+    ) -> Tuple[float, float]:
+        """
+        Computes the median and the NMAD of the finite
+        values of an elevation difference, on a reproducible
+        uniform sample of at most max_points values if given.
+
+        :param diff: elevation difference
+        :type diff: np.ndarray
+        :param max_points: maximum number of values, None for all
+        :type max_points: int
+        :return: median, nmad
+        :rtype: Tuple[float, float]
+        """
+        if max_points is not None and diff.size > max_points:
+            diff = diff.ravel()[self._draw_sample_candidates(diff.size)]
+            diff = diff[np.isfinite(diff)][:max_points]
         else:
-            cropped_dem = dem[:, int(np.floor(-x_offset)) : dem.shape[1]]
+            diff = diff[np.isfinite(diff)]
+        median = np.median(diff)
+        nmad = 1.4826 * np.median(np.abs(diff - median))
+        return median, nmad
 
-        if -y_offset >= 0:
-            cropped_dem = cropped_dem[
-                0 : dem.shape[0] - int(np.ceil(-y_offset)), :
+    def _draw_fit_sample(
+        self, dh: np.ndarray, aspect: np.ndarray
+    ) -> Union[np.ndarray, Tuple[np.ndarray, ...]]:
+        """
+        Returns the valid pixels of the elevation difference fitted by
+        a Nuth & Kaab iteration. If there are more than max_fit_points,
+        a reproducible sample is drawn among FIT_SAMPLE_OVERSAMPLING
+        times max_fit_points uniformly drawn candidates, keeping at most
+        ceil(max_fit_points / 72) candidates of each aspect slice so
+        that the scarce aspects keep all their pixels, and at most
+        max_fit_points candidates with the lowest ranks in their slice.
+
+        :param dh: elevation difference
+        :type dh: np.ndarray
+        :param aspect: aspect for the same locations as the dh
+        :type aspect: np.ndarray
+        :return: valid pixels mask or sampled pixels indexes
+        :rtype: np.ndarray or Tuple[np.ndarray, ...]
+        """
+        valid = np.isfinite(dh)
+        if (
+            self.max_fit_points is None
+            or np.count_nonzero(valid) <= self.max_fit_points
+        ):
+            return valid
+        candidates = self._draw_sample_candidates(dh.size)
+        candidates = candidates[
+            valid.ravel()[candidates] & np.isfinite(aspect.ravel()[candidates])
+        ]
+        # Rank of each candidate in its aspect slice, in drawing order
+        slices = np.floor(
+            aspect.ravel()[candidates] / (2 * np.pi / len(self.aspect_bounds))
+        ).astype(int)
+        order = np.argsort(slices, kind="stable")
+        sorted_slices = slices[order]
+        ranks = np.arange(len(order)) - np.searchsorted(
+            sorted_slices, sorted_slices
+        )
+        # Rounded up quota of each slice, so that a max_fit_points
+        # below the number of slices still gives a sample
+        quota = -(-self.max_fit_points // len(self.aspect_bounds))
+        kept = ranks < quota
+        sample, sample_ranks = order[kept], ranks[kept]
+        if sample.size > self.max_fit_points:
+            # Keep the lowest ranks of the slices, in drawing order
+            sample = sample[
+                np.lexsort((sample, sample_ranks))[: self.max_fit_points]
             ]
+        sample = np.sort(candidates[sample])
+        return np.unravel_index(sample, dh.shape)
 
-        else:
-            cropped_dem = cropped_dem[int(np.floor(y_offset)) : dem.shape[0], :]
-
-        return cropped_dem
-
-    def crop_classif_layers(
-        self, dem_classif: xr.DataArray, x_offset, y_offset
-    ) -> xr.DataArray:
+    def _draw_sample_candidates(self, size: int) -> np.ndarray:
         """
-        crop_classif_layers crops and updates the input classification layers
-        with the input offsets.
+        Draws reproducible uniform sample candidates indexes among size
+        pixels, FIT_SAMPLE_OVERSAMPLING times max_fit_points at most.
 
-        :param dem_classif: classification layers
-        :type dem_classif: xr.Dataarray
-        :param x_offset: x offset
-        :type x_offset: float
-        :param y_offset: y offset
-        :type y_offset: float
-        :return: cropped classification layers
-        :rtype: xr.Dataarray
-        """
-        # Initialize cropped data
-        cropped_classif_list = []
-        # For each existing classification layer
-        for idx in range(len(dem_classif.coords["indicator"])):
-            # Get classification data
-            classif_map = dem_classif.data[:, :, idx]
-            # Crop classification data
-            rectified_map = self.crop_dem_with_offset(
-                classif_map, x_offset, y_offset
-            )
-            cropped_classif_list.append(rectified_map)
-        # Set cropped data to the correct dimension order
-        cropped_classif = np.swapaxes(
-            np.transpose(np.array(cropped_classif_list)), 0, 1
-        )
-        # Get all classif indicators
-        indicator = list(dem_classif.coords["indicator"].data)
-        # Initialize new cropped classif coordinates
-        coords_classification_layers = {
-            "row": np.arange(rectified_map.shape[0]),
-            "col": np.arange(rectified_map.shape[1]),
-            "indicator": indicator,
-        }
-        # Create new xarray with the cropped classif
-        cropped_classifs = xr.DataArray(
-            data=cropped_classif,
-            coords=coords_classification_layers,
-            dims=["row", "col", "indicator"],
+        :param size: number of pixels
+        :type size: int
+        :return: candidates indexes in drawing order
+        :rtype: np.ndarray
+        """
+        rng = np.random.default_rng(self.FIT_SAMPLE_SEED)
+        return rng.choice(
+            size,
+            min(size, self.FIT_SAMPLE_OVERSAMPLING * self.max_fit_points),
+            replace=False,
         )
 
-        return cropped_classifs
-
     @staticmethod
     def _grad2d(dem: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
@@ -554,6 +795,13 @@ class NuthKaabInternal(CoregistrationTemplate):
         #    - b will be its orientation
         #    - c will be a vertical mean shift
 
+        # Valid pixels, sampled by aspect slices if there
+        # are more than max_fit_points
+        fit_pixels = self._draw_fit_sample(dh, aspect)
+        dh = dh[fit_pixels]
+        slope = slope[fit_pixels]
+        aspect = aspect[fit_pixels]
+
         # To avoid nearly-zero division, filter slope values below 0.001
         slope[np.where(slope < 0.001)] = np.nan
 
@@ -563,8 +811,6 @@ class NuthKaabInternal(CoregistrationTemplate):
         #   as they will be processed as nan later.
         with np.errstate(divide="ignore", invalid="ignore"):
             target = dh / slope
-        target = target[np.isfinite(dh)]
-        aspect = aspect[np.isfinite(dh)]
 
         # Compute filtered target
         slice_filt_median, target_filt = self._filter_target(aspect, target)
@@ -618,13 +864,15 @@ class NuthKaabInternal(CoregistrationTemplate):
         """
         Filter target slice outliers of an input
         array by a 3*sigma filtering to improve Nuth et kaab fit.
+        The target values are grouped by aspect slice once,
+        each slice being then filtered on its contiguous values.
 
         :param aspect: elevation difference sec - ref
         :type aspect: np.ndarray
         :param target: slope for the same locations as the dh
         :type target: np.ndarray
         :return: slice_filt_median, target_filt
-        :rtype: Tuple[List]
+        :rtype: Tuple[np.ndarray, np.ndarray]
         """
         # Define sigma to filter each target slice outliers
         # and improve Nuth et kaab fit.
@@ -632,23 +880,33 @@ class NuthKaabInternal(CoregistrationTemplate):
         # [mean_slice-sigma_filter*std_slice, mean_slice+sigma_filter*std_slice]
         # are considered outliers and will be set to NaN
         sigma_filter = 3
+        nb_slices = len(self.aspect_bounds)
+        # Group the target values by aspect slice at once,
+        # the values keeping their order in each slice
+        slices = self._get_aspect_slices(aspect)
+        members = np.flatnonzero(slices < nb_slices)
+        # The slices fit in int8 for a fast stable sort
+        members = members[
+            np.argsort(slices[members].astype(np.int8), kind="stable")
+        ]
+        member_target = target[members]
+        slice_ends = np.cumsum(
+            np.bincount(slices[members], minlength=nb_slices)
+        )
+        slice_starts = np.concatenate(([0], slice_ends[:-1]))
+        # The target slices are contiguous views of member_target
+        target_slices = [
+            member_target[slice_starts[idx] : slice_ends[idx]]
+            for idx in range(nb_slices)
+        ]
+
         # Initialize slice filtered median
-        slice_filt_median = []
-        # Initialize filtered target
-        target_filt = np.full(target.shape, np.nan)
-        for bounds in self.aspect_bounds:
-            # Slice indexes within aspect
-            slice_idxes = np.where(
-                (bounds < aspect) & (aspect < bounds + np.pi / 36)
-            )
+        slice_filt_median = np.full(nb_slices, np.nan)
+        for idx, target_slice in enumerate(target_slices):
             # If no aspect values are within the slice,
-            # fill mean with Nan and continue
-            if len(slice_idxes[0]) == 0:
-                # Set slice filtered median for Nuth et kaab as NaN
-                slice_filt_median.append(np.nan)
+            # keep its median as NaN and continue
+            if len(target_slice) == 0:
                 continue
-            # Obtain target values in the slice
-            target_slice = target[slice_idxes]
             # Obtain target slice's mean and std before filtering
             slice_mean = np.nanmean(target_slice)
             # numpy's std cannot handle nan
@@ -661,14 +919,57 @@ class NuthKaabInternal(CoregistrationTemplate):
                 (target_slice < (slice_mean - sigma_filter * slice_sigma)),
                 (target_slice > (slice_mean + sigma_filter * slice_sigma)),
             )
-            # Filter target_slice
-            target_slice[inv_idx] = np.nan
+            # Filter target_slice, in place in member_target
             target_slice[inv_idx] = np.nan
-            # Filter target
-            target_filt[slice_idxes] = target_slice
             # Compute slice filtered median for Nuth et kaab
-            slice_filt_median.append(np.nanmedian(target_slice))
-        return np.array(slice_filt_median), np.array(target_filt)
+            slice_filt_median[idx] = np.nanmedian(target_slice)
+
+        # Filter target
+        target_filt = np.full(target.shape, np.nan)
+        target_filt[members] = member_target
+        return slice_filt_median, target_filt
+
+    def _get_aspect_slices(self, aspect: np.ndarray) -> np.ndarray:
+        """
+        Returns the aspect slice index of each aspect value,
+        such as bounds < aspect < bounds + pi / 36 for the slice
+        aspect_bounds, the number of slices for the values outside
+        of any slice (on a bound or NaN).
+
+        :param aspect: terrain aspect
+        :type aspect: np.ndarray
+        :return: aspect slices indexes
+        :rtype: np.ndarray
+        """
+        nb_slices = len(self.aspect_bounds)
+        # Bounds compared in the type of the aspect compared to
+        # a bound scalar, such as a float32 aspect
+        bounds_type = np.result_type(aspect, self.aspect_bounds[0])
+        lower_bounds = self.aspect_bounds.astype(bounds_type)
+        upper_bounds = (self.aspect_bounds + np.pi / 36).astype(bounds_type)
+        finite = np.isfinite(aspect)
+        # Slices from the aspect division, checked against the
+        # exact bounds comparisons
+        slices = np.full(aspect.shape, nb_slices, dtype=np.int64)
+        slices[finite] = np.clip(
+            np.floor(aspect[finite] / (np.pi / 36)), 0, nb_slices - 1
+        )
+        in_slice = (lower_bounds[slices % nb_slices] < aspect) & (
+            aspect < upper_bounds[slices % nb_slices]
+        )
+        # The values around the bounds are searched among the bounds
+        around_bounds = np.flatnonzero(finite & ~in_slice)
+        around_slices = (
+            np.searchsorted(lower_bounds, aspect[around_bounds], side="left")
+            - 1
+        )
+        around_in_slice = (around_slices >= 0) & (
+            aspect[around_bounds] < upper_bounds[np.maximum(around_slices, 0)]
+        )
+        slices[around_bounds] = np.where(
+            around_in_slice, around_slices, nb_slices
+        )
+        return slices
 
     def _save_fit_plots(
         self,
@@ -735,6 +1036,46 @@ class NuthKaabInternal(CoregistrationTemplate):
         pl.savefig(plot_file, dpi=100, bbox_inches="tight")
         pl.close()
 
+    def _save_plots(self) -> bool:
+        """
+        Returns True if the optional plots are saved.
+        The plots figures are only built in this case.
+
+        :return: True if the optional plots are saved
+        :rtype: bool
+        """
+        return bool(self.save_optional_outputs and self.output_dir)
+
+    def _save_elevation_diff_plot(
+        self, dh: np.ndarray, nmad: float, plot_name: str
+    ) -> None:
+        """
+        Compute and save the elevation difference plot if the
+        optional plots are saved, does nothing otherwise
+
+        :param dh: elevation difference
+        :type dh: np.ndarray
+        :param nmad: elevation difference nmad, the plot
+            colors range being +- 3 nmad
+        :type nmad: float
+        :param plot_name: plot file name in nuth_kaab_tmp_dir
+        :type plot_name: str
+        :return: None
+        """
+        if not self._save_plots():
+            return
+        maxval = 3 * nmad
+        pl.figure(1, figsize=(7.0, 8.0))
+        pl.imshow(dh, vmin=-maxval, vmax=maxval)
+        color_bar = pl.colorbar()
+        color_bar.set_label("Elevation difference (m)")
+        pl.savefig(
+            os.path.join(self.output_dir, "nuth_kaab_tmp_dir", plot_name),
+            dpi=100,
+            bbox_inches="tight",
+        )
+        pl.close()
+
     def save_results_dict(self):
         """
         Save the coregistration results on a Dict
@@ -755,3 +1096,7 @@ class NuthKaabInternal(CoregistrationTemplate):
         self.coregistration_results["coregistration_results"]["dz"][
             "nuth_offset"
         ] = round(self.transform.z_offset, 5)
+        # Add the per iteration results and the iterations stop reason
+        self.coregistration_results["coregistration_results"][
+            "nuth_kaab_iterations"
+        ] = self.convergence_results
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains the FFT phase correlation coregistration,
+estimating the planimetric translation between the dems by the
+phase correlation of their gradient or hillshade images.
+It may be used standalone or to initialize the Nuth & Kaab offsets.
+"""
+
+# Standard imports
+import logging
+from typing import Tuple
+
+# Third party imports
+import numpy as np
+import xarray as xr
+from json_checker import And
+
+# Demcompare imports
+from ..img_tools import (
+    compute_block_mean,
+    compute_phase_correlation_shift,
+    shift_image,
+)
+from ..internal_typing import ConfigType
+from ..metric import Metric
+from ..transformation import Transformation
+from .coregistration import Coregistration
+from .coregistration_template import CoregistrationTemplate
+
+# Images correlated by the phase correlation
+CORRELATION_IMAGES = ["gradient", "hillshade"]
+# Default phase correlation parameters
+DEFAULT_CORRELATION_IMAGE = "gradient"
+DEFAULT_DECIMATION = 1
+DEFAULT_UPSAMPLING_FACTOR = 20
+
+
+@Coregistration.register("phase_correlation")
+class PhaseCorrelation(CoregistrationTemplate):
+    """
+    PhaseCorrelation class, estimates the planimetric offset between
+    the dems by FFT phase correlation and their altimetric offset
+    as the mean elevation difference once shifted
+    """
+
+    # Sub-pixel shift methods of the dem resampling
+    SHIFT_METHODS = ["bilinear", "bicubic", "fourier"]
+    # Method name
+    method_name = "phase_correlation"
+
+    def __init__(self, cfg: ConfigType = None):
+        """
+        Any coregistration class should have the following schema on
+        its input cfg (optional parameters may be added for a
+        particular coregistration class):
+
+        coregistration = {
+         "method_name": coregistration class name. str,
+         "correlation_image": optional. image of the dems correlated.
+           str "gradient" (default) for the gradient magnitude,
+           or "hillshade",
+         "decimation": optional. block mean decimation factor of the
+           dems before the correlation. int. 1 by default,
+         "upsampling_factor": optional. sub-pixel precision factor
+           of the correlation peak. int. 20 by default,
+         "shift_method": optional. sub-pixel shift method of the
+           coregistered ref. str "bilinear" (default), "bicubic"
+           or "fourier". See img_tools.shift_image,
+         "sampling_source": optional. sampling source at which
+           the dems are reprojected prior to coregistration. str
+           "sec" (default) or "ref",
+         "estimated_initial_shift_x": optional. estimated initial
+           x shift. int or float. 0 by default,
+         "estimated_initial_shift_y": optional. estimated initial
+           y shift. int or float. 0 by default,
+         "output_dir": optional output directory. str. If given,
+           the coreg_sec is saved,
+         "output_profile": optional output GeoTIFF profile. dict.
+           See img_tools.get_output_creation_options,
+         "save_optional_outputs": optional. bool. Requires output_dir
+           to be set. If activated, the internal dems of the
+           coregistration such as reproj_dem, reproj_ref,
+           reproj_coreg_sec, reproj_coreg_ref are saved.
+         "stable_terrain": optional. dict. Stable terrain mask of the
+           pixels correlated and of the altimetric offset.
+           See CoregistrationTemplate.compute_stable_terrain_mask,
+        }
+
+        :param cfg: configuration
+        :type cfg: Config Type
+        """
+        # Call generic init before supercharging
+        super().__init__(cfg)
+        # Phase correlation parameters
+        self.correlation_image = self.cfg["correlation_image"]
+        self.decimation = self.cfg["decimation"]
+        self.upsampling_factor = self.cfg["upsampling_factor"]
+        # Sub-pixel shift method of the coregistered ref
+        self.shift_method = self.cfg["shift_method"]
+
+    def fill_conf_and_schema(self, cfg: ConfigType = None) -> ConfigType:
+        """
+        Add default values to the dictionary if there are missing
+        elements and define the configuration schema
+
+        :param cfg: coregistration configuration
+        :type cfg: ConfigType
+        :return cfg: coregistration configuration updated
+        :rtype: ConfigType
+        """
+        # Call generic fill_conf_and_schema
+        cfg = super().fill_conf_and_schema(cfg)
+
+        # Give the default value if the required element
+        # is not in the configuration
+        if "correlation_image" not in cfg:
+            cfg["correlation_image"] = DEFAULT_CORRELATION_IMAGE
+        if "decimation" not in cfg:
+            cfg["decimation"] = DEFAULT_DECIMATION
+        if "upsampling_factor" not in cfg:
+            cfg["upsampling_factor"] = DEFAULT_UPSAMPLING_FACTOR
+        if "shift_method" not in cfg:
+            cfg["shift_method"] = self.SHIFT_METHODS[0]
+
+        # Add subclass parameter to the default schema
+        self.schema["method_name"] = And(
+            str, lambda input: input == self.method_name
+        )
+        self.schema["correlation_image"] = And(
+            str, lambda input: input in CORRELATION_IMAGES
+        )
+        self.schema["decimation"] = And(int, lambda input: input > 0)
+        self.schema["upsampling_factor"] = And(int, lambda input: input > 0)
+        self.schema["shift_method"] = And(
+            str, lambda input: input in self.SHIFT_METHODS
+        )
+        return cfg
+
+    def _coregister_dems_algorithm(
+        self,
+        sec: xr.Dataset,
+        ref: xr.Dataset,
+    ) -> Tuple[Transformation, xr.Dataset, xr.Dataset]:
+        """
+        Coregister_dems, computes coregistration
+        transform and coregistered DEMS of two DEMs
+        that have the same size and resolution.
+
+        :param sec: sec xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type sec: xarray Dataset
+        :param ref: ref xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :type ref: xarray Dataset
+        :return: transformation, reproj_coreg_sec xr.DataSet,
+                 reproj_coreg_ref xr.DataSet. The xr.Datasets containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+        :rtype: Tuple[Transformation, xr.Dataset, xr.Dataset]
+        """
+        sec_im = sec["image"].data
+        ref_im = ref["image"].data
+        # Only the stable terrain pixels are correlated
+        stable_mask = self.compute_stable_terrain_mask(sec, ref)
+        x_offset, y_offset = estimate_phase_correlation_offsets(
+            sec_im
+            if stable_mask is None
+            else np.where(stable_mask, sec_im, np.nan),
+            ref_im,
+            self.correlation_image,
+            self.decimation,
+            self.upsampling_factor,
+        )
+        logging.debug(
+            "Phase correlation offset in pixels (east, north): "
+            "( %.2f , %.2f )",
+            x_offset,
+            y_offset,
+        )
+
+        # Shift the ref on the sec, positive y shift moves south
+        coreg_ref = self.crop_dem_with_offset(
+            shift_image(
+                ref_im.astype(np.float64),
+                x_offset,
+                -y_offset,
+                self.shift_method,
+            ),
+            x_offset,
+            y_offset,
+        )
+        coreg_sec = self.crop_dem_with_offset(sec_im, x_offset, y_offset)
+        coreg_sec_dataset, coreg_ref_dataset = self.create_coregistered_dems(
+            sec, ref, coreg_sec, coreg_ref, x_offset, y_offset
+        )
+
+        final_dh = coreg_ref - coreg_sec
+        if stable_mask is not None:
+            final_dh[
+                ~self.crop_dem_with_offset(stable_mask, x_offset, y_offset)
+            ] = np.nan
+        transform = Transformation(
+            x_offset=x_offset,
+            y_offset=-y_offset,  # -y_offset because y_offset
+            # is north oriented
+            z_offset=float(np.nanmean(final_dh)),
+            estimated_initial_shift_x=self.estimated_initial_shift_x,
+            estimated_initial_shift_y=self.estimated_initial_shift_y,
+            adapting_factor=self.adapting_factor,
+        )
+        return transform, coreg_sec_dataset, coreg_ref_dataset
+
+    def save_results_dict(self):
+        """
+        Save the coregistration results on a Dict
+        The altimetric and coregistration results are saved.
+        Logging of the altimetric results is done in this function.
+
+        :return: None
+        """
+        # Call generic save_results_dict before supercharging
+        super().save_results_dict()
+        # Add phase correlation offsets to coregistration_results
+        self.coregistration_results["coregistration_results"]["dx"][
+            "phase_correlation_offset"
+        ] = round(self.transform.x_offset, 5)
+        self.coregistration_results["coregistration_results"]["dy"][
+            "phase_correlation_offset"
+        ] = round(self.transform.y_offset, 5)
+        self.coregistration_results["coregistration_results"]["dz"][
+            "phase_correlation_offset"
+        ] = round(self.transform.z_offset, 5)
+
+
+def estimate_phase_correlation_offsets(
+    sec_im: np.ndarray,
+    ref_im: np.ndarray,
+    correlation_image: str = DEFAULT_CORRELATION_IMAGE,
+    decimation: int = DEFAULT_DECIMATION,
+    upsampling_factor: int = DEFAULT_UPSAMPLING_FACTOR,
+) -> Tuple[float, float]:
+    """
+    Estimates the planimetric offsets between two dems of the same
+    shape by FFT phase correlation of their correlation images,
+    optionally decimated by block mean. The images are apodized by
+    a Hann window to remove the borders discontinuities.
+
+    The offsets follow the Nuth & Kaab convention: the ref shifted by
+    shift_image(ref_im, x_offset, -y_offset) is on the sec.
+
+    :param sec_im: sec image
+    :type sec_im: np.ndarray
+    :param ref_im: ref image
+    :type ref_im: np.ndarray
+    :param correlation_image: "gradient" or "hillshade"
+    :type correlation_image: str
+    :param decimation: block mean decimation factor
+    :type decimation: int
+    :param upsampling_factor: sub-pixel precision factor
+    :type upsampling_factor: int
+    :return: x_offset, y_offset (north oriented) in pixels
+    :rtype: Tuple[float, float]
+    """
+    if decimation > 1:
+        sec_im = compute_block_mean(sec_im, decimation)
+        ref_im = compute_block_mean(ref_im, decimation)
+    window = np.outer(np.hanning(sec_im.shape[0]), np.hanning(sec_im.shape[1]))
+    col_shift, row_shift = compute_phase_correlation_shift(
+        _compute_correlation_image(sec_im, correlation_image) * window,
+        _compute_correlation_image(ref_im, correlation_image) * window,
+        upsampling_factor,
+    )
+    return col_shift * decimation, -row_shift * decimation
+
+
+def _compute_correlation_image(
+    dem_im: np.ndarray, correlation_image: str
+) -> np.ndarray:
+    """
+    Computes the zero mean correlation image of a dem, null on
+    the dem nodata and their neighbours
+
+    :param dem_im: dem image
+    :type dem_im: np.ndarray
+    :param correlation_image: "gradient" or "hillshade"
+    :type correlation_image: str
+    :return: correlation image
+    :rtype: np.ndarray
+    """
+    if correlation_image == "hillshade":
+        image = Metric("hillshade").compute_hillshade(dem_im, 315, 45)
+    else:
+        grad_row, grad_col = np.gradient(dem_im.astype(np.float64))
+        image = np.hypot(grad_row, grad_col)
+    valid = np.isfinite(image)
+    if not valid.any():
+        raise ValueError("No valid pixel to correlate the dems")
+    return np.where(valid, image - np.mean(image[valid]), 0)
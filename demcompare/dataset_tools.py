@@ -21,12 +21,14 @@
 """
 This module contains functions associated to Demcompare's DEM dataset
 """
+# pylint:disable=too-many-lines
 
 import copy
 
 # Standard imports
 import logging
 import os
+from functools import lru_cache
 from typing import Dict, Tuple, Union
 
 # Third party imports
@@ -44,7 +46,21 @@ from rasterio.warp import Resampling, reproject
 from scipy import interpolate
 
 # Demcompare imports
-from .img_tools import convert_pix_to_coord
+from .img_tools import (
+    DEFAULT_CONTROL_GRID_STEP,
+    compute_on_control_grid,
+    convert_pix_to_coord,
+)
+from .lazy_tools import is_lazy_array, reproject_lazy
+
+# Step in pixels of the control grid of the geoid offset
+GEOID_GRID_STEP = DEFAULT_CONTROL_GRID_STEP
+# Maximum geoid offset upsampling error in meters
+GEOID_MAX_ERROR = 1e-3
+# Default number of warp threads and warp memory limit in MB
+# (0 for the GDAL default) of reproject_dataset
+DEFAULT_WARP_NUM_THREADS = 1
+DEFAULT_WARP_MEM_LIMIT = 0
 
 
 def create_dataset(  # pylint: disable=too-many-arguments, too-many-branches
@@ -63,6 +79,8 @@ def create_dataset(  # pylint: disable=too-many-arguments, too-many-branches
     """
     Creates dataset from input array and transform,
     and return the corresponding xarray.DataSet.
+    The input array can be a lazy chunked (dask) array,
+    in which case the dataset image is lazy too.
 
     The demcompare dataset is an xarray Dataset containing:
     :image: 2D (row, col) image as xarray.DataArray,
@@ -95,7 +113,7 @@ def create_dataset(  # pylint: disable=too-many-arguments, too-many-branches
                 - source_rasterio : rasterio's DatasetReader object or None.
 
     :param data: image data
-    :type data: np.ndarray
+    :type data: np.ndarray or dask.array.Array
     :param transform: rasterio georeferencing transformation matrix
     :type transform: np.ndarray or rasterio.Affine
     :param input_img: image path
@@ -172,7 +190,12 @@ def create_dataset(  # pylint: disable=too-many-arguments, too-many-branches
     if geoid_path:
         # transform to ellipsoid
         geoid_offset = _get_geoid_offset(dataset, geoid_path)
-        dataset["image"].data += geoid_offset
+        if is_lazy_array(dataset["image"].data):
+            dataset["image"].data = (
+                dataset["image"].data + geoid_offset
+            ).astype(np.float32)
+        else:
+            dataset["image"].data += geoid_offset
         dataset.attrs["geoid_path"] = geoid_path
     else:
         dataset.attrs["geoid_path"] = None
@@ -180,14 +203,24 @@ def create_dataset(  # pylint: disable=too-many-arguments, too-many-branches
     return dataset
 
 
-def reproject_dataset(
-    dataset: xr.Dataset, from_dataset: xr.Dataset, interp: str = "bilinear"
+def reproject_dataset(  # pylint: disable=too-many-arguments
+    dataset: xr.Dataset,
+    from_dataset: xr.Dataset,
+    interp: str = "bilinear",
+    classif_interp: str = "nearest",
+    num_threads: int = DEFAULT_WARP_NUM_THREADS,
+    warp_mem_limit: int = DEFAULT_WARP_MEM_LIMIT,
 ) -> xr.Dataset:
     """
     Reproject dataset on the from_dataset's georeference origin and grid,
     and return the corresponding xarray.DataSet.
     If no interp is given, default "bilinear" resampling is considered.
     Another available resampling is "nearest".
+    The classification layers are labels: they are all warped
+    in a single multi-band reprojection with the classif_interp
+    "nearest" (default) or "mode" resampling, keeping their type.
+    If one of the datasets is lazy, the reprojection is lazy and
+    done chunk by chunk on the from_dataset grid.
 
     :param dataset: Dataset to reproject xr.DataSet containing :
 
@@ -206,6 +239,12 @@ def reproject_dataset(
     :type from_dataset: xr.Dataset
     :param interp: interpolation method
     :type interp: str
+    :param classif_interp: classification layers interpolation method
+    :type classif_interp: str
+    :param num_threads: number of warp threads
+    :type num_threads: int
+    :param warp_mem_limit: warp memory limit in MB, 0 for GDAL default
+    :type warp_mem_limit: int
     :return: reprojected xr.DataSet containing :
 
                 - image : 2D (row, col) xr.DataArray float32
@@ -247,28 +286,59 @@ def reproject_dataset(
     )
     # Get source array
     source_array = dataset["image"].data
-    # Define dest_array with the output size and fill with nodata
-    dest_array = np.zeros_like(from_dataset["image"].data)
-    dest_array[:, :] = from_dataset.nodata
     # Obtain datasets CRSs
     src_crs = rasterio.crs.CRS.from_dict(dataset.attrs["crs"])
     dst_crs = rasterio.crs.CRS.from_dict(from_dataset.attrs["crs"])
+    # Warp options shared by the image and classification layers
+    warp_options = {
+        "num_threads": num_threads,
+        "warp_mem_limit": warp_mem_limit,
+    }
 
-    # Reproject with rasterio
-    reproject(
-        source=source_array,
-        destination=dest_array,
-        src_transform=src_transform,
-        src_crs=src_crs,
-        dst_transform=dst_transform,
-        dst_crs=dst_crs,
-        resampling=interpolation_method,
-        src_nodata=dataset.attrs["nodata"],
-        dst_nodata=from_dataset.attrs["nodata"],
-    )
+    # If one of the datasets is lazy, reproject chunk by chunk
+    lazy_chunks = _get_lazy_chunks(dataset, from_dataset)
+    if lazy_chunks is not None:
+        dest_array = reproject_lazy(
+            source_array,
+            src_transform,
+            src_crs,
+            from_dataset["image"].shape,
+            lazy_chunks,
+            dst_transform,
+            dst_crs,
+            interpolation_method,
+            src_nodata=dataset.attrs["nodata"],
+            dst_nodata=from_dataset.attrs["nodata"],
+            fill_value=from_dataset.nodata,
+            **warp_options,
+        )
+        # Convert output dataset's remaining nodata values to nan
+        dest_array = np.where(
+            dest_array == dataset.attrs["nodata"],
+            np.float32(np.nan),
+            dest_array,
+        )
+    else:
+        # Define dest_array with the output size and fill with nodata
+        dest_array = np.zeros_like(from_dataset["image"].data)
+        dest_array[:, :] = from_dataset.nodata
+
+        # Reproject with rasterio
+        reproject(
+            source=source_array,
+            destination=dest_array,
+            src_transform=src_transform,
+            src_crs=src_crs,
+            dst_transform=dst_transform,
+            dst_crs=dst_crs,
+            resampling=interpolation_method,
+            src_nodata=dataset.attrs["nodata"],
+            dst_nodata=from_dataset.attrs["nodata"],
+            **warp_options,
+        )
 
-    # Convert output dataset's remaining nodata values to nan
-    dest_array[dest_array == dataset.attrs["nodata"]] = np.nan
+        # Convert output dataset's remaining nodata values to nan
+        dest_array[dest_array == dataset.attrs["nodata"]] = np.nan
     # Charge reprojected_dataset's data and nodata values
     reprojected_dataset["image"].data = dest_array
     reprojected_dataset.attrs["nodata"] = dataset.attrs["nodata"]
@@ -277,36 +347,57 @@ def reproject_dataset(
         indicator = (
             dataset["classification_layer_masks"].coords["indicator"].data
         )
-        classification_layer_masks = np.full(
-            (
-                reprojected_dataset["image"].shape[0],
-                reprojected_dataset["image"].shape[1],
-                len(indicator),
-            ),
-            np.nan,
-            dtype=np.float32,
-        )
-        for idx in np.arange(len(indicator)):
-            # Define dest_array with the output size and fill with nodata
-            dest_array_classif = np.zeros_like(from_dataset["image"].data)
-            dest_array_classif[:, :] = dataset.nodata
-            # Get source array
-            source_array_classif = dataset["classification_layer_masks"][
-                :, :, idx
-            ].data
+        # Classification layers are labels, they are all reprojected
+        # at once as (indicator, row, col) bands keeping their type
+        classif_resampling = Resampling.nearest
+        if classif_interp == "mode":
+            classif_resampling = Resampling.mode
+        elif classif_interp != "nearest":
+            logging.warning(
+                "Classification layers interpolation method not available,"
+                " use default 'nearest'"
+            )
+        classif_dtype = dataset["classification_layer_masks"].dtype
+        classif_nodata = get_classification_layer_nodata(classif_dtype)
+        source_classif = dataset["classification_layer_masks"].data
+        # The nodata label of a layer is not the nodata of the others
+        classif_warp_options = dict(warp_options, UNIFIED_SRC_NODATA="NO")
+        if lazy_chunks is not None:
+            dest_classif = reproject_lazy(
+                source_classif.transpose(2, 0, 1),
+                src_transform,
+                src_crs,
+                from_dataset["image"].shape,
+                lazy_chunks,
+                dst_transform,
+                dst_crs,
+                classif_resampling,
+                src_nodata=classif_nodata,
+                dst_nodata=classif_nodata,
+                fill_value=classif_nodata,
+                **classif_warp_options,
+            )
+        else:
+            dest_classif = np.full(
+                (len(indicator),) + from_dataset["image"].shape,
+                classif_nodata,
+                dtype=classif_dtype,
+            )
             # Reproject with rasterio
             reproject(
-                source=source_array_classif,
-                destination=dest_array_classif,
+                source=np.ascontiguousarray(source_classif.transpose(2, 0, 1)),
+                destination=dest_classif,
                 src_transform=src_transform,
                 src_crs=src_crs,
                 dst_transform=dst_transform,
                 dst_crs=dst_crs,
-                resampling=interpolation_method,
-                src_nodata=dataset.attrs["nodata"],
-                dst_nodata=from_dataset.attrs["nodata"],
+                resampling=classif_resampling,
+                src_nodata=classif_nodata,
+                dst_nodata=classif_nodata,
+                **classif_warp_options,
             )
-            classification_layer_masks[:, :, idx] = dest_array_classif
+        # Back to (row, col, indicator) layers
+        classification_layer_masks = dest_classif.transpose(1, 2, 0)
 
         # Define coords, the third col is the indicator
         # with the classification layer name
@@ -324,6 +415,88 @@ def reproject_dataset(
     return reprojected_dataset
 
 
+def _get_lazy_chunks(
+    dataset: xr.Dataset, from_dataset: xr.Dataset
+) -> Union[Tuple[Tuple[int, ...], ...], None]:
+    """
+    Returns the chunks of the from_dataset grid if one of the
+    datasets image is lazy, None otherwise.
+    If only dataset is lazy, its chunks size is used on the
+    from_dataset grid.
+
+    :param dataset: dataset to reproject
+    :type dataset: xr.Dataset
+    :param from_dataset: dataset to get projection from
+    :type from_dataset: xr.Dataset
+    :return: from_dataset grid chunks or None
+    :rtype: Tuple[Tuple[int, ...], ...] or None
+    """
+    if is_lazy_array(from_dataset["image"].data):
+        return from_dataset["image"].data.chunks
+    if is_lazy_array(dataset["image"].data):
+        return dataset["image"].data.chunksize
+    return None
+
+
+def get_classification_layer_dtype(
+    min_value: Union[int, float], max_value: Union[int, float]
+) -> np.dtype:
+    """
+    Returns the compact storage type of classification layer maps
+    whose labels are integers within [min_value, max_value]:
+    uint8 or uint16, the maximum value of the type being kept for the
+    nodata label (see get_classification_layer_nodata).
+    float32 is returned if the labels do not fit.
+
+    :param min_value: minimum label value
+    :type min_value: int or float
+    :param max_value: maximum label value
+    :type max_value: int or float
+    :return: classification layer maps type
+    :rtype: np.dtype
+    """
+    for dtype in (np.uint8, np.uint16):
+        if min_value >= 0 and max_value < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.float32)
+
+
+def get_classification_layer_nodata(dtype: np.dtype) -> Union[int, float]:
+    """
+    Returns the nodata label of classification layer maps of the
+    input type: the maximum value of the integer types, nan otherwise.
+
+    :param dtype: classification layer maps type
+    :type dtype: np.dtype
+    :return: nodata label
+    :rtype: int or float
+    """
+    if np.issubdtype(dtype, np.integer):
+        return int(np.iinfo(dtype).max)
+    return np.nan
+
+
+def cast_classification_layers(data: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """
+    Casts classification layer maps to the input type,
+    converting their nodata labels to the nodata label of the type.
+
+    :param data: classification layer maps
+    :type data: np.ndarray
+    :param dtype: output type
+    :type dtype: np.dtype
+    :return: classification layer maps of the output type
+    :rtype: np.ndarray
+    """
+    if data.dtype == dtype:
+        return data
+    nodata = get_classification_layer_nodata(data.dtype)
+    nodata_mask = np.isnan(data) if np.isnan(nodata) else data == nodata
+    return np.where(
+        nodata_mask, get_classification_layer_nodata(dtype), data
+    ).astype(dtype)
+
+
 def compute_offset_adapting_factor(
     sec: xr.Dataset, ref: xr.Dataset
 ) -> Tuple[float, float]:
@@ -342,15 +515,35 @@ def compute_offset_adapting_factor(
     :rtype: Tuple[float, float]
     """
     # Obtain the original dem size
-    orig_ysize, orig_xsize = sec["image"].shape
-    # Reproject the dem to the ref without doing any crop
-    reproj_sec = reproject_dataset(sec, ref, interp="bilinear")
-    # Obtain the full reprojected dem size
-    reproj_ysize, reproj_xsize = reproj_sec["image"].shape
+    orig_ysize, orig_xsize = _get_source_shape(sec)
+    # The dem reprojected to the ref without doing any crop
+    # has the size of the full ref grid
+    reproj_ysize, reproj_xsize = _get_source_shape(ref)
     # Return the x and y factors to adapt the computed offsets
     return orig_xsize / reproj_xsize, orig_ysize / reproj_ysize
 
 
+def _get_source_shape(dataset: xr.Dataset) -> Tuple[int, int]:
+    """
+    Returns the (rows, cols) shape of the full raster the dataset
+    was loaded from, as its image may only be an input ROI window.
+    If the dataset has no source raster, its image shape is returned.
+
+    :param dataset: xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+    :type dataset: xr.Dataset
+    :return: full raster shape
+    :rtype: Tuple[int, int]
+    """
+    if dataset.attrs.get("source_rasterio"):
+        return dataset.attrs["source_rasterio"]["source_dem"].shape
+    return dataset["image"].shape
+
+
 def _get_geoid_offset(
     dataset: xr.Dataset, geoid_path: Union[str, None]
 ) -> np.ndarray:
@@ -367,8 +560,8 @@ def _get_geoid_offset(
     :type dataset: xr.Dataset
     :param geoid_path: optional absolut geoid_path, if None egm96 is used
     :type geoid_path: str or None
-    :return: offset as array
-    :rtype: np.ndarray
+    :return: offset as array, lazy if the dataset image is lazy
+    :rtype: np.ndarray or dask.array.Array
     """
     # If no geoid path has been given, use the default geoid egm96
     # installed in setup.py
@@ -380,57 +573,123 @@ def _get_geoid_offset(
         # Create full geoid path
         geoid_path = os.path.join(module_path, geoid_path)
 
-    # Obtain dataset's grid
-    ny, nx = dataset["image"].data.shape
-    xp = np.arange(nx)
-    yp = np.arange(ny)
+    transform_array = np.copy(dataset["georef_transform"].data)
+    src_crs = rasterio.crs.CRS.from_dict(dataset.attrs["crs"])
+
+    def _compute_offset(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Computes the geoid offset on the (rows, cols) grid
+
+        :param rows: 2D grid rows
+        :type rows: np.ndarray
+        :param cols: 2D grid cols
+        :type cols: np.ndarray
+        :return: offset as array
+        :rtype: np.ndarray
+        """
+        # Project the dataset grid into lat/lon coordinates
+        lonlat = list(convert_pix_to_coord(transform_array, rows, cols))
+
+        # If the georef's units are meters (if is_projected),
+        # convert them to degrees
+        if src_crs.is_projected:
+            # convert to global coordinates
+            proj = pyproj.Proj(src_crs)
+            lonlat = list(proj(lonlat[0], lonlat[1], inverse=True))
+
+        # transform to list (2xN)
+        lon_1d = np.reshape(lonlat[0], rows.size)
+        lat_1d = np.reshape(lonlat[1], rows.size)
+        coords = np.zeros((lon_1d.size, 2))
+        coords[:, 0] = lon_1d
+        coords[:, 1] = lat_1d
+        # Interpolate geoid on the dataset coordinates
+        # If the dataset coordinates are outside of the geoid scope,
+        # an error will be raised.
+        try:
+            # Get geoid values
+            interp_geoid = _interpolate_geoid(
+                geoid_path, coords, interpol_method="linear"
+            )
+        except ValueError:
+            logging.error(
+                "Input DSM %s coordinates outside of the %s geoid scope.",
+                dataset.attrs["input_img"],
+                geoid_path,
+            )
+            raise
+
+        # transform to array of the grid shape
+        return np.reshape(interp_geoid, rows.shape)
+
+    image = dataset["image"].data
+    if is_lazy_array(image):
+        # Compute the offset chunk by chunk, on the chunk grid
+        def _compute_block_offset(
+            _block: np.ndarray, block_info: Dict = None
+        ) -> np.ndarray:
+            """
+            Computes the geoid offset of a lazy image chunk
+            """
+            (row_start, row_end), (col_start, col_end) = block_info[0][
+                "array-location"
+            ]
+            return compute_on_control_grid(
+                _compute_offset,
+                np.arange(row_start, row_end),
+                np.arange(col_start, col_end),
+                max_error=GEOID_MAX_ERROR,
+                step=GEOID_GRID_STEP,
+            )
 
-    xp, yp = np.meshgrid(xp, yp)
-    # Project the dataset grid into lat/lon coordinates
-    lonlat = list(
-        convert_pix_to_coord(dataset["georef_transform"].data, yp, xp)
+        return image.map_blocks(_compute_block_offset, dtype=np.float64)
+
+    # Obtain dataset's grid offset
+    ny, nx = image.shape
+    # The geoid being smooth at the DEM resolution, the offset
+    # is computed on a control grid and upsampled
+    return compute_on_control_grid(
+        _compute_offset,
+        np.arange(ny),
+        np.arange(nx),
+        max_error=GEOID_MAX_ERROR,
+        step=GEOID_GRID_STEP,
     )
 
-    # If the georef's units are meters (if is_projected),
-    # convert them to degrees
-    src_crs = rasterio.crs.CRS.from_dict(dataset.attrs["crs"])
-    if src_crs.is_projected:
-        # convert to global coordinates
-        proj = pyproj.Proj(src_crs)
-        lonlat = list(proj(lonlat[0], lonlat[1], inverse=True))
-
-    # transform to list (2xN)
-    lon_1d = np.reshape(
-        lonlat[0],
-        (dataset["image"].data.shape[0] * dataset["image"].data.shape[1]),
-    )
-    lat_1d = np.reshape(
-        lonlat[1],
-        (dataset["image"].data.shape[0] * dataset["image"].data.shape[1]),
-    )
-    coords = np.zeros((lon_1d.size, 2))
-    coords[:, 0] = lon_1d
-    coords[:, 1] = lat_1d
-    # Interpolate geoid on the dataset coordinates
-    # If the dataset coordinates are outside of the geoid scope,
-    # an error will be raised.
-    try:
-        # Get geoid values
-        interp_geoid = _interpolate_geoid(
-            geoid_path, coords, interpol_method="linear"
-        )
-    except ValueError:
-        logging.error(
-            "Input DSM %s coordinates outside of the %s geoid scope.",
-            dataset.attrs["input_img"],
-            geoid_path,
-        )
-        raise
 
-    # transform to array of shape dataset['im'].data.shape
-    arr_offset = np.reshape(interp_geoid, dataset["image"].data.shape)
+@lru_cache(maxsize=4)
+def _read_geoid(
+    geoid_filename: str,
+) -> Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]:
+    """
+    Reads the geoid grid once per process and per geoid file.
+
+    :param geoid_filename: geoid_filename
+    :type geoid_filename: str
+    :return: geoid grid (x, y) positions and its (x, y) values
+    :rtype: Tuple[Tuple[np.ndarray, np.ndarray], np.ndarray]
+    """
+    with rasterio.open(geoid_filename) as dataset:
+        transform = dataset.transform
+        # Get transform's step
+        step_x = transform[0]
+        step_y = -transform[4]
+
+        # coin BG
+        [ori_x, ori_y] = transform * (
+            0.5,
+            dataset.height - 0.5,
+        )  # positions au centre pixel
 
-    return arr_offset
+        # Get all geoid values
+        geoid_values = np.ascontiguousarray(dataset.read(1)[::-1, :].T)
+        # Get all geoid positions
+        x = ori_x + step_x * np.arange(dataset.width)
+        y = ori_y + step_y * np.arange(dataset.height)
+
+    # The cached grid is shared
+    geoid_values.flags.writeable = False
+    return (x, y), geoid_values
 
 
 def _interpolate_geoid(
@@ -451,28 +710,9 @@ def _interpolate_geoid(
     :return: interpolated position [lon,lat,estimate geoid]
     :rtype: 3D np.array
     """
-    dataset = rasterio.open(geoid_filename)
-
-    transform = dataset.transform
-    # Get transform's step
-    step_x = transform[0]
-    step_y = -transform[4]
-
-    # coin BG
-    [ori_x, ori_y] = transform * (
-        0.5,
-        dataset.height - 0.5,
-    )  # positions au centre pixel
-
-    # Compute last x and y geoid positions
-    last_x = ori_x + step_x * dataset.width
-    last_y = ori_y + step_y * dataset.height
-    # Get all geoid values
-    geoid_values = dataset.read(1)[::-1, :].transpose()
-    # Get all geoid positions
-    x = np.arange(ori_x, last_x, step_x)
-    y = np.arange(ori_y, last_y, step_y)
-    geoid_grid_coordinates = (x, y)
+    geoid_grid_coordinates, geoid_values = _read_geoid(
+        os.path.abspath(geoid_filename)
+    )
     # Interpolate geoid on the input coordinates
     interp_geoid = interpolate.interpn(
         geoid_grid_coordinates,
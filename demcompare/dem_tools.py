@@ -31,35 +31,57 @@ import copy
 import logging
 import os
 from enum import Enum
-from typing import Dict, Tuple, Union
-
-import matplotlib.pyplot as mpl_pyplot
+from typing import Dict, List, Tuple, Union
 
 # Third party imports
 import numpy as np
 import rasterio
+import rasterio.shutil
 import xarray as xr
 from astropy import units as u
+from matplotlib.figure import Figure
 from numpy.fft import fft2, ifft2, ifftshift
 from rasterio import Affine
+from rasterio.enums import Resampling
 from scipy.ndimage import convolve
 
 from .dataset_tools import (
+    cast_classification_layers,
     compute_offset_adapting_factor,
     create_dataset,
+    get_classification_layer_dtype,
     reproject_dataset,
 )
 from .img_tools import (
+    DEFAULT_OUTPUT_PROFILE,
     calc_spatial_freq_2d,
+    compute_on_control_grid,
+    compute_overview_factors,
+    compute_roi_crop_window,
+    compute_roi_window,
     convert_pix_to_coord,
     crop_rasterio_source_with_roi,
+    get_output_creation_options,
     neighbour_interpol,
 )
+from .lazy_tools import (
+    compute_if_lazy,
+    crop_rasterio_source_with_roi_lazy,
+    is_lazy_array,
+    read_rasterio_lazy,
+    to_lazy_like,
+    write_rasterio_lazy,
+)
 
 DEFAULT_NODATA = -32768
+# Default number of pixels read around an input ROI
+DEFAULT_ROI_MARGIN = 10
+# Maximum error in meters of the pixel distances of geographic DEMs,
+# computed on a control grid
+SLOPE_DISTANCE_MAX_ERROR = 1e-3
 
 
-def load_dem(
+def load_dem(  # pylint: disable=too-many-arguments, too-many-branches
     path: str,
     nodata: float = None,
     band: int = 1,
@@ -68,12 +90,22 @@ def load_dem(
     zunit: str = "m",
     input_roi: Union[bool, dict, Tuple] = False,
     classification_layers: Dict = None,
+    roi_margin: int = DEFAULT_ROI_MARGIN,
+    chunks: Union[int, Tuple[int, int], str, None] = None,
 ) -> xr.Dataset:
     """
     Reads the input DEM path and parameters and generates
     the DEM object as xr.Dataset to be handled in demcompare functions.
 
     A DEM can be any raster file opened by rasterio.
+    If an input_roi is given, only the raster window covering the ROI
+    (enlarged by roi_margin pixels) is read.
+    If chunks is given, the DEM and its classification layers are not
+    read but returned as lazy chunked (dask) arrays, each chunk being
+    read from its own rasterio window when computed.
+    The classification layers labels are stored as uint8 or uint16
+    (float32 if they do not fit), see
+    dataset_tools.get_classification_layer_dtype.
 
     :param path: path to dem (readable by rasterio)
     :type path: str
@@ -93,6 +125,13 @@ def load_dem(
     :type input_roi: bool, dict or Tuple
     :param classification_layers: input classification layers
     :type classification_layers: Dict or None
+    :param roi_margin: number of pixels read around the ROI, to keep
+            data available for later coregistration shifts.
+            Default: DEFAULT_ROI_MARGIN
+    :type roi_margin: int
+    :param chunks: (row, col) chunks size of the lazy mode
+            (int, tuple or "auto"). Default None: in-memory arrays
+    :type chunks: int, Tuple[int, int], str or None
     :return: dem  xr.DataSet containing : (see dataset_tools for details)
 
                 - image : 2D (row, col) xr.DataArray float32
@@ -113,6 +152,8 @@ def load_dem(
     dem_geotransform = src_dem.transform
     # Get rasterio BoundingBox(left, bottom, right, top)
     bounds_dem = src_dem.bounds
+    # Window to be read, None reads the full raster
+    window_dem = None
 
     if input_roi is not False:
         # Use ROI
@@ -137,24 +178,40 @@ def load_dem(
                 and "h" in input_roi
             ):
                 # coordinates
-                window_dem = rasterio.windows.Window(
+                roi_window = rasterio.windows.Window(
                     input_roi["x"],
                     input_roi["y"],
                     input_roi["w"],
                     input_roi["h"],
                 )
                 left, bottom, right, top = rasterio.windows.bounds(
-                    window_dem, dem_geotransform
+                    roi_window, dem_geotransform
                 )
                 bounds_dem = rasterio.coords.BoundingBox(
                     left, bottom, right, top
                 )
             else:
                 raise TypeError("Not the right conventions for ROI")
+            # Only read the ROI window (and its margin)
+            window_dem = compute_roi_window(
+                bounds_dem, dem_geotransform, src_dem.shape, margin=roi_margin
+            )
+            # Georeference the loaded image with the window transform
+            dem_geotransform = rasterio.windows.transform(
+                window_dem, src_dem.transform
+            )
     # Get dem raster image from band image
-    dem_image = src_dem.read(band)
-    # Test nodata in DEM
-    if np.all(dem_image == nodata):
+    if chunks is None:
+        dem_image = src_dem.read(band, window=window_dem)
+    else:
+        dem_image = read_rasterio_lazy(src_dem, band, window_dem, chunks)
+    # Test nodata in DEM, only in eager mode: on a lazy DEM it would
+    # read the whole DEM at load time
+    if (
+        nodata is not None
+        and not is_lazy_array(dem_image)
+        and np.all(dem_image == nodata)
+    ):
         raise ValueError(
             f"All values in {source_rasterio['source_dem'].name} are NODATA"
         )
@@ -163,30 +220,51 @@ def load_dem(
     if classification_layers:
         classif_layers = {}
         classif_layers["names"] = []
-        classif_layers["map_arrays"] = np.full(
-            (
-                dem_image.shape[0],
-                dem_image.shape[1],
-                len(classification_layers.keys()),
-            ),
-            np.nan,
-            dtype=np.float32,
-        )
+        map_arrays = []
         # Open the clasification layers with rasterio
         # and add the map_array to the layer dict
-        for idx, [name, layer] in enumerate(classification_layers.items()):
+        for name, layer in classification_layers.items():
             classif_rasterio_source = rasterio.open(layer["map_path"])
-            map_array = classif_rasterio_source.read(band)
-            if map_array.shape != dem_image.shape:
+            if classif_rasterio_source.shape != src_dem.shape:
                 raise ValueError(
                     f"Input classification layer {name} "
                     "does not have the same size"
                     " as its reference dem."
                 )
-
-            classif_layers["map_arrays"][:, :, idx] = map_array
+            # Read the same window as the dem
+            if chunks is None:
+                map_arrays.append(
+                    classif_rasterio_source.read(band, window=window_dem)
+                )
+            else:
+                map_arrays.append(
+                    read_rasterio_lazy(
+                        classif_rasterio_source,
+                        band,
+                        window_dem,
+                        dem_image.chunksize,
+                    )
+                )
             classif_layers["names"].append(name)
             source_rasterio[name] = classif_rasterio_source
+        # Store the maps labels with a compact type
+        classif_dtype = _get_maps_dtype(map_arrays)
+        if chunks is None:
+            classif_layers["map_arrays"] = np.empty(
+                (
+                    dem_image.shape[0],
+                    dem_image.shape[1],
+                    len(map_arrays),
+                ),
+                dtype=classif_dtype,
+            )
+            for idx, map_array in enumerate(map_arrays):
+                classif_layers["map_arrays"][:, :, idx] = map_array
+        else:
+            classif_layers["map_arrays"] = np.stack(
+                [map_array.astype(classif_dtype) for map_array in map_arrays],
+                axis=-1,
+            )
 
     # create dataset
     dem_dataset = create_dem(
@@ -206,6 +284,34 @@ def load_dem(
     return dem_dataset
 
 
+def _get_maps_dtype(map_arrays: List[np.ndarray]) -> np.dtype:
+    """
+    Returns the compact type storing the labels of the
+    input classification layer maps.
+    The range of lazy maps is given by their type to avoid reading them.
+
+    :param map_arrays: classification layer maps, in memory or lazy
+    :type map_arrays: List[np.ndarray]
+    :return: classification layer maps type
+    :rtype: np.dtype
+    """
+    min_value, max_value = 0, 0
+    for map_array in map_arrays:
+        if is_lazy_array(map_array) and np.issubdtype(
+            map_array.dtype, np.integer
+        ):
+            map_min = np.iinfo(map_array.dtype).min
+            map_max = np.iinfo(map_array.dtype).max
+        elif is_lazy_array(map_array) or np.any(np.mod(map_array, 1) != 0):
+            # Lazy float maps and non integer labels are kept as float32
+            return np.dtype(np.float32)
+        else:
+            map_min, map_max = np.min(map_array), np.max(map_array)
+        min_value = min(min_value, map_min)
+        max_value = max(max_value, map_max)
+    return get_classification_layer_dtype(min_value, max_value)
+
+
 def copy_dem(dem: xr.Dataset) -> xr.Dataset:
     """
     Returns a copy of the input dem.
@@ -243,10 +349,15 @@ def save_dem(
     dataset: xr.Dataset,
     filename: str,
     nodata: float = DEFAULT_NODATA,
+    output_profile: Dict = None,
 ) -> xr.Dataset:
     """
     Writes a Dataset in a tiff file.
     If new_array is set, new_array is used as data.
+    A lazy dataset is computed and written chunk by chunk.
+    The output GeoTIFF layout, compression and overviews are given
+    by output_profile (see img_tools.get_output_creation_options),
+    plain GeoTIFF by default.
     Returns written dataset.
 
     :param dataset:  xarray.DataSet containing the variables :
@@ -260,6 +371,8 @@ def save_dem(
     :type filename: str
     :param nodata:  value of nodata to use
     :type nodata: float
+    :param output_profile: output GeoTIFF profile, default None
+    :type output_profile: Dict or None
     :return:  xr.DataSet containing :
 
                 - image : 2D (row, col) xr.DataArray float32
@@ -282,38 +395,59 @@ def save_dem(
     )
 
     data = dataset["image"].data
-
     if len(dataset["image"].shape) == 2:
-        row, col = data.shape
-        with rasterio.open(
-            filename,
-            mode="w+",
-            driver="GTiff",
-            width=col,
-            height=row,
-            count=1,
-            dtype=data.dtype,
-            crs=previous_profile["crs"],
-            transform=previous_profile["transform"],
-        ) as source_ds:
-            source_ds.nodata = nodata
-            source_ds.write(data, 1)
+        bands = [data]
+    else:
+        bands = [data[:, :, dsp] for dsp in range(data.shape[2])]
 
+    driver, creation_options = get_output_creation_options(
+        output_profile, data.dtype
+    )
+    # The COG driver only copies an existing raster:
+    # write a temporary GeoTIFF and copy it in COG layout
+    write_filename = filename
+    if driver == "COG":
+        write_filename = os.path.splitext(filename)[0] + "_tmp_cog.tif"
+        gtiff_options = {"bigtiff": creation_options["bigtiff"]}
     else:
-        row, col, depth = data.shape
-        with rasterio.open(
-            filename,
-            mode="w+",
-            driver="GTiff",
-            width=col,
-            height=row,
-            count=depth,
-            dtype=data.dtype,
-            crs=previous_profile["crs"],
-            transform=previous_profile["transform"],
-        ) as source_ds:
-            for dsp in range(1, depth + 1):
-                source_ds.write(data[:, :, dsp - 1], dsp)
+        gtiff_options = creation_options
+
+    with rasterio.open(
+        write_filename,
+        mode="w+",
+        driver="GTiff",
+        width=data.shape[1],
+        height=data.shape[0],
+        count=len(bands),
+        dtype=data.dtype,
+        crs=previous_profile["crs"],
+        transform=previous_profile["transform"],
+        **gtiff_options,
+    ) as source_ds:
+        source_ds.nodata = nodata
+        for dsp, band in enumerate(bands, start=1):
+            if is_lazy_array(band):
+                write_rasterio_lazy(source_ds, band, dsp)
+            else:
+                source_ds.write(band, dsp)
+        if driver == "GTiff" and output_profile is not None:
+            if output_profile.get("overviews", False):
+                source_ds.build_overviews(
+                    compute_overview_factors(
+                        data.shape[:2],
+                        output_profile.get(
+                            "blocksize", DEFAULT_OUTPUT_PROFILE["blocksize"]
+                        ),
+                    ),
+                    Resampling.average,
+                )
+
+    if driver == "COG":
+        rasterio.shutil.copy(
+            write_filename, filename, driver="COG", **creation_options
+        )
+        os.remove(write_filename)
+
     dataset.attrs["input_img"] = filename
 
     return dataset
@@ -398,6 +532,7 @@ def create_dem(  # pylint: disable=too-many-arguments, too-many-branches
 ) -> xr.Dataset:
     """
     Creates dem from input array and transform.
+    The input array can be a lazy chunked (dask) array.
 
     The demcompare DEM is an xarray Dataset containing:
                 - image : 2D (row, col) xr.DataArray float32
@@ -462,11 +597,13 @@ def create_dem(  # pylint: disable=too-many-arguments, too-many-branches
             data = data[:, :, 0]
 
     # Convert nodata values to nan
+    # (np.where does not modify the input array, that can be lazy)
     data = data.astype(np.float32)
-    data[data == nodata] = np.nan
+    data = np.where(data == nodata, np.float32(np.nan), data)
 
     # Convert altimetric units to meter
-    data = ((data * u.Unit(zunit)).to(u.meter)).value
+    # (with the unit scale, as astropy quantities would load lazy arrays)
+    data = data * u.Unit(zunit).to(u.meter)
     new_zunit = u.meter
 
     # If no transform was given, add random transform and resolution
@@ -537,51 +674,36 @@ class SamplingSourceParameter(Enum):
     REF = "ref"
 
 
-def reproject_dems(
+def plan_dems_reprojection(
     sec: xr.Dataset,
     ref: xr.Dataset,
-    initial_shift_x: Union[int, float] = 0,
-    initial_shift_y: Union[int, float] = 0,
     sampling_source: str = SamplingSourceParameter.SEC.value,
-) -> Tuple[xr.Dataset, xr.Dataset, Tuple[float, float]]:
+) -> Dict:
     """
-    Reprojects both DEMs to common grid, common bounds and common georef origin.
+    Plans the reprojection of reproject_dems from the dems transforms,
+    bounds and CRSs only, without reading nor warping any pixel.
 
-    The common grid, bounds, georef origin are defined
-    by the sampling_source parameter.
-    It defines which is the sampling of the output DEMs.
+    The plan is a dict containing:
 
-    - If sampling_source is "ref":
-      ref is cropped to the common bounds
-      sec is cropped to the common bounds and resampled
-    - If sampling_source is "sec":
-      ref is cropped to the common bounds and resampled
-      sec is cropped to the common bounds
+    - sampling_source: 'ref' or 'sec' sampling of the output dems
+    - intersection_roi: common bounds in the static dem CRS
+    - static_window: window of the static dem source raster
+      cropped to the intersection_roi
+    - transform: output dems affine transform
+    - shape: output dems (row, col) shape
+    - adapting_factor: x and y coregistration offsets adapting factor
 
-    :param sec: dem to align xr.DataSet containing :
+    If the dems do not intersect, an exception is raised.
 
-                - im : 2D (row, col) xarray.DataArray float32
-                - trans: 1D (trans_len) xarray.DataArray
+    :param sec: dem to align xr.DataSet
     :type sec: xr.Dataset
-    :param ref: ref xr.DataSet containing :
-
-                - im : 2D (row, col) xarray.DataArray float32
-                - trans: 1D (trans_len) xarray.DataArray
+    :param ref: ref xr.DataSet
     :type ref: xr.Dataset
-    :param initial_shift_x: optional initial shift x
-    :type initial_shift_x: Union[int, float]
-    :param initial_shift_y: optional initial shift y
-    :type initial_shift_y: Union[int, float]
     :param sampling_source: 'ref' or 'sec', the sampling
                  value of the output dems, by defaut "sec"
     :type sampling_source: str
-    :return: reproj_cropped_sec xr.DataSet,
-                 reproj_cropped_ref xr.DataSet, adapting_factor.
-                 The xr.Datasets containing :
-
-                 - im : 2D (row, col) xarray.DataArray float32
-                 - trans: 1D (trans_len) xarray.DataArray
-    :rtype: xr.Dataset, xr.Dataset, Tuple[float, float]
+    :return: reprojection plan
+    :rtype: Dict
     """
     if sampling_source == SamplingSourceParameter.REF.value:
         interp = sec
@@ -630,49 +752,163 @@ def reproject_dems(
         min(transformed_static_bounds[3], transformed_interp_bounds[3]),
     )
 
+    # The static dem source raster window cropped to the
+    # intersection gives the output grid
+    src_static = static.attrs["source_rasterio"]["source_dem"]
+    static_window = compute_roi_crop_window(src_static, intersection_roi)
+
+    return {
+        "sampling_source": sampling_source,
+        "intersection_roi": intersection_roi,
+        "static_window": static_window,
+        "transform": src_static.window_transform(static_window),
+        "shape": (int(static_window.height), int(static_window.width)),
+        "adapting_factor": adapting_factor,
+    }
+
+
+def reproject_dems(  # pylint: disable=too-many-branches
+    sec: xr.Dataset,
+    ref: xr.Dataset,
+    initial_shift_x: Union[int, float] = 0,
+    initial_shift_y: Union[int, float] = 0,
+    sampling_source: str = SamplingSourceParameter.SEC.value,
+    plan: Dict = None,
+) -> Tuple[xr.Dataset, xr.Dataset, Tuple[float, float]]:
+    """
+    Reprojects both DEMs to common grid, common bounds and common georef origin.
+
+    The common grid, bounds, georef origin are defined
+    by the sampling_source parameter.
+    It defines which is the sampling of the output DEMs.
+
+    - If sampling_source is "ref":
+      ref is cropped to the common bounds
+      sec is cropped to the common bounds and resampled
+    - If sampling_source is "sec":
+      ref is cropped to the common bounds and resampled
+      sec is cropped to the common bounds
+
+    :param sec: dem to align xr.DataSet containing :
+
+                - im : 2D (row, col) xarray.DataArray float32
+                - trans: 1D (trans_len) xarray.DataArray
+    :type sec: xr.Dataset
+    :param ref: ref xr.DataSet containing :
+
+                - im : 2D (row, col) xarray.DataArray float32
+                - trans: 1D (trans_len) xarray.DataArray
+    :type ref: xr.Dataset
+    :param initial_shift_x: optional initial shift x
+    :type initial_shift_x: Union[int, float]
+    :param initial_shift_y: optional initial shift y
+    :type initial_shift_y: Union[int, float]
+    :param sampling_source: 'ref' or 'sec', the sampling
+                 value of the output dems, by defaut "sec"
+    :type sampling_source: str
+    :param plan: optional reprojection plan of plan_dems_reprojection
+                 with the same sampling_source, computed if None
+    :type plan: Dict
+    :return: reproj_cropped_sec xr.DataSet,
+                 reproj_cropped_ref xr.DataSet, adapting_factor.
+                 The xr.Datasets containing :
+
+                 - im : 2D (row, col) xarray.DataArray float32
+                 - trans: 1D (trans_len) xarray.DataArray
+    :rtype: xr.Dataset, xr.Dataset, Tuple[float, float]
+    """
+    # Plan the reprojection from the dems geometry
+    if plan is None:
+        plan = plan_dems_reprojection(sec, ref, sampling_source)
+    if sampling_source == SamplingSourceParameter.REF.value:
+        interp = sec
+        static = ref
+    else:  # sampling_source == SamplingSourceParameter.SEC.value:
+        interp = ref
+        static = sec
+    intersection_roi = plan["intersection_roi"]
+    adapting_factor = plan["adapting_factor"]
+
+    # Lazy datasets are cropped lazily with the same chunks
+    chunks = None
+    if is_lazy_array(static["image"].data):
+        chunks = static["image"].data.chunksize
+
     # Crop static dem
-    # rasterio.mask.mask function needs the src read by rasterio
+    # on the planned window of the src read by rasterio
     src_static = static.attrs["source_rasterio"]["source_dem"]
-    (
-        new_cropped_static,
-        new_cropped_static_transform,
-    ) = crop_rasterio_source_with_roi(src_static, intersection_roi)
+    if chunks is not None:
+        (
+            new_cropped_static,
+            new_cropped_static_transform,
+        ) = crop_rasterio_source_with_roi_lazy(
+            src_static, intersection_roi, chunks, plan["static_window"]
+        )
+    else:
+        (
+            new_cropped_static,
+            new_cropped_static_transform,
+        ) = crop_rasterio_source_with_roi(
+            src_static, intersection_roi, plan["static_window"]
+        )
 
     # Crop static classification layers
-    # rasterio.mask.mask function needs the src read by rasterio
+    # on the planned window of the src read by rasterio
     if "indicator" in static.coords:
-        cropped_static_classif = np.full(
-            (
-                new_cropped_static.shape[1],
-                new_cropped_static.shape[2],
-                len(static["classification_layer_masks"].coords["indicator"]),
-            ),
-            np.nan,
-            dtype=np.float32,
-        )
-        for idx, indicator in enumerate(
-            static["classification_layer_masks"].coords["indicator"].data
-        ):
-            src_classif = static.attrs["source_rasterio"][indicator]
-            (
-                new_cropped_classif,
-                _,
-            ) = crop_rasterio_source_with_roi(src_classif, intersection_roi)
-            cropped_static_classif[:, :, idx] = new_cropped_classif
-        # Remove confidence_measure dataArray from the dataset to update it
-        indicator = list(static.coords["indicator"].data)
-        static = static.drop_dims("indicator")
+        if chunks is not None:
+            lazy_classifs = []
+            for indicator in (
+                static["classification_layer_masks"].coords["indicator"].data
+            ):
+                src_classif = static.attrs["source_rasterio"][indicator]
+                (
+                    new_cropped_classif,
+                    _,
+                ) = crop_rasterio_source_with_roi_lazy(
+                    src_classif, intersection_roi, chunks, plan["static_window"]
+                )
+                lazy_classifs.append(
+                    new_cropped_classif[0].astype(
+                        static["classification_layer_masks"].dtype
+                    )
+                )
+            cropped_static_classif = np.stack(lazy_classifs, axis=-1)
+        else:
+            cropped_static_classif = np.empty(
+                (
+                    new_cropped_static.shape[1],
+                    new_cropped_static.shape[2],
+                    len(
+                        static["classification_layer_masks"].coords["indicator"]
+                    ),
+                ),
+                dtype=static["classification_layer_masks"].dtype,
+            )
+            for idx, indicator in enumerate(
+                static["classification_layer_masks"].coords["indicator"].data
+            ):
+                src_classif = static.attrs["source_rasterio"][indicator]
+                (
+                    new_cropped_classif,
+                    _,
+                ) = crop_rasterio_source_with_roi(
+                    src_classif, intersection_roi, plan["static_window"]
+                )
+                cropped_static_classif[:, :, idx] = new_cropped_classif
+        # Build the cropped classification layers apart from the
+        # static dataset to avoid aligning them on the uncropped image
         coords_classification_layers = {
             "row": np.arange(new_cropped_static.shape[1]),
             "col": np.arange(new_cropped_static.shape[2]),
-            "indicator": indicator,
+            "indicator": list(static.coords["indicator"].data),
         }
-
-        static["classification_layer_masks"] = xr.DataArray(
+        cropped_static_classification_layers = xr.DataArray(
             data=cropped_static_classif,
             coords=coords_classification_layers,
             dims=["row", "col", "indicator"],
         )
+    else:
+        cropped_static_classification_layers = None
 
     # Create cropped static dem
     reproj_cropped_static = create_dem(
@@ -684,11 +920,7 @@ def reproject_dems(
         zunit=static.attrs["zunit"],
         input_img=static.attrs["input_img"],
         bounds=intersection_roi,
-        classification_layer_masks=(
-            static.classification_layer_masks
-            if "indicator" in static.coords
-            else None
-        ),
+        classification_layer_masks=cropped_static_classification_layers,
     )
 
     # Full_interp represent a dem with the full interp image
@@ -867,25 +1099,23 @@ def accumulates_class_layers(  # pylint:disable=too-many-branches
         if isinstance(classif_layers_datarray, xr.DataArray):
             # If the dataarray already existed,
             # update it
-            nb_row = classif_layers_datarray.shape[0]
-            nb_col = classif_layers_datarray.shape[1]
-            nb_indicator = (
-                classif_layers_datarray.shape[2]
-                + sec["classification_layer_masks"].shape[2]
+            # Add the sec indicators to the DataArray, in the
+            # smallest type storing both ref and sec labels
+            classif_dtype = np.promote_types(
+                classif_layers_datarray.dtype,
+                sec["classification_layer_masks"].dtype,
             )
-
-            # Add a new indicator to the DataArray
-            updated_data = np.full(
-                (nb_row, nb_col, nb_indicator), np.nan, dtype=np.float32
+            updated_data = np.concatenate(
+                [
+                    cast_classification_layers(
+                        classif_layers_datarray.data, classif_dtype
+                    ),
+                    cast_classification_layers(
+                        sec["classification_layer_masks"].data, classif_dtype
+                    ),
+                ],
+                axis=-1,
             )
-            # Ref classification layers
-            updated_data[
-                :, :, : -sec["classification_layer_masks"].shape[2]
-            ] = classif_layers_datarray.data
-            # Sec classification layers
-            updated_data[:, :, classif_layers_datarray.shape[2] :] = sec[
-                "classification_layer_masks"
-            ].data
             # quick fix to avoid deprecation warning using to_numpy
             # Clean must be done using xr.dataArray all along and not numpy
             indicator = np.copy(
@@ -969,73 +1199,38 @@ def compute_dem_slope(
     :rtype: np.ndarray
     """
 
-    def _get_orthodromic_distance(
-        lon1: Union[float, np.ndarray],
-        lat1: Union[float, np.ndarray],
-        lon2: Union[float, np.ndarray],
-        lat2: Union[float, np.ndarray],
-    ):
-        """
-        Get Orthodromic distance from two (lat,lon) coordinates
-
-        :param lon1: longitude 1
-        :type lon1: Union[float, np.ndarray]
-        :param lat1: latitude 1
-        :type lat1: Union[float, np.ndarray]
-        :param lon2: longitude 2
-        :type lon2: Union[float, np.ndarray]
-        :param lat2: latitude 2
-        :type lat2: Union[float, np.ndarray]
-        :return: orthodromic distance
-        """
-        # WGS-84 equatorial radius in km
-        radius_equator = 6378137.0
-        return radius_equator * np.arccos(
-            np.cos(lat1 * np.pi / 180)
-            * np.cos(lat2 * np.pi / 180)
-            * np.cos((lon2 - lon1) * np.pi / 180)
-            + np.sin(lat1 * np.pi / 180) * np.sin(lat2 * np.pi / 180)
-        )
-
-    crs = dataset.attrs["crs"]
-    if not crs.is_projected:
-        # Our dem is not projected, we can't simply use the pixel resolution
-        # we need to compute resolution between each point
-
-        # Create grid of image's size
-        ny, nx = dataset["image"].data.shape
-        xp = np.arange(nx)
-        yp = np.arange(ny)
-        xp, yp = np.meshgrid(xp, yp)
-        # Convert all pixels on grid to lat lon
-        lon, lat = convert_pix_to_coord(
-            dataset["georef_transform"].data, yp, xp
-        )
-        # lon, lat is flattened in rasterio > 1.4.0, to be corrected
-        # quick fix, reshape after function
-        lon = np.reshape(lon, (ny, nx))
-        lat = np.reshape(lat, (ny, nx))
-        lonr = np.roll(lon, 1, 1)
-        latl = np.roll(lat, 1, 0)
-        # Get distance between all pixels
-        distx = _get_orthodromic_distance(lon, lat, lonr, lat)
-        disty = _get_orthodromic_distance(lon, lat, lon, latl)
-
-        # deal with singularities at edges
-        distx[:, 0] = distx[:, 1]
-        disty[0] = disty[1]
-    else:
-        # if resolution is define, all pixels consider this distance
-        distx = np.abs(dataset.attrs["xres"])
-        disty = np.abs(dataset.attrs["yres"])
+    # Get the pixels distances in meters, as scalars,
+    # per row vectors or full grids
+    distx, disty = compute_pixel_distances(dataset)
 
     # Convolution kernel
     conv_x = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
     conv_y = conv_x.transpose()
 
     # Now we do the convolutions :
-    gx = convolve(dataset["image"].data, conv_x, mode="reflect")
-    gy = convolve(dataset["image"].data, conv_y, mode="reflect")
+    image = dataset["image"].data
+    if is_lazy_array(image):
+        # Chunk by chunk, with a one pixel overlap between chunks
+        gx = image.map_overlap(
+            convolve,
+            depth=1,
+            boundary="reflect",
+            weights=conv_x,
+            mode="reflect",
+        )
+        gy = image.map_overlap(
+            convolve,
+            depth=1,
+            boundary="reflect",
+            weights=conv_y,
+            mode="reflect",
+        )
+        if isinstance(distx, np.ndarray):
+            distx = to_lazy_like(distx, image)
+            disty = to_lazy_like(disty, image)
+    else:
+        gx = convolve(image, conv_x, mode="reflect")
+        gy = convolve(image, conv_y, mode="reflect")
 
     # And eventually we do compute tan(slope) and aspect
     tan_slope = np.sqrt((gx / distx) ** 2 + (gy / disty) ** 2) / 8
@@ -1052,8 +1247,13 @@ def compute_dem_slope(
     # Slope
     coords_slope = [dataset.coords["row"], dataset.coords["col"]]
     # Add computed slope in the 3D classification layer format
-    data = np.full((slope.shape[0], slope.shape[1]), np.nan, dtype=np.float32)
-    data[:, :] = slope
+    if is_lazy_array(slope):
+        data = slope.astype(np.float32)
+    else:
+        data = np.full(
+            (slope.shape[0], slope.shape[1]), np.nan, dtype=np.float32
+        )
+        data[:, :] = slope
     # Create the dataarray
     # In case there is a single dem, we name the datarray
     # as ref_slope. If there are two arrays, the sec slope
@@ -1071,6 +1271,108 @@ def compute_dem_slope(
     return slope
 
 
+def compute_pixel_distances(
+    dataset: xr.Dataset,
+) -> Tuple[Union[float, np.ndarray], Union[float, np.ndarray]]:
+    """
+    Computes the distances in meters between each pixel and its
+    previous col (distx) and row (disty) pixels.
+
+    For a projected DEM, the distances are its resolution.
+    For a geographic north-up DEM, the orthodromic distances only depend
+    on the row latitude: they are returned as (row, 1) vectors
+    broadcastable over the image.
+    Otherwise they are computed on a control grid as 2D (row, col) arrays.
+
+    :param dataset: dataset
+    :type dataset: xr.DataSet containing :
+
+                - image : 2D (row, col) xr.DataArray float32
+                - georef_transform: 1D (trans_len) xr.DataArray
+                - classification_layer_masks : 3D (row, col, indicator)
+                  xr.DataArray
+    :return: distx, disty
+    :rtype: Tuple[float or np.ndarray, float or np.ndarray]
+    """
+    crs = dataset.attrs["crs"]
+    if crs.is_projected:
+        # if resolution is define, all pixels consider this distance
+        return np.abs(dataset.attrs["xres"]), np.abs(dataset.attrs["yres"])
+
+    # Our dem is not projected, we can't simply use the pixel resolution
+    # we need to compute resolution between each point
+    transform_array = dataset["georef_transform"].data
+    ny, nx = dataset["image"].shape
+
+    def _compute_distances(
+        rows: np.ndarray, cols: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the distances of the (rows, cols) pixels
+        to their previous col and row pixels
+        """
+        # Convert the pixels and their neighbours to lat lon
+        lon, lat = convert_pix_to_coord(transform_array, rows, cols)
+        lonr, _ = convert_pix_to_coord(transform_array, rows, cols - 1)
+        _, latl = convert_pix_to_coord(transform_array, rows - 1, cols)
+        return (
+            _get_orthodromic_distance(lon, lat, lonr, lat),
+            _get_orthodromic_distance(lon, lat, lon, latl),
+        )
+
+    if transform_array[2] == 0 and transform_array[4] == 0:
+        # North-up grid: the distances are the same along each row,
+        # computed on its second col
+        distx, disty = _compute_distances(
+            np.arange(ny)[:, np.newaxis], np.ones((1, 1))
+        )
+    else:
+        # Get distance between all pixels, the distances being
+        # smooth they are computed on a control grid and upsampled
+        distx, disty = compute_on_control_grid(
+            _compute_distances,
+            np.arange(ny),
+            np.arange(nx),
+            max_error=SLOPE_DISTANCE_MAX_ERROR,
+        )
+
+    # deal with singularities at edges
+    if distx.shape[1] > 1:
+        distx[:, 0] = distx[:, 1]
+    if ny > 1:
+        disty[0] = disty[1]
+    return distx, disty
+
+
+def _get_orthodromic_distance(
+    lon1: Union[float, np.ndarray],
+    lat1: Union[float, np.ndarray],
+    lon2: Union[float, np.ndarray],
+    lat2: Union[float, np.ndarray],
+):
+    """
+    Get Orthodromic distance from two (lat,lon) coordinates
+
+    :param lon1: longitude 1
+    :type lon1: Union[float, np.ndarray]
+    :param lat1: latitude 1
+    :type lat1: Union[float, np.ndarray]
+    :param lon2: longitude 2
+    :type lon2: Union[float, np.ndarray]
+    :param lat2: latitude 2
+    :type lat2: Union[float, np.ndarray]
+    :return: orthodromic distance
+    """
+    # WGS-84 equatorial radius in km
+    radius_equator = 6378137.0
+    return radius_equator * np.arccos(
+        np.cos(lat1 * np.pi / 180)
+        * np.cos(lat2 * np.pi / 180)
+        * np.cos((lon2 - lon1) * np.pi / 180)
+        + np.sin(lat1 * np.pi / 180) * np.sin(lat2 * np.pi / 180)
+    )
+
+
 def compute_and_save_image_plots(
     dem: xr.Dataset,
     plot_path: str = None,
@@ -1102,13 +1404,20 @@ def compute_and_save_image_plots(
 
     # Create and save plot using the dem_plot function
 
-    # Compute mean of dem image data
-    mu = np.nanmean(dem["image"].data)
-    # Compute std also
-    sigma = np.nanstd(dem["image"].data)
+    # The figure is only built if it is saved
+    if not plot_path:
+        return
 
-    # Plot with matplotlib.pyplot
-    fig, fig_ax = mpl_pyplot.subplots(figsize=(7.0, 8.0))
+    # Compute mean and std of dem image data
+    # (in a single pass over the chunks of a lazy image)
+    mu, sigma = compute_if_lazy(
+        np.nanmean(dem["image"].data), np.nanstd(dem["image"].data)
+    )
+
+    # Plot with a matplotlib Figure, not registered in pyplot
+    # so that the plots can be drawn by concurrent output writers
+    fig = Figure(figsize=(7.0, 8.0))
+    fig_ax = fig.add_subplot()
     # add fig title if present
     if fig_title:
         fig_ax.set_title(fig_title, fontsize="large")
@@ -1143,10 +1452,7 @@ def compute_and_save_image_plots(
         )
 
     # Save plot
-    if plot_path:
-        mpl_pyplot.savefig(plot_path, dpi=100, bbox_inches="tight")
-
-    mpl_pyplot.close()
+    fig.savefig(plot_path, dpi=100, bbox_inches="tight")
 
 
 def verify_fusion_layers(dem: xr.Dataset, classif_cfg: Dict, support: str):
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains a wrapper running demcompare on one reference
+dem and a list of secondary dems, the reference being loaded once
+"""
+
+import argparse
+import copy
+import csv
+import json
+import logging
+import multiprocessing as mp
+import os
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+# Third party imports
+import argcomplete
+
+from demcompare import load_input_dem, log_conf
+from demcompare import run as run_demcompare_on_sec
+from demcompare.demcompare_tiles import get_coreg_results
+from demcompare.helpers_init import read_config_file, save_config_file
+from demcompare.internal_typing import ConfigType
+
+# Summary table of the batch written in the output_dir
+BATCH_SUMMARY_FILE = "batch_summary.csv"
+
+# Input ref loaded once per process and shared by its secondary dems
+_BATCH_CACHE: Dict = {}
+
+
+def get_parser():
+    """
+    ArgumentParser for demcompare_batch
+
+    :return: parser
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare a reference Digital Elevation Model "
+        "to a list of secondary Digital Elevation Models",
+        fromfile_prefix_chars="@",
+    )
+
+    parser.add_argument(
+        "batch_config",
+        metavar="config.json",
+        help=(
+            "path to a json file containing the paths to "
+            "input and output files, the list of input secondary dems "
+            "and the algorithm parameters"
+        ),
+    )
+
+    parser.add_argument(
+        "--loglevel",
+        default="WARNING",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+        help="Logger level (default: INFO. Should be one of "
+        "(DEBUG, INFO, WARNING, ERROR, CRITICAL)",
+    )
+
+    return parser
+
+
+def verify_config(dict_config: ConfigType) -> Tuple[List[str], int]:
+    """
+    Functions that verify the batch configuration
+
+    :param dict_config: batch configuration with the input_secs list
+        and the optional batch parameters
+    :type dict_config: ConfigType
+    :return: secondary dems names, nb_cpu
+    :rtype: Tuple[List[str], int]
+    """
+    if "input_sec" in dict_config:
+        raise ValueError("The secondary dems are given by input_secs")
+    if (
+        "input_secs" not in dict_config
+        or not isinstance(dict_config["input_secs"], list)
+        or not dict_config["input_secs"]
+    ):
+        raise ValueError("input_secs must be a non empty list")
+
+    names = []
+    for input_sec in dict_config["input_secs"]:
+        if not isinstance(input_sec, dict) or "path" not in input_sec:
+            raise ValueError("Each input_secs dem must have a path")
+        # The secondary dem output directory name,
+        # its file name without extension by default
+        names.append(
+            input_sec["name"]
+            if "name" in input_sec
+            else os.path.splitext(os.path.basename(input_sec["path"]))[0]
+        )
+    if len(set(names)) != len(names):
+        raise ValueError(f"The input_secs names are not unique: {names}")
+
+    nb_cpu = 1
+    if "batch" in dict_config and "nb_cpu" in dict_config["batch"]:
+        nb_cpu = dict_config["batch"]["nb_cpu"]
+        if (
+            not isinstance(nb_cpu, int)
+            or isinstance(nb_cpu, bool)
+            or nb_cpu <= 0
+        ):
+            raise ValueError("Number of CPUs is incorrect")
+        if nb_cpu > len(os.sched_getaffinity(0)):
+            raise ValueError(
+                "Number of CPUs in the config is more than available CPUs"
+            )
+
+    return names, nb_cpu
+
+
+def init_batch_process(input_ref_cfg: ConfigType):
+    """
+    Loads the input ref once in the current process, the rasterio
+    sources of the loaded dem not being shareable between processes.
+
+    :param input_ref_cfg: input_ref configuration
+    :type input_ref_cfg: ConfigType
+    """
+    _BATCH_CACHE["input_ref"] = load_input_dem(input_ref_cfg)
+
+
+def process_secondary(args) -> Tuple[str, Optional[str]]:
+    """
+    Function running `demcompare` on one secondary dem with the input
+    ref loaded by init_batch_process, possibly with multiprocessing.
+
+    :param args: arguments list to compute process_secondary
+        with multiprocessing, see list below
+    :type args: list
+
+        :param name: Name of the secondary dem
+        :type name: str
+        :param config: Secondary dem's demcompare configuration file
+        :type config: str
+        :param loglevel: log level
+        :type loglevel: str
+    :return: name of the secondary dem, error message or None
+    :rtype: Tuple[str, Optional[str]]
+    """
+    name, config, loglevel = args
+
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    error = None
+    try:
+        run_demcompare_on_sec(
+            config, loglevel=loglevel, input_ref=_BATCH_CACHE["input_ref"]
+        )
+    # A failing secondary dem does not stop the batch
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error(
+            "Secondary dem %s failed: %s", name, traceback.format_exc()
+        )
+        error = f"{type(exc).__name__}: {exc}"
+
+    # Close the log file of the secondary dem run
+    for handler in list(root_logger.handlers):
+        if handler not in handlers and isinstance(handler, logging.FileHandler):
+            root_logger.removeHandler(handler)
+            handler.close()
+
+    return name, error
+
+
+def get_secondary_results(
+    output_dir: str, dict_config: ConfigType
+) -> Dict[str, float]:
+    """
+    Get the coregistration offsets and the global statistics
+    of one secondary dem from its output files
+
+    :param output_dir: output directory of the secondary dem
+    :type output_dir: str
+    :param dict_config: batch configuration
+    :type dict_config: ConfigType
+    :return: summary values by column name
+    :rtype: Dict[str, float]
+    """
+    results = {}
+    if "coregistration" in dict_config:
+        with open(
+            os.path.join(
+                output_dir, "coregistration", "coregistration_results.json"
+            ),
+            "r",
+            encoding="utf-8",
+        ) as json_file:
+            coreg_results = json.load(json_file)
+        (
+            results["dx"],
+            results["dy"],
+            results["dz"],
+            results["percentage_valid_points_ref"],
+            results["percentage_valid_points_sec"],
+        ) = get_coreg_results(coreg_results)
+
+    if "statistics" in dict_config:
+        for dem_processing_method in dict_config["statistics"]:
+            with open(
+                os.path.join(
+                    output_dir,
+                    "stats",
+                    dem_processing_method,
+                    "global",
+                    "stats_results.json",
+                ),
+                "r",
+                encoding="utf-8",
+            ) as json_file:
+                global_stats = json.load(json_file)["0"]
+            for metric, value in global_stats.items():
+                if metric != "Set Name":
+                    results[f"{dem_processing_method}_{metric}"] = value
+
+    return results
+
+
+def run_batch(batch_config: str, loglevel=logging.WARNING) -> List[Dict]:
+    """
+    Runs demcompare on the input ref and each input_secs dem,
+    writing each secondary dem outputs in output_dir/<name>
+    and the summary table of all of them in output_dir
+
+    :param batch_config: path to the batch json configuration file
+    :type batch_config: str
+    :param loglevel: log level
+    :type loglevel: str
+    :return: summary table rows, one per secondary dem
+    :rtype: List[Dict]
+    """
+    # Logging configuration
+    log_conf.setup_logging(default_level=loglevel)
+
+    # Relative paths of the input dems are made absolute
+    dict_config = read_config_file(batch_config)
+
+    # Verify config and get the secondary dems names
+    names, nb_cpu = verify_config(dict_config)
+
+    output_dir = os.path.abspath(dict_config["output_dir"])
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Write the demcompare configuration of each secondary dem
+    tasks = []
+    for name, input_sec in zip(names, dict_config["input_secs"]):
+        sec_config = copy.deepcopy(dict_config)
+        sec_config.pop("input_secs")
+        sec_config.pop("batch", None)
+        sec_config["input_sec"] = {
+            key: value for key, value in input_sec.items() if key != "name"
+        }
+        sec_config["output_dir"] = os.path.join(output_dir, name)
+        os.makedirs(sec_config["output_dir"], exist_ok=True)
+        config = os.path.join(sec_config["output_dir"], f"{name}_config.json")
+        save_config_file(config, sec_config)
+        tasks.append((name, config, loglevel))
+
+    logging.info(
+        "Running demcompare on %s secondary dems with %s processes",
+        len(tasks),
+        nb_cpu,
+    )
+    # The input ref is loaded once per process
+    if nb_cpu == 1:
+        init_batch_process(dict_config["input_ref"])
+        errors = dict(process_secondary(task) for task in tasks)
+        _BATCH_CACHE.clear()
+    else:
+        with mp.Pool(
+            processes=nb_cpu,
+            initializer=init_batch_process,
+            initargs=(dict_config["input_ref"],),
+        ) as pool:
+            errors = dict(pool.map(process_secondary, tasks))
+
+    # Summary table of the secondary dems results
+    summary = []
+    for name, input_sec in zip(names, dict_config["input_secs"]):
+        row = {"name": name, "path": input_sec["path"]}
+        if errors[name] is None:
+            row.update(
+                get_secondary_results(
+                    os.path.join(output_dir, name), dict_config
+                )
+            )
+        row["error"] = errors[name]
+        summary.append(row)
+
+    fieldnames = []
+    for row in summary:
+        fieldnames.extend(key for key in row if key not in fieldnames)
+    with open(
+        os.path.join(output_dir, BATCH_SUMMARY_FILE),
+        "w",
+        encoding="utf-8",
+        newline="",
+    ) as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(summary)
+
+    return summary
+
+
+def main():
+    """
+    Call demcompare-batch's main
+    """
+
+    parser = get_parser()
+    argcomplete.autocomplete(parser)
+    args = parser.parse_args()
+
+    try:
+        run_batch(args.batch_config, args.loglevel)
+
+    except Exception:  # pylint: disable=broad-except
+        logging.error(" Demcompare %s", traceback.format_exc())
+
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,7 @@ from astropy import units as u
 
 # Demcompare imports
 from .dem_processing import DemProcessing
+from .img_tools import check_output_profile
 from .internal_typing import ConfigType
 from .stats_processing import StatsProcessing
 
@@ -76,23 +77,20 @@ def read_config_file(config_file: str) -> ConfigType:
         config = json.load(_fstream)
         config_dir = os.path.abspath(os.path.dirname(config_file))
         # make potential relative paths absolute
-        if "input_ref" in config:
-            config["input_ref"]["path"] = make_relative_path_absolute(
-                config["input_ref"]["path"], config_dir
+        input_dems_cfg = [
+            config[input_dem]
+            for input_dem in ["input_ref", "input_sec"]
+            if input_dem in config
+        ]
+        # demcompare_batch list of input secs
+        if "input_secs" in config:
+            input_dems_cfg.extend(config["input_secs"])
+        for input_dem_cfg in input_dems_cfg:
+            input_dem_cfg["path"] = make_relative_path_absolute(
+                input_dem_cfg["path"], config_dir
             )
-            if "classification_layers" in config["input_ref"]:
-                for _, classif_cfg in config["input_ref"][
-                    "classification_layers"
-                ].items():
-                    classif_cfg["map_path"] = make_relative_path_absolute(
-                        classif_cfg["map_path"], config_dir
-                    )
-        if "input_sec" in config:
-            config["input_sec"]["path"] = make_relative_path_absolute(
-                config["input_sec"]["path"], config_dir
-            )
-            if "classification_layers" in config["input_sec"]:
-                for _, classif_cfg in config["input_sec"][
+            if "classification_layers" in input_dem_cfg:
+                for _, classif_cfg in input_dem_cfg[
                     "classification_layers"
                 ].items():
                     classif_cfg["map_path"] = make_relative_path_absolute(
@@ -149,9 +147,20 @@ def compute_initialization(config_json: str) -> ConfigType:
         )
     if "statistics" in cfg:
         for dem_processing_method in cfg["statistics"]:
-            cfg["statistics"][dem_processing_method]["output_dir"] = (
-                os.path.join(cfg["output_dir"], "stats", dem_processing_method)
-            )
+            cfg["statistics"][dem_processing_method][
+                "output_dir"
+            ] = os.path.join(cfg["output_dir"], "stats", dem_processing_method)
+
+    # Save output_profile parameter in "coregistration"
+    # and/or "statistics" dict
+    if "output_profile" in cfg:
+        if "coregistration" in cfg:
+            cfg["coregistration"]["output_profile"] = cfg["output_profile"]
+        if "statistics" in cfg:
+            for dem_processing_method in cfg["statistics"]:
+                cfg["statistics"][dem_processing_method][
+                    "output_profile"
+                ] = cfg["output_profile"]
 
     return cfg
 
@@ -226,6 +235,21 @@ def check_input_parameters(cfg: ConfigType):  # noqa: C901
                 raise NameError(
                     f"ERROR: input DSM zunit ({output_msg}) not a lenght unit"
                 )
+    # Check output GeoTIFF profile
+    if "output_profile" in cfg:
+        check_output_profile(cfg["output_profile"])
+
+    # Check number of background output writers
+    if "output_writers" in cfg and (
+        not isinstance(cfg["output_writers"], int)
+        or isinstance(cfg["output_writers"], bool)
+        or cfg["output_writers"] < 0
+    ):
+        raise ValueError(
+            "ERROR: output_writers must be a positive integer,"
+            f" got {cfg['output_writers']}"
+        )
+
     # Check report config
     if "report" in cfg:
         # Supported for now: default (-> sphinx) and sphinx
@@ -22,21 +22,56 @@
 This module contains generic functions associated to raster images.
 It consists mainly on wrappers to rasterio functions.
 """
+# pylint:disable=too-many-lines
 
 # Standard imports
 import logging
-from typing import List, Tuple, Union
+from typing import Callable, Dict, List, Tuple, Union
 
 # Third party imports
 import numpy as np
 import rasterio
 import rasterio.crs
-import rasterio.mask
+import rasterio.features
 import rasterio.warp
 import rasterio.windows
 from rasterio import Affine
+from rasterio.errors import WindowError
 from scipy.interpolate import griddata
 
+# Output GeoTIFF profile default values, see get_output_creation_options.
+# The default profile writes plain uncompressed and untiled GeoTIFF.
+DEFAULT_OUTPUT_PROFILE = {
+    "cog": False,
+    "tiled": False,
+    "blocksize": 512,
+    "compress": None,
+    "predictor": None,
+    "max_z_error": None,
+    "num_threads": "ALL_CPUS",
+    "bigtiff": "IF_SAFER",
+    "overviews": False,
+}
+# Available output compressions
+OUTPUT_COMPRESSIONS = [
+    "deflate",
+    "zstd",
+    "lzw",
+    "lerc",
+    "lerc_deflate",
+    "lerc_zstd",
+]
+
+# Default control grid step in pixels and number of rows
+# upsampled at once, see compute_on_control_grid
+DEFAULT_CONTROL_GRID_STEP = 32
+DEFAULT_CONTROL_GRID_BLOCK_ROWS = 1024
+
+# Sub-pixel shift methods of shift_image
+SHIFT_METHODS = ["bilinear", "bicubic", "fourier", "nearest"]
+# Cubic convolution kernel parameter of the bicubic shift
+BICUBIC_KERNEL_PARAMETER = -0.5
+
 
 def convert_pix_to_coord(
     transform_array: Union[List, np.ndarray],
@@ -57,62 +92,180 @@ def convert_pix_to_coord(
     :return: converted x,y in geographic coordinates from affine transform
     :rtype: Tuple[np.ndarray, np.ndarray]
     """
-    # Obtain the dataset transform in affine format from coefficients
-    transform = Affine.from_gdal(
-        transform_array[0],
-        transform_array[1],
-        transform_array[2],
-        transform_array[3],
-        transform_array[4],
-        transform_array[5],
+    # Transform the input pixels upper left corners (offset "ul")
+    # to dataset geographic coordinates with the GDAL
+    # Geo Transform coefficients, vectorized on the input arrays
+    x = (
+        transform_array[0]
+        + np.multiply(col, transform_array[1])
+        + np.multiply(row, transform_array[2])
+    )
+    y = (
+        transform_array[3]
+        + np.multiply(col, transform_array[4])
+        + np.multiply(row, transform_array[5])
     )
-    # Set the offset to ul (upper left)
-    # Transform the input pixels to dataset geographic coordinates
-    x, y = rasterio.transform.xy(transform, row, col, offset="ul")
 
-    if not isinstance(x, int):
-        x = np.array(x)
-        y = np.array(y)
+    return np.array(x), np.array(y)
+
+
+def roi_to_geometry(roi: List[float]) -> Dict:
+    """
+    Transforms the input Region of Interest to a geojson like polygon
 
-    return x, y
+    :param roi: region of interest (left, bottom, right, top)
+    :type roi: List[float]
+    :return: geojson like polygon
+    :rtype: Dict
+    """
+    polygon = [
+        [roi[0], roi[1]],
+        [roi[2], roi[1]],
+        [roi[2], roi[3]],
+        [roi[0], roi[3]],
+        [roi[0], roi[1]],
+    ]
+    return {"type": "Polygon", "coordinates": [polygon]}
 
 
 def crop_rasterio_source_with_roi(
-    src: rasterio.DatasetReader, roi: List[float]
+    src: rasterio.DatasetReader,
+    roi: List[float],
+    window: Union[rasterio.windows.Window, None] = None,
 ) -> Tuple[np.ndarray, Affine]:
     """
     Transforms the input Region of Interest to polygon and
-    crops the input rasterio source DEM and its transform.
+    crops the input rasterio source DEM and its transform,
+    as rasterio.mask.mask(all_touched=True, crop=True).
     If the ROI is outside of the input DEM, an exception is raised.
 
     :param src: input source dataset in rasterio format
     :type src: rasterio.DatasetReader
     :param roi: region of interest to crop
     :type roi: List[float]
+    :param window: optional crop window of the ROI given by
+        compute_roi_crop_window, computed if None
+    :type window: rasterio.windows.Window or None
     :return: cropped dem and its affine transform
     :rtype: Tuple[np.ndarray, Affine]
     """
+    if window is None:
+        window = compute_roi_crop_window(src, roi)
+    new_cropped_transform = src.window_transform(window)
 
-    polygon = [
-        [roi[0], roi[1]],
-        [roi[2], roi[1]],
-        [roi[2], roi[3]],
-        [roi[0], roi[3]],
-        [roi[0], roi[1]],
-    ]
-    geom_like_polygon = {"type": "Polygon", "coordinates": [polygon]}
+    # Read the window and fill the pixels outside of the ROI
+    # and the source nodata pixels with the nodata value
+    new_cropped_dem = src.read(window=window, masked=True)
+    outside = rasterio.features.geometry_mask(
+        [roi_to_geometry(roi)],
+        out_shape=new_cropped_dem.shape[-2:],
+        transform=new_cropped_transform,
+        all_touched=True,
+    )
+    new_cropped_dem.mask = np.ma.getmaskarray(new_cropped_dem) | outside
+    new_cropped_dem = new_cropped_dem.filled(
+        src.nodata if src.nodata is not None else 0
+    )
+
+    return new_cropped_dem, new_cropped_transform
+
+
+def compute_roi_crop_window(
+    src: rasterio.DatasetReader, roi: List[float]
+) -> rasterio.windows.Window:
+    """
+    Computes the window of the input rasterio source cropped to the
+    input Region of Interest by crop_rasterio_source_with_roi,
+    from the source geometry only.
+    If the ROI is outside of the input DEM, an exception is raised.
+
+    :param src: input source dataset in rasterio format
+    :type src: rasterio.DatasetReader
+    :param roi: region of interest to crop
+    :type roi: List[float]
+    :return: crop window
+    :rtype: rasterio.windows.Window
+    """
     try:
-        new_cropped_dem, new_cropped_transform = rasterio.mask.mask(
-            src, [geom_like_polygon], all_touched=True, crop=True
-        )
-    except ValueError as roi_outside_dataset:
+        return rasterio.features.geometry_window(src, [roi_to_geometry(roi)])
+    except WindowError as roi_outside_dataset:
         logging.error(
             "Input ROI coordinates outside of the %s DEM scope.",
             src.files[0],
         )
         raise ValueError from roi_outside_dataset
 
-    return new_cropped_dem, new_cropped_transform
+
+def compute_roi_window(
+    roi: List[float],
+    transform: Affine,
+    shape: Tuple[int, int],
+    margin: int = 0,
+) -> rasterio.windows.Window:
+    """
+    Converts the input Region of Interest (left, bottom, right, top)
+    to the integer rasterio window of the raster covering it,
+    enlarged by margin pixels on each side and clipped to the raster.
+    If the ROI is outside of the raster, an exception is raised.
+
+    :param roi: region of interest (left, bottom, right, top)
+    :type roi: List[float]
+    :param transform: raster affine transform
+    :type transform: Affine
+    :param shape: raster (rows, cols) shape
+    :type shape: Tuple[int, int]
+    :param margin: number of pixels added on each side of the window
+    :type margin: int
+    :return: window covering the ROI
+    :rtype: rasterio.windows.Window
+    """
+    window = roi_to_window(roi, transform, shape, margin)
+    if window is None:
+        logging.error("Input ROI coordinates outside of the DEM scope.")
+        raise ValueError("Input ROI coordinates outside of the DEM scope.")
+
+    return window
+
+
+def roi_to_window(
+    roi: List[float],
+    transform: Affine,
+    shape: Tuple[int, int],
+    margin: int = 0,
+) -> Union[rasterio.windows.Window, None]:
+    """
+    Computes the window of compute_roi_window,
+    returns None if the ROI is outside of the raster.
+
+    :param roi: region of interest (left, bottom, right, top)
+    :type roi: List[float]
+    :param transform: raster affine transform
+    :type transform: Affine
+    :param shape: raster (rows, cols) shape
+    :type shape: Tuple[int, int]
+    :param margin: number of pixels added on each side of the window
+    :type margin: int
+    :return: window covering the ROI or None
+    :rtype: rasterio.windows.Window or None
+    """
+    # Project the four ROI corners to (col, row) image coordinates
+    # so that any raster orientation is handled
+    cols, rows = ~transform * (
+        np.array([roi[0], roi[2], roi[2], roi[0]]),
+        np.array([roi[1], roi[1], roi[3], roi[3]]),
+    )
+    # Enlarge the window to whole pixels and add the margin
+    col_start = max(int(np.floor(np.min(cols))) - margin, 0)
+    row_start = max(int(np.floor(np.min(rows))) - margin, 0)
+    col_stop = min(int(np.ceil(np.max(cols))) + margin, shape[1])
+    row_stop = min(int(np.ceil(np.max(rows))) + margin, shape[0])
+
+    if col_start >= col_stop or row_start >= row_stop:
+        return None
+
+    return rasterio.windows.Window(
+        col_start, row_start, col_stop - col_start, row_stop - row_start
+    )
 
 
 def compute_gdal_translate_bounds(
@@ -151,6 +304,626 @@ def compute_gdal_translate_bounds(
     return float(x_0), float(y_0), float(x_1), float(y_1)
 
 
+def compute_on_control_grid(
+    compute_values: Callable[
+        [np.ndarray, np.ndarray], Union[np.ndarray, Tuple[np.ndarray, ...]]
+    ],
+    rows: np.ndarray,
+    cols: np.ndarray,
+    max_error: float,
+    step: int = DEFAULT_CONTROL_GRID_STEP,
+    block_rows: int = DEFAULT_CONTROL_GRID_BLOCK_ROWS,
+) -> Union[np.ndarray, Tuple[np.ndarray, ...]]:
+    """
+    Computes per pixel values, smooth at the pixel scale (such as
+    projected coordinates, geoid offsets or pixel distances),
+    on the (rows, cols) grid from a sparse lattice of control points.
+
+    The values are computed on a control grid every step pixels,
+    including the last row and col, and bilinearly upsampled
+    to the full grid by blocks of block_rows rows.
+    The upsampling error is checked on the centers and edges middles
+    of each control cell: the values are computed on every pixel
+    of the cells where it may be above max_error
+    (such as the cells crossing a discontinuity of the derivatives).
+
+    :param compute_values: function computing one or several values
+        on (rows, cols) pixels arrays of any shape
+    :type compute_values: Callable
+    :param rows: 1D sorted grid rows
+    :type rows: np.ndarray
+    :param cols: 1D sorted grid cols
+    :type cols: np.ndarray
+    :param max_error: maximum absolute upsampling error of the values
+    :type max_error: float
+    :param step: control grid step in pixels,
+        DEFAULT_CONTROL_GRID_STEP by default
+    :type step: int
+    :param block_rows: number of rows upsampled at once,
+        DEFAULT_CONTROL_GRID_BLOCK_ROWS by default
+    :type block_rows: int
+    :return: 2D (rows, cols) float64 values, as returned by compute_values
+    :rtype: np.ndarray or Tuple[np.ndarray, ...]
+    """
+
+    def _compute_values_tuple(
+        value_rows: np.ndarray, value_cols: np.ndarray
+    ) -> Tuple[np.ndarray, ...]:
+        """
+        Computes the values as a tuple of float64 arrays
+        """
+        values = compute_values(value_rows, value_cols)
+        if not isinstance(values, tuple):
+            values = (values,)
+        return tuple(np.asarray(value, np.float64) for value in values)
+
+    control_rows = _get_control_positions(rows, step)
+    control_cols = _get_control_positions(cols, step)
+    if control_rows.size == rows.size and control_cols.size == cols.size:
+        # Small grid, compute the values on every pixel
+        cols_grid, rows_grid = np.meshgrid(cols, rows)
+        return compute_values(rows_grid, cols_grid)
+
+    control_cols_grid, control_rows_grid = np.meshgrid(
+        control_cols, control_rows
+    )
+    control_values = compute_values(control_rows_grid, control_cols_grid)
+    single_value = not isinstance(control_values, tuple)
+    if single_value:
+        control_values = (control_values,)
+    control_values = tuple(
+        np.asarray(control_value, np.float64)
+        for control_value in control_values
+    )
+
+    inaccurate_cells = _get_inaccurate_control_cells(
+        _compute_values_tuple,
+        control_values,
+        control_rows,
+        control_cols,
+        max_error,
+    )
+
+    row_cells, row_weights = _get_linear_weights(control_rows, rows)
+    col_cells, col_weights = _get_linear_weights(control_cols, cols)
+    values = tuple(
+        _bilinear_upsample(
+            control_value,
+            row_cells,
+            row_weights,
+            col_cells,
+            col_weights,
+            block_rows=block_rows,
+        )
+        for control_value in control_values
+    )
+
+    # Compute the values on every pixel of the inaccurate cells
+    if np.any(inaccurate_cells):
+        logging.debug(
+            "Values computed on every pixel of %d/%d control cells",
+            np.count_nonzero(inaccurate_cells),
+            inaccurate_cells.size,
+        )
+        for row_start in range(0, rows.size, block_rows):
+            block = slice(row_start, row_start + block_rows)
+            inaccurate_rows, inaccurate_cols = np.nonzero(
+                inaccurate_cells[row_cells[block, np.newaxis], col_cells]
+            )
+            if inaccurate_rows.size == 0:
+                continue
+            inaccurate_rows += row_start
+            for value, inaccurate_value in zip(
+                values,
+                _compute_values_tuple(
+                    rows[inaccurate_rows], cols[inaccurate_cols]
+                ),
+            ):
+                value[inaccurate_rows, inaccurate_cols] = inaccurate_value
+
+    if single_value:
+        return values[0]
+    return values
+
+
+def _get_inaccurate_control_cells(
+    compute_values: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, ...]],
+    control_values: Tuple[np.ndarray, ...],
+    control_rows: np.ndarray,
+    control_cols: np.ndarray,
+    max_error: float,
+) -> np.ndarray:
+    """
+    Get the control cells where the bilinear upsampling error
+    of the control values may be above max_error.
+
+    :param compute_values: function computing the values tuple
+        on (rows, cols) pixels arrays
+    :type compute_values: Callable
+    :param control_values: 2D (control_rows, control_cols) values tuple
+    :type control_values: Tuple[np.ndarray, ...]
+    :param control_rows: 1D sorted control rows
+    :type control_rows: np.ndarray
+    :param control_cols: 1D sorted control cols
+    :type control_cols: np.ndarray
+    :param max_error: maximum absolute upsampling error of the values
+    :type max_error: float
+    :return: 2D (control rows cells, control cols cells) boolean array
+    :rtype: np.ndarray
+    """
+    # Compare the values on the centers and edges middles
+    # of the control cells to their bilinear upsampling.
+    # The upsampling error of a discontinuity line crossing a cell
+    # can be up to twice its error on the cell middle, and a cell
+    # can be crossed by two lines: the checked error is bounded
+    # by a quarter of max_error
+    check_rows = _get_check_positions(control_rows)
+    check_cols = _get_check_positions(control_cols)
+    check_cols_grid, check_rows_grid = np.meshgrid(check_cols, check_rows)
+    check_weights = _get_linear_weights(
+        control_rows, check_rows
+    ) + _get_linear_weights(control_cols, check_cols)
+    check_error = np.zeros(check_rows_grid.shape)
+    for control_value, check_value in zip(
+        control_values,
+        compute_values(check_rows_grid, check_cols_grid),
+    ):
+        check_error = np.maximum(
+            check_error,
+            np.abs(
+                check_value - _bilinear_upsample(control_value, *check_weights)
+            ),
+        )
+    # Maximum error of each cell, on its 3x3 check positions
+    if control_rows.size > 1:
+        check_error = np.maximum(
+            np.maximum(check_error[:-1:2, :], check_error[1::2, :]),
+            check_error[2::2, :],
+        )
+    if control_cols.size > 1:
+        check_error = np.maximum(
+            np.maximum(check_error[:, :-1:2], check_error[:, 1::2]),
+            check_error[:, 2::2],
+        )
+    return check_error > max_error / 4
+
+
+def _get_control_positions(positions: np.ndarray, step: int) -> np.ndarray:
+    """
+    Get the control positions every step positions,
+    including the last one.
+
+    :param positions: 1D sorted positions
+    :type positions: np.ndarray
+    :param step: control step
+    :type step: int
+    :return: control positions
+    :rtype: np.ndarray
+    """
+    control_positions = positions[::step]
+    if control_positions[-1] != positions[-1]:
+        control_positions = np.append(control_positions, positions[-1])
+    return control_positions
+
+
+def _get_check_positions(control_positions: np.ndarray) -> np.ndarray:
+    """
+    Get the control positions and the middles of the control cells,
+    interleaved.
+
+    :param control_positions: 1D sorted control positions
+    :type control_positions: np.ndarray
+    :return: check positions
+    :rtype: np.ndarray
+    """
+    check_positions = np.empty(2 * control_positions.size - 1)
+    check_positions[::2] = control_positions
+    check_positions[1::2] = (control_positions[:-1] + control_positions[1:]) / 2
+    return check_positions
+
+
+def _get_linear_weights(
+    control_positions: np.ndarray, positions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the control cell of each position, between the control positions
+    cell and cell + 1, and the linear interpolation weight of cell + 1.
+
+    :param control_positions: 1D sorted control positions
+    :type control_positions: np.ndarray
+    :param positions: 1D positions inside the control positions
+    :type positions: np.ndarray
+    :return: cells and weights
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    if control_positions.size == 1:
+        return np.zeros(positions.size, dtype=int), np.zeros(positions.size)
+    cells = np.clip(
+        np.searchsorted(control_positions, positions, side="right") - 1,
+        0,
+        control_positions.size - 2,
+    )
+    weights = (positions - control_positions[cells]) / (
+        control_positions[cells + 1] - control_positions[cells]
+    )
+    return cells, weights
+
+
+def _bilinear_upsample(  # pylint: disable=too-many-arguments
+    control_values: np.ndarray,
+    row_cells: np.ndarray,
+    row_weights: np.ndarray,
+    col_cells: np.ndarray,
+    col_weights: np.ndarray,
+    block_rows: Union[int, None] = None,
+) -> np.ndarray:
+    """
+    Bilinear upsampling of the values of a control grid,
+    from the control cells and weights of the rows and cols
+    given by _get_linear_weights.
+
+    :param control_values: 2D (control_rows, control_cols) values
+    :type control_values: np.ndarray
+    :param row_cells: control cells of the rows
+    :type row_cells: np.ndarray
+    :param row_weights: linear weights of the rows
+    :type row_weights: np.ndarray
+    :param col_cells: control cells of the cols
+    :type col_cells: np.ndarray
+    :param col_weights: linear weights of the cols
+    :type col_weights: np.ndarray
+    :param block_rows: number of rows upsampled at once, all if None
+    :type block_rows: int or None
+    :return: 2D (rows, cols) upsampled values
+    :rtype: np.ndarray
+    """
+    # A single control row or col is padded to be its own cell + 1
+    if control_values.shape[0] == 1:
+        control_values = np.concatenate([control_values, control_values])
+    if control_values.shape[1] == 1:
+        control_values = np.concatenate(
+            [control_values, control_values], axis=1
+        )
+    # Interpolate along the cols, then along the rows by blocks
+    cols_values = (
+        control_values[:, col_cells] * (1 - col_weights)
+        + control_values[:, col_cells + 1] * col_weights
+    )
+    if block_rows is None:
+        block_rows = row_cells.size
+    values = np.empty((row_cells.size, col_cells.size))
+    for row_start in range(0, row_cells.size, max(block_rows, 1)):
+        block = slice(row_start, row_start + block_rows)
+        values[block] = (
+            cols_values[row_cells[block], :]
+            * (1 - row_weights[block])[:, np.newaxis]
+            + cols_values[row_cells[block] + 1, :]
+            * row_weights[block][:, np.newaxis]
+        )
+    return values
+
+
+def shift_image(
+    image: np.ndarray,
+    col_shift: float,
+    row_shift: float,
+    method: str = "bilinear",
+    fill_value: Union[int, float] = None,
+) -> np.ndarray:
+    """
+    Shifts the image by a sub-pixel translation,
+    out[row, col] = image[row + row_shift, col + col_shift].
+
+    The translation being the same for all the pixels, the image is
+    resampled separably along the cols then the rows, with the same
+    interpolation weights for every row or col:
+
+    - bilinear: equal to a linear RectBivariateSpline evaluation
+    - bicubic: cubic convolution (Keys kernel)
+    - fourier: Fourier phase shift of the image, its nodata
+      filled with its mean value. The image borders wrap around.
+    - nearest: nearest pixel, for label images
+
+    NaN values are propagated to all the pixels interpolated with
+    a non zero weight from them. Positions outside of the image
+    take the values of its nearest border if fill_value is None,
+    fill_value otherwise.
+    Extra dimensions after (row, col), such as the classification
+    layers indicator, are shifted the same way.
+
+    :param image: (row, col, ...) image
+    :type image: np.ndarray
+    :param col_shift: col shift in pixels
+    :type col_shift: float
+    :param row_shift: row shift in pixels
+    :type row_shift: float
+    :param method: shift method of SHIFT_METHODS, default bilinear
+    :type method: str
+    :param fill_value: value outside of the image, None for its border
+    :type fill_value: int, float or None
+    :return: shifted image, float64 except for the nearest method
+    :rtype: np.ndarray
+    """
+    if method not in SHIFT_METHODS:
+        raise ValueError(
+            f"Shift method {method} is not supported, "
+            f"supported methods are {SHIFT_METHODS}"
+        )
+    if method == "fourier":
+        shifted = _fourier_shift_image(image, col_shift, row_shift)
+    else:
+        if method != "nearest":
+            image = image.astype(np.float64, copy=False)
+        shifted = _shift_image_axis(image, col_shift, 1, method)
+        shifted = _shift_image_axis(shifted, row_shift, 0, method)
+
+    if fill_value is not None:
+        if method == "nearest":
+            # The nearest pixels positions are rounded
+            row_shift = np.floor(row_shift + 0.5)
+            col_shift = np.floor(col_shift + 0.5)
+        outside_rows = _get_outside_positions(image.shape[0], row_shift)
+        outside_cols = _get_outside_positions(image.shape[1], col_shift)
+        shifted[outside_rows] = fill_value
+        shifted[:, outside_cols] = fill_value
+    return shifted
+
+
+def _shift_image_axis(
+    image: np.ndarray, shift: float, axis: int, method: str
+) -> np.ndarray:
+    """
+    Shifts the image along one axis with the
+    interpolation kernel of the method.
+
+    The fractional part of the shift being the same for all the
+    pixels, the kernel taps are integer shifted copies of the image
+    weighted by constant weights. The taps of null weight are
+    skipped not to propagate their NaN.
+
+    :param image: image
+    :type image: np.ndarray
+    :param shift: shift in pixels along the axis
+    :type shift: float
+    :param axis: shifted axis
+    :type axis: int
+    :param method: bilinear, bicubic or nearest
+    :type method: str
+    :return: shifted image
+    :rtype: np.ndarray
+    """
+    if method == "nearest":
+        return _shift_image_pixels(image, int(np.floor(shift + 0.5)), axis)
+
+    floor_shift = int(np.floor(shift))
+    fraction = shift - floor_shift
+    if method == "bilinear":
+        taps = [0, 1]
+        weights = [1 - fraction, fraction]
+    else:  # method == "bicubic"
+        taps = [-1, 0, 1, 2]
+        weights = [_get_cubic_weight(fraction - tap) for tap in taps]
+
+    shifted = None
+    for tap, weight in zip(taps, weights):
+        if weight == 0:
+            continue
+        tap_values = _shift_image_pixels(image, floor_shift + tap, axis)
+        if weight != 1:
+            tap_values *= weight
+        if shifted is None:
+            shifted = tap_values
+        else:
+            shifted += tap_values
+    return shifted
+
+
+def _shift_image_pixels(image: np.ndarray, shift: int, axis: int):
+    """
+    Shifts the image by an integer number of pixels along one axis,
+    out[i] = image[i + shift], the positions outside of the image
+    taking the value of its nearest border.
+
+    :param image: image
+    :type image: np.ndarray
+    :param shift: shift in pixels along the axis
+    :type shift: int
+    :param axis: shifted axis
+    :type axis: int
+    :return: shifted image copy
+    :rtype: np.ndarray
+    """
+    size = image.shape[axis]
+    # Move the shifted axis first to slice it
+    image = np.moveaxis(image, axis, 0)
+    shifted = np.empty_like(image)
+    # Output range inside of the image
+    first = min(max(-shift, 0), size)
+    last = max(min(size - shift, size), first)
+    shifted[first:last] = image[first + shift : last + shift]
+    shifted[:first] = image[:1]
+    shifted[last:] = image[-1:]
+    return np.moveaxis(shifted, 0, axis)
+
+
+def _get_cubic_weight(distance: float) -> float:
+    """
+    Cubic convolution kernel of Keys (1981) at the input distance,
+    with the BICUBIC_KERNEL_PARAMETER.
+
+    :param distance: distance in pixels
+    :type distance: float
+    :return: kernel weight
+    :rtype: float
+    """
+    param = BICUBIC_KERNEL_PARAMETER
+    dist = abs(distance)
+    if dist <= 1:
+        return (param + 2) * dist**3 - (param + 3) * dist**2 + 1
+    if dist < 2:
+        return param * (dist**3 - 5 * dist**2 + 8 * dist - 4)
+    return 0.0
+
+
+def _fourier_shift_image(
+    image: np.ndarray, col_shift: float, row_shift: float
+) -> np.ndarray:
+    """
+    Shifts the 2D image by a Fourier phase shift, its NaN
+    values being filled with its mean value before the shift and
+    propagated by a bilinear shift of their mask.
+
+    :param image: 2D (row, col) image
+    :type image: np.ndarray
+    :param col_shift: col shift in pixels
+    :type col_shift: float
+    :param row_shift: row shift in pixels
+    :type row_shift: float
+    :return: shifted image
+    :rtype: np.ndarray
+    """
+    nan_mask = np.isnan(image)
+    filled_image = np.where(
+        nan_mask, np.nanmean(image) if not nan_mask.all() else 0, image
+    ).astype(np.float64)
+    freq_rows = np.fft.fftfreq(image.shape[0])[:, np.newaxis]
+    freq_cols = np.fft.rfftfreq(image.shape[1])[np.newaxis, :]
+    phase = np.exp(2j * np.pi * (freq_rows * row_shift + freq_cols * col_shift))
+    shifted = np.fft.irfft2(np.fft.rfft2(filled_image) * phase, s=image.shape)
+    shifted_nan_mask = shift_image(
+        nan_mask.astype(np.float64), col_shift, row_shift
+    )
+    shifted[shifted_nan_mask != 0] = np.nan
+    return shifted
+
+
+def _get_outside_positions(size: int, shift: float) -> np.ndarray:
+    """
+    Returns the mask of the shifted positions outside of an axis.
+
+    :param size: axis size
+    :type size: int
+    :param shift: shift in pixels along the axis
+    :type shift: float
+    :return: mask of the positions outside of [0, size - 1]
+    :rtype: np.ndarray
+    """
+    positions = np.arange(size) + shift
+    return (positions < 0) | (positions > size - 1)
+
+
+def compute_block_mean(image: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Decimates the 2D image by the mean of its factor x factor
+    pixels blocks, ignoring the NaN values. The blocks without
+    any valid value are NaN, the last incomplete blocks are dropped.
+
+    :param image: 2D (row, col) image
+    :type image: np.ndarray
+    :param factor: decimation factor
+    :type factor: int
+    :return: (row // factor, col // factor) float64 decimated image
+    :rtype: np.ndarray
+    """
+    rows, cols = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[: rows * factor, : cols * factor].reshape(
+        rows, factor, cols, factor
+    )
+    valid = np.isfinite(blocks)
+    sums = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return sums / valid.sum(axis=(1, 3))
+
+
+def compute_phase_correlation_shift(
+    image: np.ndarray, ref_image: np.ndarray, upsampling_factor: int = 1
+) -> Tuple[float, float]:
+    """
+    Estimates by FFT phase correlation the translation between
+    two images of the same shape, such that
+    image[row, col] = ref_image[row + row_shift, col + col_shift],
+    the convention of shift_image.
+
+    The integer shift is the peak of the inverse FFT of the normalized
+    cross-power spectrum. With upsampling_factor > 1, it is refined
+    to 1 / upsampling_factor pixel by a matrix multiply DFT of the
+    cross-power spectrum upsampled in a 1.5 pixels neighbourhood
+    of the peak (Guizar-Sicairos et al., 2008).
+    The images must be finite and their shift below half their size.
+
+    :param image: 2D (row, col) image
+    :type image: np.ndarray
+    :param ref_image: 2D (row, col) reference image
+    :type ref_image: np.ndarray
+    :param upsampling_factor: sub-pixel precision factor, 1 for
+        an integer shift
+    :type upsampling_factor: int
+    :return: col_shift, row_shift
+    :rtype: Tuple[float, float]
+    """
+    shape = np.array(image.shape)
+    cross_power = np.fft.fft2(image) * np.conj(np.fft.fft2(ref_image))
+    # Phase only, the null frequencies being ignored
+    cross_power /= np.maximum(np.abs(cross_power), np.finfo(np.float64).tiny)
+    correlation = np.fft.ifft2(cross_power).real
+    peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+    shifts = np.array(peak, dtype=np.float64)
+    # Peaks beyond half the size are negative shifts
+    shifts[shifts > shape // 2] -= shape[shifts > shape // 2]
+
+    if upsampling_factor > 1:
+        region_size = int(np.ceil(upsampling_factor * 1.5))
+        region_center = np.fix(region_size / 2)
+        shifts = np.round(shifts * upsampling_factor) / upsampling_factor
+        # Upsampled correlation around the peak
+        correlation = _upsampled_dft(
+            cross_power,
+            region_size,
+            upsampling_factor,
+            region_center - shifts * upsampling_factor,
+        ).real
+        peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+        shifts += (np.array(peak) - region_center) / upsampling_factor
+
+    # The correlation peak is at the opposite of the image shift
+    return -float(shifts[1]), -float(shifts[0])
+
+
+def _upsampled_dft(
+    spectrum: np.ndarray,
+    region_size: int,
+    upsampling_factor: int,
+    region_offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Inverse DFT of a 2D spectrum on a region_size x region_size
+    region of the upsampling_factor times upsampled grid, starting
+    at -region_offsets upsampled pixels, computed by matrix
+    multiplications of each axis DFT kernel.
+
+    :param spectrum: 2D (row, col) spectrum
+    :type spectrum: np.ndarray
+    :param region_size: upsampled region size
+    :type region_size: int
+    :param upsampling_factor: upsampling factor
+    :type upsampling_factor: int
+    :param region_offsets: (row, col) upsampled region offsets
+    :type region_offsets: np.ndarray
+    :return: (region_size, region_size) upsampled inverse DFT
+    :rtype: np.ndarray
+    """
+    kernels = [
+        np.exp(
+            2j
+            * np.pi
+            * (np.arange(region_size) - offset)[:, np.newaxis]
+            * np.fft.fftfreq(size, upsampling_factor)
+        )
+        for size, offset in zip(spectrum.shape, region_offsets)
+    ]
+    return kernels[0] @ spectrum @ kernels[1].T
+
+
 def remove_nan_and_flatten(data: np.ndarray) -> np.ndarray:
     """
     Function for removing NaNs from a numpy array (data)
@@ -166,19 +939,25 @@ def remove_nan_and_flatten(data: np.ndarray) -> np.ndarray:
 
 
 def compute_surface_normal(
-    data: np.ndarray, dx: np.float64, dy: np.float64
+    data: np.ndarray,
+    dx: Union[np.float64, np.ndarray],
+    dy: Union[np.float64, np.ndarray],
 ) -> np.ndarray:
     """
     Return the surface normal vector at each pixel.
     First: compute the gradient in every direction at each pixel.
     Finally: compute the cross product of the 2 gradient vectors.
 
+    The resolutions may be given per row as (row, 1) vectors,
+    such as the geographic DEMs distances of
+    dem_tools.compute_pixel_distances.
+
     :param data: 2D (row, col) np.ndarray containing the image
     :type data: np.ndarray
     :param dx: DEM's resolution in the X direction
-    :type dx: np.float64
+    :type dx: np.float64 or (row, 1) np.ndarray
     :param dy: DEM's resolution in the Y direction
-    :type dy: np.float64
+    :type dy: np.float64 or (row, 1) np.ndarray
     :return: vector (3D, row, col) normal to the surface for each pixel
     :rtype: np.ndarray
     """
@@ -186,7 +965,11 @@ def compute_surface_normal(
     size_x, size_y = data.shape
 
     gx = np.gradient(data / np.abs(dx), axis=1)
-    gy = np.gradient(data / np.abs(dy), axis=0)
+    if np.ndim(dy) == 0:
+        gy = np.gradient(data / np.abs(dy), axis=0)
+    else:
+        # The resolution varies along the rows
+        gy = np.gradient(data, axis=0) / np.abs(dy)
 
     zer = np.zeros((size_x, size_y))
     one = np.ones((size_x, size_y))
@@ -293,3 +1076,118 @@ def calc_spatial_freq_1d(n: int, edge: float = np.pi) -> np.ndarray:
         freq_pos = +np.arange(0, n // 2 + 1)  # type: ignore
 
     return np.concatenate((freq_neg, freq_pos)) * 2 * edge / n
+
+
+def check_output_profile(output_profile: Dict):
+    """
+    Checks the output GeoTIFF profile keys and values,
+    raises a ValueError if the profile is invalid.
+
+    :param output_profile: output GeoTIFF profile
+    :type output_profile: Dict
+    """
+    for key in output_profile:
+        if key not in DEFAULT_OUTPUT_PROFILE:
+            raise ValueError(
+                f"ERROR: {key} is not an output profile parameter,"
+                f" available: {list(DEFAULT_OUTPUT_PROFILE.keys())}"
+            )
+    compress = output_profile.get("compress", None)
+    if compress is not None and compress.lower() not in OUTPUT_COMPRESSIONS:
+        raise ValueError(
+            f"ERROR: output compression {compress} not supported,"
+            f" available: {OUTPUT_COMPRESSIONS}"
+        )
+    blocksize = output_profile.get("blocksize", 512)
+    if not isinstance(blocksize, int) or blocksize % 16 != 0:
+        raise ValueError(
+            f"ERROR: output blocksize {blocksize} must be a multiple of 16"
+        )
+
+
+def get_output_creation_options(
+    output_profile: Union[Dict, None], dtype: np.dtype
+) -> Tuple[str, Dict]:
+    """
+    Converts the output GeoTIFF profile to the rasterio driver and
+    creation options writing it:
+
+    - cog: Cloud Optimized GeoTIFF (COG driver) layout if True
+    - tiled: tiled GeoTIFF if True (always tiled for cog)
+    - blocksize: tiles size
+    - compress: one of OUTPUT_COMPRESSIONS or None
+    - predictor: compression predictor, floating point (3) for float
+      data and horizontal differencing (2) for integers if None
+    - max_z_error: maximum error of the lerc compressions
+    - num_threads: number of compression threads
+    - bigtiff: BIGTIFF creation option ("IF_SAFER" by default)
+    - overviews: internal overviews if True, built by the COG driver
+      or after writing a GTiff (see compute_overview_factors)
+
+    Missing keys take the DEFAULT_OUTPUT_PROFILE values.
+
+    :param output_profile: output GeoTIFF profile
+    :type output_profile: Dict or None
+    :param dtype: type of the written data
+    :type dtype: np.dtype
+    :return: driver and creation options
+    :rtype: Tuple[str, Dict]
+    """
+    profile = dict(DEFAULT_OUTPUT_PROFILE)
+    if output_profile:
+        check_output_profile(output_profile)
+        profile.update(output_profile)
+
+    options: Dict = {"bigtiff": profile["bigtiff"]}
+    if profile["compress"] is not None:
+        compress = profile["compress"].lower()
+        options["compress"] = compress
+        options["num_threads"] = profile["num_threads"]
+        if compress.startswith("lerc"):
+            if profile["max_z_error"] is not None:
+                options["max_z_error"] = profile["max_z_error"]
+        else:
+            predictor = profile["predictor"]
+            if predictor is None:
+                predictor = 3 if np.issubdtype(dtype, np.floating) else 2
+            options["predictor"] = predictor
+
+    if profile["cog"]:
+        options["blocksize"] = profile["blocksize"]
+        options["overviews"] = "AUTO" if profile["overviews"] else "NONE"
+        # COG driver predictor is given by name
+        if "predictor" in options:
+            options["predictor"] = {
+                1: "NO",
+                2: "STANDARD",
+                3: "FLOATING_POINT",
+            }[options["predictor"]]
+        return "COG", options
+
+    if profile["tiled"]:
+        options["tiled"] = True
+        options["blockxsize"] = profile["blocksize"]
+        options["blockysize"] = profile["blocksize"]
+    return "GTiff", options
+
+
+def compute_overview_factors(
+    shape: Tuple[int, int], blocksize: int = 512
+) -> List[int]:
+    """
+    Computes the power of 2 decimation factors of the internal
+    overviews of a raster, down to an overview fitting in one block.
+
+    :param shape: raster (rows, cols) shape
+    :type shape: Tuple[int, int]
+    :param blocksize: blocks size
+    :type blocksize: int
+    :return: overview decimation factors
+    :rtype: List[int]
+    """
+    factors = []
+    factor = 1
+    while max(shape) / factor > blocksize:
+        factor *= 2
+        factors.append(factor)
+    return factors
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint:disable=too-few-public-methods
+"""
+This module contains functions associated to lazy chunked (dask) arrays,
+used by the optional lazy mode of demcompare.
+The lazy rasters are read, reprojected and written chunk by chunk
+with rasterio windows.
+"""
+
+# Standard imports
+import logging
+from typing import Dict, List, Tuple, Union
+
+# Third party imports
+import numpy as np
+import rasterio
+import rasterio.crs
+import rasterio.io
+import rasterio.warp
+import rasterio.windows
+from rasterio import Affine
+from rasterio.features import geometry_mask
+
+# Demcompare imports
+from .img_tools import compute_roi_crop_window, roi_to_geometry, roi_to_window
+
+# Optional lazy arrays dependency
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask = None
+    da = None
+
+
+class _RasterioWindowReader:
+    """
+    Array-like view of a rasterio source window, reading only the
+    requested slices. Used to build lazy chunked arrays with dask.
+    """
+
+    def __init__(
+        self,
+        src: rasterio.DatasetReader,
+        window: rasterio.windows.Window = None,
+        indexes: Union[int, List[int]] = 1,
+    ):
+        """
+        :param src: input source dataset in rasterio format
+        :type src: rasterio.DatasetReader
+        :param window: window to be read, None reads the full raster
+        :type window: rasterio.windows.Window or None
+        :param indexes: band index, or list of band indexes
+        :type indexes: int or List[int]
+        """
+        if window is None:
+            window = rasterio.windows.Window(0, 0, src.width, src.height)
+        self.src = src
+        self.window = window
+        self.indexes = indexes
+        shape: Tuple[int, ...] = (int(window.height), int(window.width))
+        if not isinstance(indexes, int):
+            shape = (len(indexes),) + shape
+        self.shape = shape
+        self.ndim = len(shape)
+        self.dtype = np.dtype(src.dtypes[0])
+
+    def __getitem__(self, key: Tuple[slice, ...]) -> np.ndarray:
+        """
+        Reads the (row, col) slices of the window, with a leading
+        band slice if several bands are read
+
+        :param key: tuple of slices
+        :type key: Tuple[slice, ...]
+        :return: read data
+        :rtype: np.ndarray
+        """
+        band_key = key[:-2]
+        row_slice, col_slice = [
+            range(*key_slice.indices(size))
+            for key_slice, size in zip(key[-2:], self.shape[-2:])
+        ]
+        sub_window = rasterio.windows.Window(
+            self.window.col_off + col_slice.start,
+            self.window.row_off + row_slice.start,
+            len(col_slice),
+            len(row_slice),
+        )
+        data = self.src.read(self.indexes, window=sub_window)
+        if band_key:
+            data = data[band_key]
+        return data
+
+
+class _RasterioWindowWriter:
+    """
+    Array-like writer of a rasterio band, writing each
+    assigned slices in its own window. Used to store lazy
+    chunked arrays with dask.
+    """
+
+    def __init__(self, dst: rasterio.io.DatasetWriter, index: int = 1):
+        """
+        :param dst: output dataset in rasterio format
+        :type dst: rasterio.io.DatasetWriter
+        :param index: band index to write
+        :type index: int
+        """
+        self.dst = dst
+        self.index = index
+
+    def __setitem__(self, key: Tuple[slice, slice], value: np.ndarray):
+        """
+        Writes the value in the (row, col) slices window
+
+        :param key: (row, col) slices
+        :type key: Tuple[slice, slice]
+        :param value: data to write
+        :type value: np.ndarray
+        """
+        window = rasterio.windows.Window.from_slices(
+            *key, height=self.dst.height, width=self.dst.width
+        )
+        self.dst.write(value, self.index, window=window)
+
+
+def is_lazy_array(data) -> bool:
+    """
+    Returns True if the input array is a lazy (chunked dask) array
+
+    :param data: input array
+    :type data: np.ndarray or dask.array.Array
+    :return: True if data is lazy
+    :rtype: bool
+    """
+    return da is not None and isinstance(data, da.Array)
+
+
+def check_lazy_available():
+    """
+    Raises an ImportError if the optional lazy arrays
+    dependency (dask) is not installed.
+
+    :return: None
+    """
+    if da is None:
+        logging.error(
+            "Lazy chunked mode needs dask: pip install demcompare[lazy]"
+        )
+        raise ImportError("dask is required for the lazy chunked mode")
+
+
+def to_lazy_like(data: np.ndarray, like):
+    """
+    Returns the input in-memory array as a lazy array
+    with the same chunks as the like lazy array,
+    along the axes where they have the same size.
+
+    :param data: input array
+    :type data: np.ndarray
+    :param like: lazy array with the same shape as data,
+        or a shape data is broadcastable to
+    :type like: dask.array.Array
+    :return: lazy data
+    :rtype: dask.array.Array
+    """
+    check_lazy_available()
+    return da.from_array(
+        data,
+        chunks=tuple(
+            chunks if size == like_size else (size,)
+            for size, like_size, chunks in zip(
+                data.shape, like.shape, like.chunks
+            )
+        ),
+    )
+
+
+def compute_if_lazy(*arrays) -> Tuple:
+    """
+    Computes the input lazy arrays together, in a single pass
+    over their shared chunks. In-memory inputs are returned as is.
+
+    :param arrays: input arrays, lazy or not
+    :type arrays: np.ndarray or dask.array.Array
+    :return: computed arrays
+    :rtype: Tuple
+    """
+    if da is None:
+        return arrays
+    return dask.compute(*arrays)
+
+
+def read_rasterio_lazy(
+    src: rasterio.DatasetReader,
+    indexes: Union[int, List[int], None] = 1,
+    window: rasterio.windows.Window = None,
+    chunks: Union[int, Tuple[int, int], str] = "auto",
+):
+    """
+    Returns the input rasterio source window as a lazy chunked
+    dask array, each chunk being read with its own rasterio window.
+
+    :param src: input source dataset in rasterio format
+    :type src: rasterio.DatasetReader
+    :param indexes: band index, list of band indexes or None for all bands
+    :type indexes: int, List[int] or None
+    :param window: window to be read, None reads the full raster
+    :type window: rasterio.windows.Window or None
+    :param chunks: (row, col) chunks size, as understood by dask
+    :type chunks: int, Tuple[int, int] or str
+    :return: lazy array of shape (row, col), or (band, row, col)
+             if several bands are read
+    :rtype: dask.array.Array
+    """
+    check_lazy_available()
+    if indexes is None:
+        indexes = list(src.indexes)
+    reader = _RasterioWindowReader(src, window, indexes)
+    if not isinstance(indexes, int) and not isinstance(chunks, str):
+        # Keep all the bands in each chunk
+        if isinstance(chunks, int):
+            chunks = (chunks, chunks)
+        chunks = (-1,) + tuple(chunks)
+    # GDAL datasets cannot be read concurrently, so reads are locked
+    return da.from_array(reader, chunks=chunks, lock=True, asarray=True)
+
+
+def write_rasterio_lazy(dst: rasterio.io.DatasetWriter, data, index: int = 1):
+    """
+    Writes the input lazy (row, col) array in the rasterio
+    dataset band, chunk by chunk.
+
+    :param dst: output dataset in rasterio format
+    :type dst: rasterio.io.DatasetWriter
+    :param data: lazy data to write
+    :type data: dask.array.Array
+    :param index: band index to write
+    :type index: int
+    :return: None
+    """
+    check_lazy_available()
+    # GDAL datasets cannot be written concurrently, so writes are locked
+    da.store(data, _RasterioWindowWriter(dst, index), lock=True)
+
+
+def crop_rasterio_source_with_roi_lazy(
+    src: rasterio.DatasetReader,
+    roi: List[float],
+    chunks: Union[int, Tuple[int, int], str],
+    window: Union[rasterio.windows.Window, None] = None,
+):
+    """
+    Lazy version of img_tools.crop_rasterio_source_with_roi:
+    the window cropped by rasterio.mask.mask(all_touched=True, crop=True)
+    is read chunk by chunk, and the ROI mask is rasterized on each chunk.
+    If the ROI is outside of the input DEM, an exception is raised.
+
+    :param src: input source dataset in rasterio format
+    :type src: rasterio.DatasetReader
+    :param roi: region of interest to crop
+    :type roi: List[float]
+    :param chunks: (row, col) chunks size, as understood by dask
+    :type chunks: int, Tuple[int, int] or str
+    :param window: optional crop window of the ROI given by
+        img_tools.compute_roi_crop_window, computed if None
+    :type window: rasterio.windows.Window or None
+    :return: lazy cropped (band, row, col) dem and its affine transform
+    :rtype: Tuple[dask.array.Array, Affine]
+    """
+    geom_like_polygon = roi_to_geometry(roi)
+    # Same window and nodata as rasterio.mask.mask
+    if window is None:
+        window = compute_roi_crop_window(src, roi)
+    transform = src.window_transform(window)
+    nodata = src.nodata if src.nodata is not None else 0
+    data = read_rasterio_lazy(src, None, window, chunks)
+
+    def _mask_block(block: np.ndarray, block_info: Dict = None):
+        """
+        Fills the block pixels outside of the ROI with nodata
+        """
+        (_, _), (row_start, _), (col_start, _) = block_info[0]["array-location"]
+        outside = geometry_mask(
+            [geom_like_polygon],
+            out_shape=block.shape[-2:],
+            transform=transform * Affine.translation(col_start, row_start),
+            all_touched=True,
+        )
+        block = block.copy()
+        block[:, outside] = nodata
+        return block
+
+    return data.map_blocks(_mask_block, dtype=data.dtype), transform
+
+
+def reproject_lazy(  # pylint: disable=too-many-arguments, too-many-locals
+    source: np.ndarray,
+    src_transform: Affine,
+    src_crs: rasterio.crs.CRS,
+    dst_shape: Tuple[int, int],
+    dst_chunks: Tuple[Tuple[int, ...], Tuple[int, ...]],
+    dst_transform: Affine,
+    dst_crs: rasterio.crs.CRS,
+    resampling: rasterio.warp.Resampling,
+    src_nodata: float,
+    dst_nodata: float,
+    fill_value: float,
+    margin: int = 2,
+    **warp_options,
+):
+    """
+    Lazy chunked version of rasterio.warp.reproject.
+    Each destination chunk is reprojected from the source window
+    covering it (enlarged by margin pixels), so that only this
+    window of the source is needed in memory.
+    The destination chunks are initialized with fill_value
+    and keep the source type.
+    A 3D (band, row, col) source is reprojected in a single
+    multi-band warp per chunk.
+
+    :param source: 2D (row, col) or 3D (band, row, col) source array,
+        in memory or lazy
+    :type source: np.ndarray or dask.array.Array
+    :param src_transform: source affine transform
+    :type src_transform: Affine
+    :param src_crs: source crs
+    :type src_crs: rasterio.crs.CRS
+    :param dst_shape: destination (row, col) shape
+    :type dst_shape: Tuple[int, int]
+    :param dst_chunks: destination dask chunks
+    :type dst_chunks: Tuple[Tuple[int, ...], Tuple[int, ...]]
+    :param dst_transform: destination affine transform
+    :type dst_transform: Affine
+    :param dst_crs: destination crs
+    :type dst_crs: rasterio.crs.CRS
+    :param resampling: resampling method
+    :type resampling: rasterio.warp.Resampling
+    :param src_nodata: source nodata value
+    :type src_nodata: float
+    :param dst_nodata: destination nodata value
+    :type dst_nodata: float
+    :param fill_value: destination initial value
+    :type fill_value: float
+    :param margin: number of source pixels added around each window
+    :type margin: int
+    :param warp_options: other rasterio.warp.reproject options,
+        such as num_threads or warp_mem_limit
+    :return: lazy reprojected array of dst_shape (with the source bands)
+    :rtype: dask.array.Array
+    """
+    check_lazy_available()
+    dst_chunks = da.core.normalize_chunks(dst_chunks, dst_shape)
+
+    def _reproject_block(
+        source_block: Union[np.ndarray, None],
+        src_window: Union[rasterio.windows.Window, None],
+        block_window: rasterio.windows.Window,
+    ) -> np.ndarray:
+        """
+        Reprojects the source window on a destination chunk
+        """
+        dest_block = np.full(
+            source.shape[:-2]
+            + (int(block_window.height), int(block_window.width)),
+            fill_value,
+            dtype=source.dtype,
+        )
+        if source_block is not None:
+            rasterio.warp.reproject(
+                source=np.ascontiguousarray(source_block),
+                destination=dest_block,
+                src_transform=rasterio.windows.transform(
+                    src_window, src_transform
+                ),
+                src_crs=src_crs,
+                dst_transform=rasterio.windows.transform(
+                    block_window, dst_transform
+                ),
+                dst_crs=dst_crs,
+                resampling=resampling,
+                src_nodata=src_nodata,
+                dst_nodata=dst_nodata,
+                **warp_options,
+            )
+        return dest_block
+
+    blocks = []
+    row_start = 0
+    for block_rows in dst_chunks[0]:
+        blocks_row = []
+        col_start = 0
+        for block_cols in dst_chunks[1]:
+            block_window = rasterio.windows.Window(
+                col_start, row_start, block_cols, block_rows
+            )
+            # Source window covering the destination chunk,
+            # None if the chunk is outside of the source
+            src_window = roi_to_window(
+                rasterio.warp.transform_bounds(
+                    dst_crs,
+                    src_crs,
+                    *rasterio.windows.bounds(block_window, dst_transform),
+                ),
+                src_transform,
+                source.shape[-2:],
+                margin,
+            )
+            source_block = None
+            if src_window is not None:
+                source_block = source[(Ellipsis,) + src_window.toslices()]
+            blocks_row.append(
+                da.from_delayed(
+                    dask.delayed(_reproject_block)(
+                        source_block, src_window, block_window
+                    ),
+                    shape=source.shape[:-2] + (block_rows, block_cols),
+                    dtype=source.dtype,
+                )
+            )
+            col_start += block_cols
+        blocks.append(blocks_row)
+        row_start += block_rows
+
+    return da.block(blocks)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Mainly contains the GroupedData class, input of the grouped
+scalar metrics computing a metric for all the classes at once.
+"""
+
+# Standard imports
+from typing import Tuple
+
+# Third party imports
+import numpy as np
+
+
+class GroupedData:
+    """
+    GroupedData class
+    Values grouped by class label. The per class reductions
+    (bincount sums and sorts by label) are computed on first use
+    and shared by all the grouped metrics.
+    """
+
+    def __init__(self, values: np.ndarray, labels: np.ndarray, nb_groups: int):
+        """
+        Initialization of a GroupedData object
+
+        :param values: 1D valid values, without nan
+        :type values: np.ndarray
+        :param labels: 1D class label of each value, in [0, nb_groups[
+        :type labels: np.ndarray
+        :param nb_groups: number of classes
+        :type nb_groups: int
+        :return: None
+        """
+        self.values = values
+        self.labels = labels
+        self.nb_groups = nb_groups
+        # Cached reductions
+        self._cache: dict = {}
+
+    @classmethod
+    def from_label_map(
+        cls, data: np.ndarray, label_map: np.ndarray, nb_groups: int
+    ) -> "GroupedData":
+        """
+        Creates the GroupedData of a 2D array and its label map,
+        the nan values and the negative labels being ignored
+
+        :param data: 2D input data
+        :type data: np.ndarray
+        :param label_map: 2D class label of each pixel, negative
+            for the pixels out of all the classes
+        :type label_map: np.ndarray
+        :param nb_groups: number of classes
+        :type nb_groups: int
+        :return: grouped data
+        :rtype: GroupedData
+        """
+        valid = (label_map >= 0) & ~np.isnan(data)
+        return cls(data[valid], label_map[valid], nb_groups)
+
+    @property
+    def count(self) -> np.ndarray:
+        """
+        Number of values of each class
+
+        :return: counts
+        :rtype: np.ndarray
+        """
+        if "count" not in self._cache:
+            self._cache["count"] = np.bincount(
+                self.labels, minlength=self.nb_groups
+            )
+        return self._cache["count"]
+
+    def empty_as_nan(self, group_values: np.ndarray) -> np.ndarray:
+        """
+        Sets the classes without values to nan
+
+        :param group_values: value of each class
+        :type group_values: np.ndarray
+        :return: value of each class, nan for empty classes
+        :rtype: np.ndarray
+        """
+        return np.where(self.count > 0, group_values, np.nan)
+
+    def sum(self) -> np.ndarray:
+        """
+        Sum of the values of each class
+
+        :return: sums
+        :rtype: np.ndarray
+        """
+        if "sum" not in self._cache:
+            self._cache["sum"] = np.bincount(
+                self.labels, weights=self.values, minlength=self.nb_groups
+            )
+        return self._cache["sum"]
+
+    def squared_sum(self) -> np.ndarray:
+        """
+        Sum of the squared values of each class
+
+        :return: squared sums
+        :rtype: np.ndarray
+        """
+        if "squared_sum" not in self._cache:
+            values = self.values.astype(np.float64)
+            self._cache["squared_sum"] = np.bincount(
+                self.labels, weights=values * values, minlength=self.nb_groups
+            )
+        return self._cache["squared_sum"]
+
+    def mean(self) -> np.ndarray:
+        """
+        Mean of the values of each class, nan for empty classes
+
+        :return: means
+        :rtype: np.ndarray
+        """
+        if "mean" not in self._cache:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self._cache["mean"] = self.empty_as_nan(self.sum() / self.count)
+        return self._cache["mean"]
+
+    def std(self) -> np.ndarray:
+        """
+        Standard deviation of the values of each class, computed on
+        the deviations from the class mean
+
+        :return: standard deviations
+        :rtype: np.ndarray
+        """
+        deviations = self.values - self.mean()[self.labels]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.empty_as_nan(
+                np.sqrt(
+                    np.bincount(
+                        self.labels,
+                        weights=deviations * deviations,
+                        minlength=self.nb_groups,
+                    )
+                    / self.count
+                )
+            )
+
+    def sorted_values(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Values sorted by class then by value, in a single sort,
+        and the first index of each class in them
+
+        :return: sorted values, class start indexes
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        if "sorted_values" not in self._cache:
+            self._cache["sorted_values"] = self._sort_by_label(self.values)
+        return self._cache["sorted_values"], self._starts()
+
+    def min(self) -> np.ndarray:
+        """
+        Minimum of the values of each class
+
+        :return: minimums
+        :rtype: np.ndarray
+        """
+        sorted_values, starts = self.sorted_values()
+        return self._take(sorted_values, starts)
+
+    def max(self) -> np.ndarray:
+        """
+        Maximum of the values of each class
+
+        :return: maximums
+        :rtype: np.ndarray
+        """
+        sorted_values, starts = self.sorted_values()
+        return self._take(sorted_values, starts + self.count - 1)
+
+    def quantile(self, quantile: float) -> np.ndarray:
+        """
+        Quantile of the values of each class, linearly
+        interpolated as np.percentile
+
+        :param quantile: quantile in [0, 1]
+        :type quantile: float
+        :return: quantiles
+        :rtype: np.ndarray
+        """
+        sorted_values, starts = self.sorted_values()
+        return self._sorted_quantile(sorted_values, starts, quantile)
+
+    def median(self) -> np.ndarray:
+        """
+        Median of the values of each class
+
+        :return: medians
+        :rtype: np.ndarray
+        """
+        if "median" not in self._cache:
+            self._cache["median"] = self.quantile(0.5)
+        return self._cache["median"]
+
+    def abs_deviation_quantile(
+        self, quantile: float, center: str = "median"
+    ) -> np.ndarray:
+        """
+        Quantile of the absolute deviations of the values of each class
+        from the class median or mean
+
+        :param quantile: quantile in [0, 1]
+        :type quantile: float
+        :param center: "median" or "mean"
+        :type center: str
+        :return: quantiles
+        :rtype: np.ndarray
+        """
+        key = f"abs_deviation_{center}"
+        if key not in self._cache:
+            centers = self.median() if center == "median" else self.mean()
+            self._cache[key] = self._sort_by_label(
+                np.abs(self.values - centers[self.labels])
+            )
+        return self._sorted_quantile(self._cache[key], self._starts(), quantile)
+
+    def _sort_by_label(self, values: np.ndarray) -> np.ndarray:
+        """
+        Sorts the values by class then by value
+
+        :param values: 1D values of each label
+        :type values: np.ndarray
+        :return: sorted values
+        :rtype: np.ndarray
+        """
+        return values[np.lexsort((values, self.labels))]
+
+    def _starts(self) -> np.ndarray:
+        """
+        First index of each class in the values sorted by class
+
+        :return: class start indexes
+        :rtype: np.ndarray
+        """
+        return np.concatenate(([0], np.cumsum(self.count)[:-1]))
+
+    def _take(self, sorted_values: np.ndarray, indexes: np.ndarray):
+        """
+        Takes the sorted values at the indexes, nan for empty classes
+
+        :param sorted_values: values sorted by class
+        :type sorted_values: np.ndarray
+        :param indexes: index of each class
+        :type indexes: np.ndarray
+        :return: value of each class
+        :rtype: np.ndarray
+        """
+        if not sorted_values.size:
+            return np.full(self.nb_groups, np.nan)
+        return self.empty_as_nan(
+            sorted_values[np.clip(indexes, 0, sorted_values.size - 1)]
+        )
+
+    def _sorted_quantile(
+        self, sorted_values: np.ndarray, starts: np.ndarray, quantile: float
+    ) -> np.ndarray:
+        """
+        Linearly interpolated quantile of each class of sorted values
+
+        :param sorted_values: values sorted by class then by value
+        :type sorted_values: np.ndarray
+        :param starts: class start indexes
+        :type starts: np.ndarray
+        :param quantile: quantile in [0, 1]
+        :type quantile: float
+        :return: quantiles
+        :rtype: np.ndarray
+        """
+        position = quantile * np.maximum(self.count - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(self.count - 1, 0))
+        fraction = position - lower
+        lower_values = self._take(sorted_values, starts + lower)
+        upper_values = self._take(sorted_values, starts + upper)
+        return lower_values + (upper_values - lower_values) * fraction
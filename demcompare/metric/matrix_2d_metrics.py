@@ -128,20 +128,37 @@ class DemHillShade(MetricTemplate):
             data, self.azimuth, self.angle_altitude
         )
 
-        fig, fig_ax = mpl_pyplot.subplots(figsize=(7.0, 8.0))
+        if self.no_data_location is not None:
+            hillshade_array[self.no_data_location] = np.nan
+
+        # The figure is only built if it is saved
+        if self.plot_path:
+            self.save_plot_metric(self.plot_path, hillshade_array)
+
+        if self.bounds is not None:
+            return create_dem(hillshade_array, bounds=self.bounds)
+        return create_dem(hillshade_array)
 
-        no_data_location = self.no_data_location
+    def save_plot_metric(self, output_file: str, hillshade_array: np.ndarray):
+        """
+        Compute and save the hillshade plot
 
-        if no_data_location is not None:
+        :param output_file: path where the plot image is saved
+        :type output_file: str
+        :param hillshade_array: hillshade view of the dem
+        :type hillshade_array: np.ndarray
+        :return: None
+        """
+        fig, fig_ax = mpl_pyplot.subplots(figsize=(7.0, 8.0))
+
+        if self.no_data_location is not None:
             mpl_pyplot.imshow(
-                no_data_location,
+                self.no_data_location,
                 cmap=ListedColormap([self.cmap_nodata]),
                 interpolation="none",
                 aspect="equal",
             )
 
-            hillshade_array[no_data_location] = np.nan
-
         image = mpl_pyplot.imshow(
             hillshade_array,
             cmap=mpl_pyplot.colormaps.get_cmap(self.cmap),
@@ -159,15 +176,10 @@ class DemHillShade(MetricTemplate):
         if self.fig_title:
             fig_ax.set_title(self.fig_title, fontsize="large")
 
-        if self.plot_path:
-            mpl_pyplot.savefig(self.plot_path, dpi=100, bbox_inches="tight")
+        mpl_pyplot.savefig(output_file, dpi=100, bbox_inches="tight")
 
         mpl_pyplot.close()
 
-        if self.bounds is not None:
-            return create_dem(hillshade_array, bounds=self.bounds)
-        return create_dem(hillshade_array)
-
 
 @Metric.register("svf")
 class DemSkyViewFactor(MetricTemplate):
@@ -279,8 +291,6 @@ class DemSkyViewFactor(MetricTemplate):
         :return: xr.Dataset
         """
 
-        fig, fig_ax = mpl_pyplot.subplots(figsize=(7.0, 8.0))
-
         z = self.compute_svf(data)
 
         z1d = z.reshape(-1)
@@ -295,19 +305,39 @@ class DemSkyViewFactor(MetricTemplate):
         # clip between 0 and 1 + rescale to 255
         z = np.clip(z, 0, 1) * 255
 
-        no_data_location = self.no_data_location
+        if self.no_data_location is not None:
+            z[self.no_data_location] = np.nan
+
+        # The figure is only built if it is saved
+        if self.plot_path:
+            self.save_plot_metric(self.plot_path, z)
+
+        if self.bounds is not None:
+            return create_dem(z, bounds=self.bounds)
+        return create_dem(z)
+
+    def save_plot_metric(self, output_file: str, svf_array: np.ndarray):
+        """
+        Compute and save the sky view factor plot
+
+        :param output_file: path where the plot image is saved
+        :type output_file: str
+        :param svf_array: sky view factor of the dem
+        :type svf_array: np.ndarray
+        :return: None
+        """
+        fig, fig_ax = mpl_pyplot.subplots(figsize=(7.0, 8.0))
 
-        if no_data_location is not None:
+        if self.no_data_location is not None:
             mpl_pyplot.imshow(
-                no_data_location,
+                self.no_data_location,
                 cmap=ListedColormap([self.cmap_nodata]),
                 interpolation="none",
                 aspect="equal",
             )
-            z[no_data_location] = np.nan
 
         image = mpl_pyplot.imshow(
-            z, cmap=mpl_pyplot.colormaps.get_cmap(self.cmap)
+            svf_array, cmap=mpl_pyplot.colormaps.get_cmap(self.cmap)
         )
 
         fig.colorbar(image, label=self.colorbar_title, ax=fig_ax)
@@ -324,11 +354,6 @@ class DemSkyViewFactor(MetricTemplate):
         if self.fig_title:
             fig_ax.set_title(self.fig_title, fontsize="large")
 
-        if self.plot_path:
-            mpl_pyplot.savefig(self.plot_path, dpi=100, bbox_inches="tight")
+        mpl_pyplot.savefig(output_file, dpi=100, bbox_inches="tight")
 
         mpl_pyplot.close()
-
-        if self.bounds is not None:
-            return create_dem(z, bounds=self.bounds)
-        return create_dem(z)
@@ -22,6 +22,7 @@
 Mainly contains the MetricTemplate class.
 """
 # Standard imports
+import logging
 from abc import ABCMeta, abstractmethod
 from typing import Dict, Tuple, Union
 
@@ -29,6 +30,8 @@ from typing import Dict, Tuple, Union
 import numpy as np
 import xarray as xr
 
+from .scalar_accumulator import DEFAULT_RELATIVE_ACCURACY, ScalarAccumulator
+
 
 class MetricTemplate(
     metaclass=ABCMeta
@@ -39,6 +42,17 @@ class MetricTemplate(
 
     # Default metric type
     DEFAULT_TYPE = "scalar"
+    # True if compute_metric can be evaluated on lazy (dask) arrays
+    LAZY_COMPATIBLE = False
+    # True if compute_grouped_metric computes the metric
+    # of all the classes at once
+    GROUPED_COMPATIBLE = False
+    # True if the metric can be computed chunk by chunk with
+    # mergeable accumulators (see create_accumulator)
+    STREAMING_COMPATIBLE = False
+    # True if the accumulator of the metric needs a quantile sketch,
+    # the streaming metric being then approximate
+    QUANTILE_SKETCH = False
 
     def __init__(
         self, parameters: Dict = None
@@ -61,3 +75,95 @@ class MetricTemplate(
         """
         Metric computation method
         """
+
+    def compute_grouped_metric(self, grouped_data) -> np.ndarray:
+        """
+        Grouped metric computation method, computing the metric
+        of each class of the grouped data.
+        By default, compute_metric is called on the values of each
+        class, the GROUPED_COMPATIBLE metrics computing all the
+        classes at once.
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: metric of each class, nan for empty classes
+        :rtype: np.ndarray
+        """
+        sorted_values, starts = grouped_data.sorted_values()
+        return np.array(
+            [
+                self.compute_metric(sorted_values[start : start + count])
+                if count
+                else np.nan
+                for start, count in zip(starts, grouped_data.count)
+            ],
+            dtype=np.float64,
+        )
+
+    def create_accumulator(
+        self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+    ) -> ScalarAccumulator:
+        """
+        Creates an empty accumulator of the streaming metric,
+        updated with update_accumulator for each data chunk, merged
+        with the accumulators of the other chunks or tiles with
+        merge_accumulators and finalized with finalize_accumulator.
+        Only available if STREAMING_COMPATIBLE.
+
+        :param relative_accuracy: relative accuracy of the quantile
+            sketch, if QUANTILE_SKETCH
+        :type relative_accuracy: float
+        :return: empty accumulator
+        :rtype: ScalarAccumulator
+        """
+        return ScalarAccumulator(self.QUANTILE_SKETCH, relative_accuracy)
+
+    @staticmethod
+    def update_accumulator(
+        accumulator: ScalarAccumulator, data: np.ndarray
+    ) -> ScalarAccumulator:
+        """
+        Adds the valid values of a data chunk to an accumulator
+
+        :param accumulator: accumulator
+        :type accumulator: ScalarAccumulator
+        :param data: data chunk, the nan values being ignored
+        :type data: np.ndarray
+        :return: updated accumulator
+        :rtype: ScalarAccumulator
+        """
+        return accumulator.update(data)
+
+    @staticmethod
+    def merge_accumulators(
+        accumulator: ScalarAccumulator, other: ScalarAccumulator
+    ) -> ScalarAccumulator:
+        """
+        Merges two partial accumulators of the metric
+
+        :param accumulator: accumulator, updated in place
+        :type accumulator: ScalarAccumulator
+        :param other: other accumulator
+        :type other: ScalarAccumulator
+        :return: merged accumulator
+        :rtype: ScalarAccumulator
+        """
+        return accumulator.merge(other)
+
+    def finalize_accumulator(
+        self, accumulator: ScalarAccumulator  # pylint: disable=unused-argument
+    ) -> float:
+        """
+        Computes the metric from its accumulator.
+        Only available if STREAMING_COMPATIBLE.
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: metric, nan if the accumulator is empty
+        :rtype: float
+        """
+        logging.error(
+            "%s metric can not be computed from an accumulator",
+            type(self).__name__,
+        )
+        raise ValueError
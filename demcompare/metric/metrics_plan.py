@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Mainly contains the MetricsPlan class, the execution plan of
+a list of input metrics parsed once and reused for all the
+classes and modes of a classification layer.
+"""
+
+# Standard imports
+from typing import Dict, List, Tuple, Union
+
+from .metric import Metric
+from .metric_template import MetricTemplate
+
+
+class MetricsPlan:
+    """
+    MetricsPlan class
+    Input metrics parsed once: metric names, parameters and outliers
+    handling, and the input array of each metric (raw or outliers free,
+    1D flattened without nan or 2D). The stateless scalar metric
+    objects are created once and reused, the other metric objects
+    keeping state of their computation are created on each use.
+    """
+
+    def __init__(
+        self,
+        input_metrics: List[Union[Dict, str]],
+        remove_outliers: bool = False,
+    ):
+        """
+        Initialization of a MetricsPlan object
+
+        :param input_metrics: list of input metrics, their name or a dict
+            with their name as only key and their parameters as value
+        :type input_metrics: List[Union[Dict, str]]
+        :param remove_outliers: outliers handling of the metrics
+            without remove_outliers parameter
+        :type remove_outliers: bool
+        :return: None
+        """
+        # Parameters of each metric, without remove_outliers
+        self.params: Dict[str, Union[Dict, None]] = {}
+        # Outliers handling of each metric
+        self.remove_outliers: Dict[str, bool] = {}
+        for input_metric in input_metrics:
+            # The input metric can be a dictionary or a str
+            # If dict, metric will have type and params
+            if isinstance(input_metric, dict):
+                name = list(input_metric.keys())[0]
+                params = dict(input_metric[name])
+                # remove_outliers is not part of the metric class
+                self.remove_outliers[name] = params.pop(
+                    "remove_outliers", remove_outliers
+                )
+                self.params[name] = params
+            else:
+                name = input_metric
+                self.remove_outliers[name] = remove_outliers
+                self.params[name] = None
+        # Metric objects, in the input metrics order
+        self.metrics: Dict[str, MetricTemplate] = {
+            name: Metric(name, params) for name, params in self.params.items()
+        }
+        # Input array of each metric:
+        # (remove_outliers, "1D" or "2D")
+        self.inputs: Dict[str, Tuple[bool, str]] = {
+            name: (
+                self.remove_outliers[name],
+                "2D"
+                if metric_object.type == "matrix2D"
+                else getattr(metric_object, "input_type", "1D"),
+            )
+            for name, metric_object in self.metrics.items()
+        }
+
+    @property
+    def remove_outliers_list(self) -> List[bool]:
+        """
+        Outliers handling of each metric, in the metrics order
+
+        :return: remove outliers list
+        :rtype: List[bool]
+        """
+        return [self.remove_outliers[name] for name in self.metrics]
+
+    def get_metric(self, name: str) -> MetricTemplate:
+        """
+        Returns the metric object of a metric, the scalar metric
+        objects being reused and the other ones created
+
+        :param name: metric name
+        :type name: str
+        :return: metric object
+        :rtype: MetricTemplate
+        """
+        if self.metrics[name].type == "scalar":
+            return self.metrics[name]
+        return Metric(name, self.params[name])
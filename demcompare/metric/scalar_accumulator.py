@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Mainly contains the ScalarAccumulator and QuantileSketch classes,
+the mergeable partial states of the streaming scalar metrics
+updated chunk by chunk (or tile by tile).
+"""
+
+# Standard imports
+from typing import Tuple, Union
+
+# Third party imports
+import numpy as np
+
+# Default relative accuracy of the quantile sketch
+DEFAULT_RELATIVE_ACCURACY = 1e-3
+# Absolute values below which the values are counted as zero
+DEFAULT_MIN_VALUE = 1e-6
+
+
+class QuantileSketch:
+    """
+    QuantileSketch class
+    Mergeable quantile sketch of the values centered on an offset:
+    the centered values are counted in logarithmic buckets of
+    relative width 2 * relative_accuracy, one set of buckets per sign,
+    the centered values of absolute value below min_value being
+    counted as zero. The offset is the median of the first updated
+    chunk if not given, so that the buckets are fine around the
+    values and not around zero.
+    Each value x is represented within relative_accuracy * |x - offset|
+    (plus min_value), the number of buckets only depending on the
+    range of the centered values.
+    """
+
+    def __init__(
+        self,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        min_value: float = DEFAULT_MIN_VALUE,
+        offset: Union[float, None] = None,
+    ):
+        """
+        Initialization of a QuantileSketch object
+
+        :param relative_accuracy: relative accuracy of the centered values
+        :type relative_accuracy: float
+        :param min_value: absolute centered values below which the
+            values are counted as the offset
+        :type min_value: float
+        :param offset: center of the values, the median of the
+            first updated chunk if None
+        :type offset: float or None
+        :return: None
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                f"Quantile sketch relative accuracy {relative_accuracy} "
+                "must be in ]0, 1["
+            )
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.offset = offset
+        # Buckets relative width
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        # Number of values
+        self.count = 0
+        # Number of values counted as the offset
+        self.zero_count = 0
+        # Sorted bucket keys and counts of the positive centered values,
+        # and of the negative centered values absolute values
+        self.keys = {
+            "positive": np.empty(0, dtype=np.int64),
+            "negative": np.empty(0, dtype=np.int64),
+        }
+        self.counts = {
+            "positive": np.empty(0, dtype=np.int64),
+            "negative": np.empty(0, dtype=np.int64),
+        }
+
+    def update(self, data: np.ndarray) -> "QuantileSketch":
+        """
+        Adds the values of a data chunk, the nan values being ignored
+
+        :param data: data chunk
+        :type data: np.ndarray
+        :return: updated sketch
+        :rtype: QuantileSketch
+        """
+        data = np.asarray(data, dtype=np.float64).ravel()
+        data = data[~np.isnan(data)]
+        if not data.size:
+            return self
+        if self.offset is None:
+            self.offset = float(np.median(data))
+        self._add_centered_values(
+            data - self.offset, np.ones(data.size, dtype=np.int64)
+        )
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Adds the values of another sketch of the same accuracy.
+        If the offsets differ, the other sketch bucket values are
+        counted again in the buckets of this sketch, their error
+        being then bounded by the sum of the two sketches errors.
+
+        :param other: other sketch
+        :type other: QuantileSketch
+        :return: merged sketch
+        :rtype: QuantileSketch
+        """
+        if (
+            other.relative_accuracy != self.relative_accuracy
+            or other.min_value != self.min_value
+        ):
+            raise ValueError(
+                "Quantile sketches of different accuracies can not be merged"
+            )
+        if not other.count:
+            return self
+        if self.offset is None:
+            self.offset = other.offset
+        if other.offset == self.offset:
+            self.count += other.count
+            self.zero_count += other.zero_count
+            for sign in self.keys:
+                self._add_buckets(sign, other.keys[sign], other.counts[sign])
+        else:
+            values, counts = other.get_buckets()
+            self._add_centered_values(values - self.offset, counts)
+        return self
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Quantile of the values, linearly interpolated as np.percentile
+
+        :param quantile: quantile in [0, 1]
+        :type quantile: float
+        :return: estimated quantile, nan if the sketch is empty
+        :rtype: float
+        """
+        values, counts = self.get_buckets()
+        return _weighted_quantile(values, counts, quantile)
+
+    def deviation_quantile(self, quantile: float, center: float) -> float:
+        """
+        Quantile of the absolute deviations of the values from
+        a center value, each bucket deviation being computed from
+        the bucket value
+
+        :param quantile: quantile in [0, 1]
+        :type quantile: float
+        :param center: center value of the deviations
+        :type center: float
+        :return: estimated quantile, nan if the sketch is empty
+        :rtype: float
+        """
+        values, counts = self.get_buckets()
+        deviations = np.abs(values - center)
+        order = np.argsort(deviations, kind="stable")
+        return _weighted_quantile(deviations[order], counts[order], quantile)
+
+    def get_buckets(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Value and count of all the buckets, in ascending values
+
+        :return: bucket values, bucket counts
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        # Bucket centered value, within relative_accuracy
+        # of the bucket centered values
+        positive_values = (
+            2 * self.gamma ** self.keys["positive"] / (self.gamma + 1)
+        )
+        negative_values = (
+            -2 * self.gamma ** self.keys["negative"][::-1] / (self.gamma + 1)
+        )
+        values = np.concatenate(
+            (negative_values, [0.0], positive_values)
+        ).astype(np.float64)
+        counts = np.concatenate(
+            (
+                self.counts["negative"][::-1],
+                [self.zero_count],
+                self.counts["positive"],
+            )
+        ).astype(np.int64)
+        offset = 0.0 if self.offset is None else self.offset
+        return values + offset, counts
+
+    def _add_centered_values(self, values: np.ndarray, counts: np.ndarray):
+        """
+        Counts centered values in the buckets
+
+        :param values: values centered on the offset
+        :type values: np.ndarray
+        :param counts: count of each value
+        :type counts: np.ndarray
+        :return: None
+        """
+        self.count += int(np.sum(counts))
+        self.zero_count += int(np.sum(counts[np.abs(values) <= self.min_value]))
+        for sign, sign_mask, sign_values in (
+            ("positive", values > self.min_value, values),
+            ("negative", values < -self.min_value, -values),
+        ):
+            keys = np.ceil(
+                np.log(sign_values[sign_mask]) / np.log(self.gamma)
+            ).astype(np.int64)
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            self._add_buckets(
+                sign,
+                unique_keys,
+                np.bincount(
+                    inverse,
+                    weights=counts[sign_mask],
+                    minlength=unique_keys.size,
+                ).astype(np.int64),
+            )
+
+    def _add_buckets(self, sign: str, keys: np.ndarray, counts: np.ndarray):
+        """
+        Adds counts to the buckets of a sign
+
+        :param sign: "positive" or "negative"
+        :type sign: str
+        :param keys: bucket keys
+        :type keys: np.ndarray
+        :param counts: count of each bucket key
+        :type counts: np.ndarray
+        :return: None
+        """
+        if not keys.size:
+            return
+        self.keys[sign], inverse = np.unique(
+            np.concatenate((self.keys[sign], keys)), return_inverse=True
+        )
+        self.counts[sign] = np.bincount(
+            inverse,
+            weights=np.concatenate((self.counts[sign], counts)),
+        ).astype(np.int64)
+
+
+class ScalarAccumulator:
+    """
+    ScalarAccumulator class
+    Mergeable partial state of the streaming scalar metrics: exact
+    count, sums, mean, centered second moment, min and max, and
+    an optional QuantileSketch for the quantile based metrics.
+    """
+
+    def __init__(
+        self,
+        quantile_sketch: bool = False,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    ):
+        """
+        Initialization of a ScalarAccumulator object
+
+        :param quantile_sketch: if True, the values are also
+            added to a QuantileSketch
+        :type quantile_sketch: bool
+        :param relative_accuracy: relative accuracy of the quantile sketch
+        :type relative_accuracy: float
+        :return: None
+        """
+        # Number of valid values
+        self.count = 0
+        # Sums of the values and of the squared values
+        self.sum = 0.0
+        self.squared_sum = 0.0
+        # Mean and sum of the squared deviations from the mean
+        self.mean = np.nan
+        self.squared_deviations_sum = 0.0
+        # Min and max
+        self.min = np.nan
+        self.max = np.nan
+        # Quantile sketch
+        self.sketch: QuantileSketch = (
+            QuantileSketch(relative_accuracy) if quantile_sketch else None
+        )
+
+    @property
+    def std(self) -> float:
+        """
+        Standard deviation of the values, as np.std
+
+        :return: standard deviation, nan if empty
+        :rtype: float
+        """
+        if not self.count:
+            return np.nan
+        return float(np.sqrt(self.squared_deviations_sum / self.count))
+
+    def update(self, data: np.ndarray) -> "ScalarAccumulator":
+        """
+        Adds the values of a data chunk, the nan values being ignored
+
+        :param data: data chunk
+        :type data: np.ndarray
+        :return: updated accumulator
+        :rtype: ScalarAccumulator
+        """
+        data = np.asarray(data, dtype=np.float64).ravel()
+        data = data[~np.isnan(data)]
+        if not data.size:
+            return self
+        chunk = ScalarAccumulator()
+        chunk.count = data.size
+        chunk.sum = float(np.sum(data))
+        chunk.squared_sum = float(np.sum(data * data))
+        chunk.mean = chunk.sum / chunk.count
+        deviations = data - chunk.mean
+        chunk.squared_deviations_sum = float(np.sum(deviations * deviations))
+        chunk.min = float(np.min(data))
+        chunk.max = float(np.max(data))
+        self._merge_moments(chunk)
+        if self.sketch is not None:
+            self.sketch.update(data)
+        return self
+
+    def merge(self, other: "ScalarAccumulator") -> "ScalarAccumulator":
+        """
+        Adds the values of another accumulator
+
+        :param other: other accumulator
+        :type other: ScalarAccumulator
+        :return: merged accumulator
+        :rtype: ScalarAccumulator
+        """
+        if (self.sketch is None) != (other.sketch is None):
+            raise ValueError(
+                "Accumulators with and without quantile sketch "
+                "can not be merged"
+            )
+        if other.count:
+            self._merge_moments(other)
+            if self.sketch is not None:
+                self.sketch.merge(other.sketch)
+        return self
+
+    def _merge_moments(self, other: "ScalarAccumulator"):
+        """
+        Merges the exact moments of a non empty accumulator,
+        with the pairwise update of the mean and second moment
+
+        :param other: other non empty accumulator
+        :type other: ScalarAccumulator
+        :return: None
+        """
+        if not self.count:
+            self.mean = other.mean
+            self.min = other.min
+            self.max = other.max
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.squared_deviations_sum += (
+                delta * delta * self.count * other.count / count
+            )
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.sum += other.sum
+        self.squared_sum += other.squared_sum
+        self.squared_deviations_sum += other.squared_deviations_sum
+
+
+def _weighted_quantile(
+    values: np.ndarray, counts: np.ndarray, quantile: float
+) -> float:
+    """
+    Linearly interpolated quantile of sorted values repeated
+    count times, as np.percentile of the repeated values
+
+    :param values: sorted values
+    :type values: np.ndarray
+    :param counts: count of each value
+    :type counts: np.ndarray
+    :param quantile: quantile in [0, 1]
+    :type quantile: float
+    :return: quantile, nan if there is no value
+    :rtype: float
+    """
+    nb_values = int(np.sum(counts))
+    if not nb_values:
+        return np.nan
+    position = quantile * (nb_values - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, nb_values - 1)
+    # Index of the values at the lower and upper ranks
+    lower_idx, upper_idx = np.searchsorted(
+        np.cumsum(counts), [lower, upper], side="right"
+    )
+    return float(
+        values[lower_idx]
+        + (values[upper_idx] - values[lower_idx]) * (position - lower)
+    )
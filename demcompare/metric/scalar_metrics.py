@@ -26,8 +26,10 @@ from typing import Tuple, Union
 
 import numpy as np
 
+from .grouped_data import GroupedData
 from .metric import Metric
 from .metric_template import MetricTemplate
+from .scalar_accumulator import ScalarAccumulator
 
 
 @Metric.register("mean")
@@ -36,6 +38,10 @@ class Mean(MetricTemplate):
     Mean metric class
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -50,6 +56,28 @@ class Mean(MetricTemplate):
         mean = np.nanmean(data)
         return mean
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed mean of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.mean()
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed mean, nan if empty
+        :rtype: float
+        """
+        return accumulator.mean if accumulator.count else np.nan
+
 
 @Metric.register("max")
 class Max(MetricTemplate):
@@ -57,6 +85,10 @@ class Max(MetricTemplate):
     Max metric class
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -71,6 +103,28 @@ class Max(MetricTemplate):
         computed_max = np.max(data)
         return computed_max
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed max of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.max()
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed max, nan if empty
+        :rtype: float
+        """
+        return accumulator.max
+
 
 @Metric.register("min")
 class Min(MetricTemplate):
@@ -78,6 +132,10 @@ class Min(MetricTemplate):
     Min metric class
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -92,6 +150,28 @@ class Min(MetricTemplate):
         computed_min = np.min(data)
         return computed_min
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed min of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.min()
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed min, nan if empty
+        :rtype: float
+        """
+        return accumulator.min
+
 
 @Metric.register("std")
 class Std(MetricTemplate):
@@ -100,6 +180,10 @@ class Std(MetricTemplate):
 
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -114,6 +198,28 @@ class Std(MetricTemplate):
         std = np.std(data)
         return std
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed std of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.std()
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed std, nan if empty
+        :rtype: float
+        """
+        return accumulator.std
+
 
 @Metric.register("rmse")
 class Rmse(MetricTemplate):
@@ -122,6 +228,10 @@ class Rmse(MetricTemplate):
 
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -136,6 +246,34 @@ class Rmse(MetricTemplate):
         rmse = np.sqrt(np.mean(data * data))
         return rmse
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed rmse of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.empty_as_nan(
+            np.sqrt(
+                grouped_data.squared_sum() / np.maximum(grouped_data.count, 1)
+            )
+        )
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed rmse, nan if empty
+        :rtype: float
+        """
+        if not accumulator.count:
+            return np.nan
+        return float(np.sqrt(accumulator.squared_sum / accumulator.count))
+
 
 @Metric.register("median")
 class Median(MetricTemplate):
@@ -143,6 +281,10 @@ class Median(MetricTemplate):
     Median metric class
     """
 
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+    QUANTILE_SKETCH = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -157,6 +299,29 @@ class Median(MetricTemplate):
         median = np.nanmedian(data)
         return median
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed median of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.median()
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method,
+        approximated by the quantile sketch
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed median, nan if empty
+        :rtype: float
+        """
+        return accumulator.sketch.quantile(0.5)
+
 
 @Metric.register("nmad")
 class Nmad(MetricTemplate):
@@ -165,6 +330,10 @@ class Nmad(MetricTemplate):
 
     """
 
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+    QUANTILE_SKETCH = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -179,6 +348,31 @@ class Nmad(MetricTemplate):
         nmad = 1.4826 * np.nanmedian(np.abs(data - np.nanmedian(data)))
         return nmad
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed nmad of each class
+        :rtype: np.ndarray
+        """
+        return 1.4826 * grouped_data.abs_deviation_quantile(0.5, "median")
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method,
+        approximated by the quantile sketch
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed nmad, nan if empty
+        :rtype: float
+        """
+        return 1.4826 * accumulator.sketch.deviation_quantile(
+            0.5, accumulator.sketch.quantile(0.5)
+        )
+
 
 @Metric.register("sum")
 class Sum(MetricTemplate):
@@ -186,6 +380,10 @@ class Sum(MetricTemplate):
     Summation metric class
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -200,6 +398,28 @@ class Sum(MetricTemplate):
         computed_sum = np.sum(data)
         return computed_sum
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed sum of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.empty_as_nan(grouped_data.sum())
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed sum, nan if empty
+        :rtype: float
+        """
+        return accumulator.sum if accumulator.count else np.nan
+
 
 @Metric.register("squared_sum")
 class SumSquaredErr(MetricTemplate):
@@ -207,6 +427,10 @@ class SumSquaredErr(MetricTemplate):
     Squared summation metric class
     """
 
+    LAZY_COMPATIBLE = True
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -221,6 +445,28 @@ class SumSquaredErr(MetricTemplate):
         squared_sum = np.sum(data * data)
         return squared_sum
 
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed squared_sum of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.empty_as_nan(grouped_data.squared_sum())
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed squared_sum, nan if empty
+        :rtype: float
+        """
+        return accumulator.squared_sum if accumulator.count else np.nan
+
 
 @Metric.register("percentil_90")
 class Percentil90(MetricTemplate):
@@ -228,6 +474,10 @@ class Percentil90(MetricTemplate):
     90 percentil metric class
     """
 
+    GROUPED_COMPATIBLE = True
+    STREAMING_COMPATIBLE = True
+    QUANTILE_SKETCH = True
+
     def compute_metric(
         self, data: np.ndarray
     ) -> Union[Tuple[np.ndarray, np.ndarray], np.ndarray, float]:
@@ -241,3 +491,26 @@ class Percentil90(MetricTemplate):
         """
         p_90 = np.nanpercentile(np.abs(data - np.nanmean(data)), 90)
         return p_90
+
+    def compute_grouped_metric(self, grouped_data: GroupedData) -> np.ndarray:
+        """
+        Grouped metric computation method
+
+        :param grouped_data: values grouped by class
+        :type grouped_data: GroupedData
+        :return: the computed percentil_90 of each class
+        :rtype: np.ndarray
+        """
+        return grouped_data.abs_deviation_quantile(0.9, "mean")
+
+    def finalize_accumulator(self, accumulator: ScalarAccumulator) -> float:
+        """
+        Streaming metric computation method,
+        approximated by the quantile sketch
+
+        :param accumulator: accumulator of all the data chunks
+        :type accumulator: ScalarAccumulator
+        :return: the computed percentil_90, nan if empty
+        :rtype: float
+        """
+        return accumulator.sketch.deviation_quantile(0.9, accumulator.mean)
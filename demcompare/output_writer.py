@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains the OutputWriter class, writing the demcompare
+output files (rasters, figures) in the background while the
+computation continues.
+"""
+
+# Standard imports
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Union
+
+# Default number of background output writers
+DEFAULT_OUTPUT_WRITERS = 2
+
+
+class OutputWriter:
+    """
+    Bounded pool of threads writing output files in the background.
+
+    Writing functions are submitted with their arguments and run by
+    max_workers threads. At most 2 * max_workers writings are pending,
+    submit blocking otherwise, to bound the memory held by the outputs.
+    join waits for all the writings and raises the first writing error.
+    With max_workers = 0, the writings are done on submit.
+
+    The submitted functions must not rely on shared global state
+    (such as matplotlib.pyplot) and their data must not be modified
+    by the caller until written.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_OUTPUT_WRITERS):
+        """
+        Initialization of an OutputWriter object
+
+        :param max_workers: number of writing threads,
+                0 to write on submit. Default: DEFAULT_OUTPUT_WRITERS
+        :type max_workers: int
+        :return: None
+        """
+        if max_workers < 0:
+            raise ValueError(
+                f"Number of output writers {max_workers} must be positive"
+            )
+        self.max_workers = max_workers
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._pending: Union[threading.BoundedSemaphore, None] = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(
+                max_workers, thread_name_prefix="demcompare_writer"
+            )
+            self._pending = threading.BoundedSemaphore(2 * max_workers)
+        self._futures: List[Future] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Do not mask the error of the computation
+        # by a writing error
+        try:
+            if exc_type is None:
+                self.join()
+        finally:
+            self.shutdown()
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """
+        Writes an output in the background with func(*args, **kwargs).
+        Raises the error of an already failed writing.
+
+        :param func: writing function
+        :type func: Callable
+        :return: None
+        """
+        if self._executor is None:
+            func(*args, **kwargs)
+            return
+        self._raise_failed_writing()
+        self._pending.acquire()  # pylint: disable=consider-using-with
+        future = self._executor.submit(func, *args, **kwargs)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+
+    def join(self):
+        """
+        Waits for all the submitted writings,
+        raises the first writing error.
+
+        :return: None
+        """
+        futures, self._futures = self._futures, []
+        errors = [
+            future.exception()
+            for future in futures
+            if future.exception() is not None
+        ]
+        for error in errors:
+            logging.error("Output writing failed: %s", error)
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        """
+        Waits for all the submitted writings and stops the threads,
+        without raising the writing errors, only logged.
+
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        futures, self._futures = self._futures, []
+        for future in futures:
+            if future.exception() is not None:
+                logging.error("Output writing failed: %s", future.exception())
+
+    def _raise_failed_writing(self):
+        """
+        Raises the error of the first failed done writing.
+
+        :return: None
+        """
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                self.join()
+
+
+def write_output(
+    output_writer: Union[OutputWriter, None], func: Callable, *args, **kwargs
+):
+    """
+    Writes an output in the background with the output_writer,
+    or directly if output_writer is None.
+
+    :param output_writer: output writer or None
+    :type output_writer: OutputWriter or None
+    :param func: writing function
+    :type func: Callable
+    :return: None
+    """
+    if output_writer is None:
+        func(*args, **kwargs)
+    else:
+        output_writer.submit(func, *args, **kwargs)
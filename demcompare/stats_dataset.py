@@ -49,6 +49,26 @@ class StatsDataset:
 
     :image: 2D (row, col) input image as xarray.DataArray,
 
+    :labels_by_class: 2D (row, col)
+
+        xarray.DataArray containing
+        the class index of each valid pixel,
+        -1 for the pixels out of the classes.
+        The image by class is materialized on access by
+        get_classification_layer_image_by_class
+
+    :labels_by_class_intersection: 2D (row, col)
+
+        xarray.DataArray containing
+        the class index of each pixel
+        considering the intersection mode
+
+    :labels_by_class_exclusion: 2D (row, col)
+
+        xarray.DataArray containing
+        the class index of each pixel
+        considering the exclusion mode
+
     :image_by_class: 3D (row, col; nb_classes)
 
         xarray.DataArray containing
@@ -67,6 +87,10 @@ class StatsDataset:
         the image pixels belonging
         to each class considering the exclusion mode
 
+    The image_by_class DataArrays are only stored for the input stats
+    given with their dz_values (overlapping classes or lazy data),
+    instead of the labels_by_class DataArrays.
+
     :attributes:
 
                 - name : name of the classification_layer. str
@@ -96,7 +120,11 @@ class StatsDataset:
             )
 
     def add_classif_layer_and_mode_stats(
-        self, classif_name: str, input_stats: List[Dict], mode_name: str
+        self,
+        classif_name: str,
+        input_stats: List[Dict],
+        mode_name: str,
+        class_labels: np.ndarray = None,
     ):
         """
         Add the stats of a classification layer and
@@ -104,11 +132,15 @@ class StatsDataset:
 
         :param classif_name: classification_layer name
         :type classif_name: str
-        :param input_stats: input statistics
+        :param input_stats: input statistics, with the
+          dz_values of each class if class_labels is None
         :type input_stats: List[str]
         :mode_name: name of the mode (standard (no name),
           intersection, exclusion)
         :type mode_name: str
+        :param class_labels: class index of each pixel of the mode,
+          -1 for the pixels out of the classes and the mode
+        :type class_labels: np.ndarray or None
         :return: None
         """
         # If no xr.Dataset exists for the classification layer,
@@ -132,12 +164,11 @@ class StatsDataset:
             self.classif_layers_dataset.append(new_dataset)
 
         # Image and stats indicator name
-        if mode_name == "standard":
-            image_indicator = "image_by_class"
-            stats_indicator = "stats_by_class"
-        else:
-            image_indicator = "image_by_class_" + mode_name
-            stats_indicator = "stats_by_class_" + mode_name
+        (
+            image_indicator,
+            labels_indicator,
+            stats_indicator,
+        ) = self._get_mode_indicators(mode_name)
 
         # Add the mode of the corresponding classification layer on the
         # classif_layers_and_modes dictionary if doesn't exist in classif modes
@@ -152,73 +183,82 @@ class StatsDataset:
         dataset_idx = list(self.classif_layers_and_modes.keys()).index(
             classif_name
         )
-        # Initialize the classification layer classes
-        classes = list(np.arange(len(input_stats)))
-        # Define coords, the third col is the indicator
-        # with the number of classes
-        coords_classification_layers = [
-            self.classif_layers_dataset[dataset_idx].coords["row"],
-            self.classif_layers_dataset[dataset_idx].coords["col"],
-            classes,
-        ]
-        # Initialize the image data by class
-        # Each dataset has one xr.DataArray per mode indicating
-        # the image by class
-        image_maps = np.full(
-            (
-                self.image.shape[0],
-                self.image.shape[1],
-                len(classes),
-            ),
-            np.nan,
-            dtype=np.float32,
-        )
+        dataset = self.classif_layers_dataset[dataset_idx]
         # Initialize the stats_by_class + mode_name dictionary on
         # the dataset attrs
-        if (
-            stats_indicator
-            not in self.classif_layers_dataset[dataset_idx].attrs
-        ):
-            self.classif_layers_dataset[dataset_idx].attrs[stats_indicator] = {}
+        if stats_indicator not in dataset.attrs:
+            dataset.attrs[stats_indicator] = {}
         # Iterate to obtain the stats per class
         # overwrite if mode/stat is already present
         for class_idx, class_stats in enumerate(input_stats):
-            # Fill the alti diff of the corresponding class
-            # with the input dz_values
-            image_maps[:, :, class_idx] = class_stats["dz_values"]
-            # Make a copy of the class_stats dictionary to make
-            # temporal changes
-            tmp_class_stats = copy.deepcopy(class_stats)
-            # Pop the dz_values dictionary key to iterate over
-            # the rest of metrics
-            tmp_class_stats.pop("dz_values")
             # Scalar metrics are stored in attrs
             # of the dataset
             # Initialize the stats_by_class + mode_name +
             # class_idx dictionary
-            if (
-                class_idx
-                not in self.classif_layers_dataset[dataset_idx].attrs[
-                    stats_indicator
-                ]
-            ):
-                self.classif_layers_dataset[dataset_idx].attrs[stats_indicator][
-                    class_idx
-                ] = {}
-            # Add each metric on the dictionary
-            for stat_name, stat_value in tmp_class_stats.items():
-                self.classif_layers_dataset[dataset_idx].attrs[stats_indicator][
-                    class_idx
-                ][stat_name] = stat_value
+            if class_idx not in dataset.attrs[stats_indicator]:
+                dataset.attrs[stats_indicator][class_idx] = {}
+            # Add each metric on the dictionary, except the dz_values
+            for stat_name, stat_value in class_stats.items():
+                if stat_name != "dz_values":
+                    dataset.attrs[stats_indicator][class_idx][
+                        stat_name
+                    ] = stat_value
 
         # Create and add the xr.DataArray to the dataset
         # overload if already present (through dataset_idx above)
-        self.classif_layers_dataset[dataset_idx][image_indicator] = (
-            xr.DataArray(
+        if class_labels is not None:
+            # One label map per mode, the image by class
+            # being materialized on access
+            dataset[labels_indicator] = xr.DataArray(
+                data=class_labels,
+                coords=[dataset.coords["row"], dataset.coords["col"]],
+                dims=["row", "col"],
+            )
+            if image_indicator in dataset:
+                dataset = dataset.drop_vars(image_indicator)
+        else:
+            # Fill the alti diff of each class with its input dz_values
+            image_maps = np.full(
+                (
+                    self.image.shape[0],
+                    self.image.shape[1],
+                    len(input_stats),
+                ),
+                np.nan,
+                dtype=np.float32,
+            )
+            for class_idx, class_stats in enumerate(input_stats):
+                image_maps[:, :, class_idx] = class_stats["dz_values"]
+            dataset[image_indicator] = xr.DataArray(
                 data=image_maps,
-                coords=coords_classification_layers,
+                coords=[
+                    dataset.coords["row"],
+                    dataset.coords["col"],
+                    list(np.arange(len(input_stats))),
+                ],
                 dims=["row", "col", "classes"],
             )
+            if labels_indicator in dataset:
+                dataset = dataset.drop_vars(labels_indicator)
+        self.classif_layers_dataset[dataset_idx] = dataset
+
+    @staticmethod
+    def _get_mode_indicators(mode_name: str) -> Tuple[str, str, str]:
+        """
+        Returns the image by class, labels by class and stats by
+        class indicator names of a mode
+
+        :param mode_name: mode (standard (or no name), intersection,
+          exclusion)
+        :type mode_name: str
+        :return: image, labels and stats indicators
+        :rtype: Tuple[str, str, str]
+        """
+        suffix = "" if mode_name in ("standard", "") else "_" + mode_name
+        return (
+            "image_by_class" + suffix,
+            "labels_by_class" + suffix,
+            "stats_by_class" + suffix,
         )
 
     def save_as_csv_and_json(
@@ -320,6 +360,53 @@ class StatsDataset:
         )
         return self.classif_layers_dataset[idx]
 
+    def get_classification_layer_image_by_class(
+        self,
+        classification_layer: str,
+        mode: str = "standard",
+        classif_class: int = None,
+    ) -> np.ndarray:
+        """
+        Returns the image pixels belonging to a class of the
+        input classification layer and mode, nan elsewhere.
+        Materialized on access from the mode labels map.
+
+        :param classification_layer: classification_layer name
+        :type classification_layer: str
+        :param mode: mode (standard (or no name), intersection, exclusion)
+        :type mode: str
+        :param classif_class: classification_layer class index,
+          if None the 3D (row, col, nb_classes) image of all the classes
+          is returned
+        :type classif_class: int
+        :return: 2D (row, col) image of the class or
+          3D (row, col, nb_classes) image by class
+        :rtype: np.ndarray
+        """
+        dataset = self.get_classification_layer_dataset(classification_layer)
+        (
+            image_indicator,
+            labels_indicator,
+            stats_indicator,
+        ) = self._get_mode_indicators(mode)
+        # Image by class stored from the input dz_values
+        if image_indicator in dataset:
+            if classif_class is None:
+                return dataset[image_indicator].data
+            return dataset[image_indicator].data[:, :, classif_class]
+
+        class_labels = dataset[labels_indicator].data
+        if classif_class is None:
+            classes = np.arange(len(dataset.attrs[stats_indicator]))
+            return np.where(
+                class_labels[:, :, np.newaxis] == classes,
+                dataset["image"].data[:, :, np.newaxis],
+                np.nan,
+            ).astype(np.float32)
+        return np.where(
+            class_labels == classif_class, dataset["image"].data, np.nan
+        ).astype(np.float32)
+
     def get_classification_layer_stats(self, classification_layer: str) -> Dict:
         """
         Returns all the stats corresponding to
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Mainly contains the StatsMasks class, computing the validity
+and outliers masks of a stats dem once for all its
+classification layers and modes.
+"""
+
+# Standard imports
+from typing import Union
+
+# Third party imports
+import numpy as np
+
+# DEMcompare imports
+from .lazy_tools import compute_if_lazy
+
+
+class StatsMasks:
+    """
+    StatsMasks class
+    Validity and outliers masks of a stats dem image, each computed
+    once on its first use and shared by all the classification
+    layers and modes of the stats computation.
+    """
+
+    def __init__(
+        self, array: np.ndarray, nodata_value: Union[int, float, None] = None
+    ):
+        """
+        Initialization of a StatsMasks object
+
+        :param array: stats dem image
+        :type array: np.ndarray
+        :param nodata_value: no data value considered. Default: None
+        :type nodata_value: int, float or None
+        :return: None
+        """
+        # Stats dem image
+        self.array = array
+        # No data value of the image
+        self.nodata_value = nodata_value
+        # Cached masks
+        self._nonan_mask: np.ndarray = None
+        self._no_data_location: np.ndarray = None
+        self._outliers_free_mask: np.ndarray = None
+
+    @property
+    def nonan_mask(self) -> np.ndarray:
+        """
+        Mask of True where the image is neither nan nor nodata
+
+        :return: nonan mask
+        :rtype: np.ndarray
+        """
+        if self._nonan_mask is None:
+            self._nonan_mask = compute_nonan_mask(self.array, self.nodata_value)
+        return self._nonan_mask
+
+    @property
+    def no_data_location(self) -> np.ndarray:
+        """
+        Mask of True where the image is nan or nodata
+
+        :return: no data location
+        :rtype: np.ndarray
+        """
+        if self._no_data_location is None:
+            self._no_data_location = ~self.nonan_mask
+        return self._no_data_location
+
+    @property
+    def outliers_free_mask(self) -> np.ndarray:
+        """
+        Mask of True where the image value is no outlier,
+        see compute_outliers_free_mask
+
+        :return: outliers free mask
+        :rtype: np.ndarray
+        """
+        if self._outliers_free_mask is None:
+            self._outliers_free_mask = compute_outliers_free_mask(
+                self.array, self.nonan_mask
+            )
+        return self._outliers_free_mask
+
+
+def compute_nonan_mask(
+    array: np.ndarray, nodata_value: Union[int, float, None] = None
+) -> np.ndarray:
+    """
+    Get no data and nan mask value
+
+    :param array: input array to get the mask from
+    :type array: np.ndarray
+    :param nodata_value: no data value considered. Default: None
+    :type nodata_value: int, float or None
+    :return: nan and nodata_value if exists mask on array.
+    :rtype: np.ndarray
+    """
+    # If no nodata value is specified, just detect nan values
+    if nodata_value is None:
+        return ~np.isnan(array)
+    # If nodata value is specified, detect both nan and nodata values
+    return (~np.isnan(array)) * (array != nodata_value)
+
+
+def compute_outliers_free_mask(
+    array: np.ndarray, nonan_mask: np.ndarray
+) -> np.ndarray:
+    """
+    Get outliers free mask (array of True where value is no outlier) with
+    values outside (mu + 3 sigma) and (mu - 3 sigma).
+    Nan and nodata values are not considered in mu and sigma computation.
+
+    :param array: input array to get the mask from
+    :type array: np.ndarray
+    :param nonan_mask: nan and nodata free mask of the array
+    :type nonan_mask: np.ndarray
+    :return: outliers free mask (array of True where value is no outlier)
+    :rtype: np.ndarray
+    """
+    # Apply the nonan and nodata mask to the input array
+    array_without_nan = array[nonan_mask]
+    # Compute mean and std of the input array
+    # (in a single pass over the chunks of a lazy array)
+    mu, sigma = compute_if_lazy(
+        np.mean(array_without_nan), np.std(array_without_nan)
+    )
+    # Compute the outliers free mask on the input array
+    return (array > mu - 3 * sigma) * (array < mu + 3 * sigma)
@@ -41,6 +41,7 @@ from demcompare.metric import Metric
 
 from .internal_typing import ConfigType
 from .stats_dataset import StatsDataset
+from .stats_masks import StatsMasks
 
 
 class StatsProcessing:
@@ -106,6 +107,8 @@ class StatsProcessing:
             # create stats module output directory if given in configuration
             # if used in standalone, be sure that the path is absolute
             os.makedirs(cfg["output_dir"], exist_ok=True)
+        # Output GeoTIFF profile
+        self.output_profile: Union[Dict, None] = self.cfg["output_profile"]
 
         # DEM processing method
         self.dem_processing_method = dem_processing_method
@@ -126,6 +129,11 @@ class StatsProcessing:
             self.stats_dataset: StatsDataset = StatsDataset(
                 self.dem["image"].data, self.dem_processing_method
             )
+            # Validity and outliers masks of the dem,
+            # computed once for all the classification layers
+            self.stats_masks: StatsMasks = StatsMasks(
+                self.dem["image"].data, self.dem.attrs["nodata"]
+            )
             # Create classification layers
             self._create_classif_layers()
 
@@ -148,9 +156,9 @@ class StatsProcessing:
             cfg["classification_layers"] = {}
 
         # Add default global layer
-        cfg["classification_layers"][self._DEFAULT_GLOBAL_LAYER_NAME] = (
-            copy.deepcopy(self._DEFAULT_GLOBAL_LAYER)
-        )
+        cfg["classification_layers"][
+            self._DEFAULT_GLOBAL_LAYER_NAME
+        ] = copy.deepcopy(self._DEFAULT_GLOBAL_LAYER)
 
         # If metrics have been specified,
         # add them to all classif layers
@@ -175,6 +183,8 @@ class StatsProcessing:
             cfg["remove_outliers"] = self._REMOVE_OUTLIERS
         if "output_dir" not in cfg:
             cfg["output_dir"] = None
+        if "output_profile" not in cfg:
+            cfg["output_profile"] = None
         return cfg
 
     def _create_classif_layers(self):
@@ -195,6 +205,7 @@ class StatsProcessing:
                     # Set output_dir on the classif
                     # layer's cfg
                     clayer["output_dir"] = self.output_dir
+                    clayer["output_profile"] = self.output_profile
                     # If outliers handling has not been specified
                     # on the classification layer cfg,
                     # add the global statistics one
@@ -298,7 +309,10 @@ class StatsProcessing:
             )
 
             classif.compute_classif_stats(
-                self.dem, self.stats_dataset, metrics=metrics
+                self.dem,
+                self.stats_dataset,
+                metrics=metrics,
+                stats_masks=self.stats_masks,
             )
 
         return self.stats_dataset
@@ -31,6 +31,10 @@ from collections import OrderedDict
 import numpy as np
 import pytest
 
+# Demcompare imports
+from demcompare import dem_tools
+from demcompare.stats_dataset import StatsDataset
+
 
 @pytest.mark.unit_tests
 def test_create_merged_classes(initialize_fusion_layer):
@@ -187,3 +191,48 @@ def test_create_labelled_map(initialize_fusion_layer):
     )
 
     np.testing.assert_equal(gt_map_image, fusion_layer_.map_image["sec"])
+
+
+@pytest.mark.unit_tests
+def test_compute_classif_stats(initialize_fusion_layer):
+    """
+    Test the compute_classif_stats function of a fusion layer
+    Input data:
+    - Fusion classification layer from the "initialize_fusion_layer"
+      fixture
+    - Manually created image to compute the stats from
+    Validation data:
+    - Manually computed mean and number of points of each
+      fusion layer's class
+    Validation process:
+    - Compute the stats of the image on the fusion layer
+    - Check that the fusion classes masks are boolean
+    - Check the mean and number of points of each class
+    - Checked function : FusionClassificationLayer's
+      compute_classif_stats
+    """
+    fusion_layer_ = initialize_fusion_layer
+
+    # Fusion layer's classes masks, see test_merge_classes_and_create_sets_masks
+    # class 1: (0, 0), class 2: (3, 2), class 3: (1, 2),
+    # class 4: (0, 1), class 5: (0, 2) and (1, 0),
+    # class 6: (1, 1) and (3, 1)
+    image = np.arange(12, dtype=np.float32).reshape((4, 3))
+    data = dem_tools.create_dem(data=image)
+    stats_dataset = StatsDataset(image)
+
+    fusion_layer_.compute_classif_stats(data, stats_dataset, metrics=["mean"])
+
+    for class_mask in fusion_layer_.classes_masks["sec"]:
+        assert class_mask.dtype == bool
+
+    # Ground truth mean and number of points of each class
+    gt_means = [0.0, 11.0, 5.0, 1.0, 2.5, 7.0]
+    gt_nbpts = [1, 1, 1, 1, 2, 2]
+    stats_by_class = stats_dataset.get_classification_layer_stats("Fusion0")[
+        "stats_by_class"
+    ]
+    assert len(stats_by_class) == len(gt_means)
+    for idx, (gt_mean, gt_nbpt) in enumerate(zip(gt_means, gt_nbpts)):
+        np.testing.assert_allclose(stats_by_class[idx]["mean"], gt_mean)
+        assert stats_by_class[idx]["nbpts"] == gt_nbpt
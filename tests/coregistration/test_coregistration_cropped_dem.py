@@ -23,6 +23,7 @@
 """
 This module contains functions to test
 the coregistration.crop_dem_with_offset function
+and the classification layers crop and interpolation
 """
 # pylint:disable=protected-access
 # pylint:disable=duplicate-code
@@ -30,6 +31,10 @@ the coregistration.crop_dem_with_offset function
 # Third party imports
 import numpy as np
 import pytest
+import xarray as xr
+
+# Demcompare imports
+from demcompare.img_tools import shift_image
 
 
 @pytest.mark.unit_tests
@@ -150,3 +155,70 @@ def test_crop_dem_with_offset_neg_x_neg_y(initialize_dem_and_coreg):
         int(np.floor(-x_offset)) : input_dem.shape[1],
     ]
     np.testing.assert_equal(gt_cropped_dem, output_cropped_dem)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "x_offset, y_offset", [(2.3, 4.7), (-1.6, 2.2), (-2.3, -1.4)]
+)
+def test_crop_and_interpolate_classif_layers(
+    initialize_dem_and_coreg, x_offset, y_offset
+):
+    """
+    Test the crop_classif_layers and interpolate_classif_layers functions
+    Input data:
+    - Manually computed three labels classification layers
+    - Coregistration object created by fixture initialize_dem_and_coreg
+    Validation data:
+    - Each layer cropped with crop_dem_with_offset and shifted
+      with shift_image
+    Validation process:
+    - Interpolates and crops the classification layers
+    - Checks that the cropped layers are a view on the input cube
+      with new row and col coordinates
+    - Checks that the input layers are not modified by the
+      interpolation
+    - Checks that all the layers are the same as ground truth
+        - Checked functions: coregistration.crop_classif_layers,
+          coregistration.interpolate_classif_layers
+    """
+    coregistration_, _ = initialize_dem_and_coreg
+
+    rng = np.random.default_rng(0)
+    layers = rng.integers(0, 4, (12, 10, 3), dtype=np.uint8)
+    dem_classif = xr.DataArray(
+        data=layers.copy(),
+        coords={
+            "row": np.arange(12),
+            "col": np.arange(10),
+            "indicator": ["a", "b", "c"],
+        },
+        dims=["row", "col", "indicator"],
+    )
+
+    cropped_classif = coregistration_.crop_classif_layers(
+        dem_classif, x_offset, y_offset
+    )
+    assert np.shares_memory(cropped_classif.data, dem_classif.data)
+    np.testing.assert_array_equal(
+        cropped_classif.coords["row"], np.arange(cropped_classif.shape[0])
+    )
+    assert list(cropped_classif.coords["indicator"].data) == ["a", "b", "c"]
+
+    interp_classif = coregistration_.interpolate_classif_layers(
+        dem_classif, x_offset, y_offset
+    )
+    np.testing.assert_array_equal(dem_classif.data, layers)
+    assert interp_classif.dtype == np.uint8
+
+    for idx in range(layers.shape[2]):
+        np.testing.assert_array_equal(
+            cropped_classif.data[:, :, idx],
+            coregistration_.crop_dem_with_offset(
+                layers[:, :, idx], x_offset, y_offset
+            ),
+        )
+        np.testing.assert_array_equal(
+            interp_classif.data[:, :, idx],
+            shift_image(layers[:, :, idx], x_offset, -y_offset, "nearest", 255),
+        )
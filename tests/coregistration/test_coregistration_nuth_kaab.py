@@ -25,16 +25,51 @@ This module contains functions to test all the
 methods in the Nuth et Kaab coregistration method.
 """
 # pylint:disable=protected-access
-# pylint:disable=duplicate-code
+# pylint:disable=duplicate-code,too-many-lines
 
 # Third party imports
+import matplotlib.pyplot as pl
 import numpy as np
 import pytest
 import scipy
 from json_checker import DictCheckerError
+from rasterio.crs import CRS
 
 # Demcompare imports
-from demcompare import coregistration
+from demcompare import coregistration, dem_tools, img_tools
+
+
+def create_shifted_dems(x_offset, y_offset, z_offset):
+    """
+    Creates a smooth ref dem and the sec dem shifted
+    by the input offsets
+
+    :param x_offset: x offset in pixels
+    :type x_offset: float
+    :param y_offset: y offset in pixels
+    :type y_offset: float
+    :param z_offset: elevation bias
+    :type z_offset: float
+    :return: sec and ref dems
+    :rtype: Tuple[xr.Dataset, xr.Dataset]
+    """
+    rows, cols = np.meshgrid(np.arange(296), np.arange(296), indexing="ij")
+    terrain = 300 * np.sin(rows / 23.0) * np.cos(cols / 31.0) + 2 * rows
+    ref_im = terrain[20:-20, 20:-20].astype(np.float32)
+    sec_im = (
+        img_tools.shift_image(terrain, x_offset, y_offset, "bicubic")[
+            20:-20, 20:-20
+        ]
+        + z_offset
+    ).astype(np.float32)
+    transform = np.array([600000.0, 30.0, 0.0, 5000000.0, 0.0, -30.0])
+    ref = dem_tools.create_dem(
+        ref_im, transform=transform, img_crs=CRS.from_epsg(32630)
+    )
+    sec = dem_tools.create_dem(
+        sec_im, transform=transform, img_crs=CRS.from_epsg(32630)
+    )
+    return sec, ref
 
 
 @pytest.mark.unit_tests
@@ -214,6 +249,60 @@ def test_filter_target():
     )
 
 
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("aspect_dtype", [np.float32, np.float64])
+def test_filter_target_slices(aspect_dtype):
+    """
+    Test the filter_target aspect slices grouping
+    Input data:
+    - Random aspect with nan values and values on the slices bounds,
+      random heavy tailed target with nan values
+    Validation data:
+    - Filtered target and medians computed slice by slice
+      with the bounds < aspect < bounds + pi / 36 slices
+    Validation process:
+    - Creates a coregistration object and does filter_target
+    - Check that the outputs are equal to the slice by slice ones
+    """
+    cfg = {"method_name": "nuth_kaab_internal", "number_of_iterations": 6}
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
+
+    rng = np.random.default_rng(0)
+    aspect = rng.uniform(0, 2 * np.pi, 20000).astype(aspect_dtype)
+    aspect[::50] = np.nan
+    aspect[1:5000:7] = coregistration_.aspect_bounds[18]
+    aspect[2:5000:7] = 2 * np.pi
+    target = rng.standard_cauchy(20000)
+    target[::13] = np.nan
+
+    gt_slice_filt_median = []
+    gt_filtered_target = np.full(target.shape, np.nan)
+    for bounds in coregistration_.aspect_bounds:
+        slice_idxes = np.where(
+            (bounds < aspect) & (aspect < bounds + np.pi / 36)
+        )
+        target_slice = target[slice_idxes]
+        slice_mean = np.nanmean(target_slice)
+        slice_sigma = np.std(target_slice[np.isfinite(target_slice)])
+        target_slice[
+            (target_slice < slice_mean - 3 * slice_sigma)
+            | (target_slice > slice_mean + 3 * slice_sigma)
+        ] = np.nan
+        gt_filtered_target[slice_idxes] = target_slice
+        gt_slice_filt_median.append(np.nanmedian(target_slice))
+
+    (
+        output_slice_filt_median,
+        output_filtered_target,
+    ) = coregistration_._filter_target(aspect, target)
+
+    np.testing.assert_array_equal(
+        output_slice_filt_median, gt_slice_filt_median
+    )
+    np.testing.assert_array_equal(output_filtered_target, gt_filtered_target)
+
+
 @pytest.mark.unit_tests
 def test_nuth_kaab_single_iter():
     """
@@ -302,39 +391,32 @@ def test_nuth_kaab_single_iter():
 
 
 @pytest.mark.unit_tests
-def test_interpolate_dem_on_grid():
+@pytest.mark.parametrize(
+    "x_offset, y_offset", [(0.3, -0.7), (-1.6, 0.45), (1.0, 2.0)]
+)
+def test_shift_image_on_grid(x_offset, y_offset):
     """
-    Test the interpolate_dem_on_grid function
+    Test the dem resampling of the Nuth & Kaab iterations
     Input data:
-    - Manually computed data with spline interpolators
+    - Manually computed dem with nan values
     Validation data:
-    - Manually computed ground truth gt_masked_dem, gt_nan_mask
-    and gt_spline_1 and gt_spline_2 with scipy RectBivariateSpline function
+    - The dem resampled with scipy RectBivariateSpline linear
+      splines of the dem and of its nan mask, as done before
+      the shift engine
     Validation process:
-    - Creates a coregistration object and does interpolate_dem_on_grid
-    - Test that the output splines are the same as ground_truth
-      spline.tck is a tuple (t,c,k) containing the vector of knots,
-      the B-spline coefficients, and the degree of the spline.
+    - Shift the dem with img_tools's shift_image bilinear method
+      as the Nuth & Kaab iterations
+    - Test that the shifted dem and its nan values are the same as
+      the spline resampled ones
     """
-    # Define cfg
-    cfg = {
-        "method_name": "nuth_kaab_internal",
-        "number_of_iterations": 6,
-        "estimated_initial_shift_x": 0,
-        "estimated_initial_shift_y": 0,
-    }
-
-    # Initialize coregistration object
-    coregistration_ = coregistration.Coregistration(cfg)
-
     # Define input_dem array
     input_dem = np.array(
         (
-            [1, 1, np.nan],
-            [-1, 2, 1],
-            [4, -3, np.nan],
-            [np.nan, 1, 1],
-            [1, 1, np.nan],
+            [1, 1, np.nan, 2],
+            [-1, 2, 1, 3],
+            [4, -3, np.nan, 0],
+            [np.nan, 1, 1, 5],
+            [1, 1, np.nan, 2],
         ),
         dtype=np.float64,
     )
@@ -343,51 +425,365 @@ def test_interpolate_dem_on_grid():
     xgrid = np.arange(input_dem.shape[1])
     ygrid = np.arange(input_dem.shape[0])
 
-    # Masked input_dem used to obtain spline_1 interpolator
-    gt_masked_dem = np.array(
-        (
-            [1, 1, -9999],
-            [-1, 2, 1],
-            [4, -3, -9999],
-            [-9999, 1, 1],
-            [1, 1, -9999],
-        ),
-        dtype=np.float64,
+    # Compute the ground truth with the splines of the masked
+    # dem and of its nan mask
+    nan_mask = np.isnan(input_dem)
+    gt_spline_1 = scipy.interpolate.RectBivariateSpline(
+        ygrid, xgrid, np.where(nan_mask, -9999, input_dem), kx=1, ky=1
     )
-    # input_dem's mask used to obtain spline_2 interpolators
-    gt_nan_mask = np.array(
-        (
-            [False, False, True],
-            [False, False, False],
-            [False, False, True],
-            [True, False, False],
-            [False, False, True],
+    gt_spline_2 = scipy.interpolate.RectBivariateSpline(
+        ygrid, xgrid, nan_mask, kx=1, ky=1
+    )
+    gt_znew = gt_spline_1(ygrid - y_offset, xgrid + x_offset)
+    gt_znew[gt_spline_2(ygrid - y_offset, xgrid + x_offset) != 0] = np.nan
+
+    output_znew = img_tools.shift_image(input_dem, x_offset, -y_offset)
+
+    np.testing.assert_array_equal(np.isnan(output_znew), np.isnan(gt_znew))
+    np.testing.assert_allclose(output_znew, gt_znew, rtol=1e-12)
+
+
+@pytest.mark.unit_tests
+def test_nuth_kaab_pyramid():
+    """
+    Test the coarse to fine pyramid Nuth & Kaab coregistration
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a several pixels offset and an elevation bias
+    Validation data:
+    - The input offsets and bias
+    Validation process:
+    - Coregister the dems with pyramid levels and a single
+      full resolution iteration
+    - Check that the offsets and bias are the input ones
+    - Check that too many pyramid levels raise a DictCheckerError
+    - Checked function : NuthKaabInternal's _coregister_dems_algorithm
+    """
+    sec, ref = create_shifted_dems(4.4, -3.2, 2)
+
+    cfg = {
+        "method_name": "nuth_kaab_internal",
+        "number_of_iterations": 1,
+        "pyramid_levels": 2,
+        "pyramid_iterations": 4,
+    }
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+
+    np.testing.assert_allclose(transform.x_offset, 4.4, atol=0.02)
+    np.testing.assert_allclose(transform.y_offset, -3.2, atol=0.02)
+    np.testing.assert_allclose(transform.z_offset, -2, atol=0.05)
+
+    cfg["pyramid_levels"] = 8
+    with pytest.raises(DictCheckerError):
+        _ = coregistration.Coregistration(cfg)
+
+
+@pytest.mark.unit_tests
+def test_nuth_kaab_pyramid_final_iterations():
+    """
+    Test the number of full resolution Nuth & Kaab iterations
+    after the coarse to fine pyramid
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a several pixels offset and an elevation bias
+    Validation data:
+    - The input offsets and bias
+    Validation process:
+    - Coregister the dems with the default number_of_iterations,
+      without and with pyramid levels
+    - Check that the full resolution stage runs number_of_iterations
+      iterations without pyramid and pyramid_final_iterations
+      iterations with pyramid
+    - Check that the offsets and bias are the input ones
+    - Checked function : NuthKaabInternal's _coregister_dems_algorithm
+    """
+    full_resolution_iterations = []
+    for pyramid_levels in [0, 2]:
+        # The ref dem is unbiased in place by the coregistration
+        sec, ref = create_shifted_dems(4.4, -3.2, 2)
+        cfg = {
+            "method_name": "nuth_kaab_internal",
+            "pyramid_levels": pyramid_levels,
+            "pyramid_final_iterations": 2,
+        }
+        coregistration_ = coregistration.Coregistration(cfg)
+        coregistration_.adapting_factor = (1.0, 1.0)
+        transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+        full_resolution_iterations.append(
+            sum(
+                iteration["pyramid_level"] == 0
+                for iteration in coregistration_.convergence_results[
+                    "iterations"
+                ]
+            )
+        )
+
+    assert full_resolution_iterations == [
+        coregistration_.DEFAULT_ITERATIONS,
+        2,
+    ]
+    np.testing.assert_allclose(transform.x_offset, 4.4, atol=0.02)
+    np.testing.assert_allclose(transform.y_offset, -3.2, atol=0.02)
+    np.testing.assert_allclose(transform.z_offset, -2, atol=0.05)
+
+
+@pytest.mark.unit_tests
+def test_draw_fit_sample():
+    """
+    Test the Nuth & Kaab fit pixels sampling
+    Input data:
+    - Manually created elevation difference with nan values and
+      an aspect with a scarce aspect slice
+    Validation data:
+    - None
+    Validation process:
+    - Check that all the valid pixels are fitted without max_fit_points
+    - Draw the fit sample with max_fit_points
+    - Check that the sample is reproducible, of valid pixels, has
+      at most max_fit_points / 72 pixels in each aspect slice and
+      keeps all the pixels of the scarce aspect slice
+    - Checked function : NuthKaabInternal's _draw_fit_sample
+    """
+    rng = np.random.default_rng(0)
+    dh = rng.normal(0, 1, (200, 300))
+    dh[rng.random(dh.shape) < 0.1] = np.nan
+    aspect = rng.uniform(0, np.pi, dh.shape)
+    # Scarce aspect slice
+    aspect[::40, ::40] = 1.5 * np.pi + 0.01
+
+    cfg = {"method_name": "nuth_kaab_internal", "number_of_iterations": 6}
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
+    np.testing.assert_array_equal(
+        coregistration_._draw_fit_sample(dh, aspect), np.isfinite(dh)
+    )
+
+    cfg["max_fit_points"] = 7200
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
+    sample = coregistration_._draw_fit_sample(dh, aspect)
+    np.testing.assert_array_equal(
+        np.ravel_multi_index(sample, dh.shape),
+        np.ravel_multi_index(
+            coregistration_._draw_fit_sample(dh, aspect), dh.shape
         ),
-        dtype=np.float64,
     )
-    output_spline_1, output_spline_2 = coregistration_.interpolate_dem_on_grid(
-        input_dem, xgrid, ygrid
+    assert np.isfinite(dh[sample]).all()
+    slices = np.floor(aspect[sample] / (np.pi / 36)).astype(int)
+    slice_counts = np.bincount(slices)
+    assert slice_counts.max() <= 100
+    assert len(slices) <= cfg["max_fit_points"]
+    # The drawn valid candidates of the scarce slice are all kept
+    candidates = coregistration_._draw_sample_candidates(dh.size)
+    candidates = candidates[np.isfinite(dh.ravel()[candidates])]
+    scarce_candidates = (
+        np.floor(aspect.ravel()[candidates] / (np.pi / 36)) == 54
     )
+    assert 0 < slice_counts[54] == np.count_nonzero(scarce_candidates)
 
-    # Compute both ground_truth splines
-    gt_spline_1 = scipy.interpolate.RectBivariateSpline(
-        ygrid, xgrid, gt_masked_dem, kx=1, ky=1
+
+@pytest.mark.unit_tests
+def test_draw_fit_sample_small_max_fit_points():
+    """
+    Test the Nuth & Kaab fit sample with a max_fit_points
+    below the number of aspect slices
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a sub-pixel offset
+    Validation data:
+    - None
+    Validation process:
+    - Draw the fit sample with max_fit_points = 50
+    - Check that the sample has max_fit_points valid pixels,
+      at most one per aspect slice
+    - Coregister the dems and check that the offsets are finite
+    - Checked function : NuthKaabInternal's _draw_fit_sample
+      and _coregister_dems_algorithm
+    """
+    rng = np.random.default_rng(0)
+    dh = rng.normal(0, 1, (200, 300))
+    aspect = rng.uniform(0, 2 * np.pi, dh.shape)
+
+    cfg = {
+        "method_name": "nuth_kaab_internal",
+        "number_of_iterations": 2,
+        "max_fit_points": 50,
+    }
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.aspect_bounds = np.arange(0, 2 * np.pi, np.pi / 36)
+    sample = coregistration_._draw_fit_sample(dh, aspect)
+    assert len(sample[0]) == cfg["max_fit_points"]
+    assert np.isfinite(dh[sample]).all()
+    slices = np.floor(aspect[sample] / (np.pi / 36)).astype(int)
+    assert np.bincount(slices).max() == 1
+
+    sec, ref = create_shifted_dems(0.6, -0.3, 2)
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+    assert np.isfinite(
+        [transform.x_offset, transform.y_offset, transform.z_offset]
+    ).all()
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "tolerances, stop_reason",
+    [
+        ({}, "max_iterations"),
+        ({"convergence_tolerance": 0.01}, "convergence_tolerance"),
+        ({"nmad_gain_tolerance": 1.0}, "nmad_gain_tolerance"),
+    ],
+)
+def test_nuth_kaab_convergence(tolerances, stop_reason):
+    """
+    Test the Nuth & Kaab iterations convergence control
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a sub-pixel offset
+    Validation data:
+    - The input offsets and the expected stop reason
+    Validation process:
+    - Coregister the dems with a maximum number of iterations and
+      the convergence tolerances
+    - Check the offsets, the stop reason and the per iteration results
+    - Check that a negative convergence tolerance raises
+      a DictCheckerError
+    - Checked function : NuthKaabInternal's _coregister_dems_algorithm
+    """
+    sec, ref = create_shifted_dems(0.6, -0.3, 2)
+    cfg = {"method_name": "nuth_kaab_internal", "number_of_iterations": 10}
+    cfg.update(tolerances)
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+
+    np.testing.assert_allclose(transform.x_offset, 0.6, atol=0.02)
+    np.testing.assert_allclose(transform.y_offset, -0.3, atol=0.02)
+    results = coregistration_.convergence_results
+    assert results["stop_reason"] == stop_reason
+    iterations = results["iterations"]
+    if stop_reason == "max_iterations":
+        assert len(iterations) == 10
+    else:
+        assert len(iterations) < 10
+    assert [iteration["iteration"] for iteration in iterations] == list(
+        range(1, len(iterations) + 1)
     )
-    gt_spline_2 = scipy.interpolate.RectBivariateSpline(
-        ygrid, xgrid, gt_nan_mask, kx=1, ky=1
+    np.testing.assert_allclose(
+        iterations[-1]["x_offset"], transform.x_offset, atol=1e-5
+    )
+    assert all(iteration["time"] >= 0 for iteration in iterations)
+
+    cfg["convergence_tolerance"] = -1
+    with pytest.raises(DictCheckerError):
+        _ = coregistration.Coregistration(cfg)
+
+
+@pytest.mark.unit_tests
+def test_nuth_kaab_no_plots(monkeypatch):
+    """
+    Test that the Nuth & Kaab figures are only built if
+    the optional outputs are saved
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a sub-pixel offset
+    Validation data:
+    - The input offsets
+    Validation process:
+    - Coregister the dems without optional outputs,
+      pyplot figures creation and the elevation difference
+      plots raising an error
+    - Check that the offsets are the input ones
+    - Checked function : NuthKaabInternal's _coregister_dems_algorithm
+    """
+
+    def failing_figure(*args, **kwargs):
+        raise AssertionError("figure created without optional outputs")
+
+    monkeypatch.setattr(pl, "figure", failing_figure)
+    sec, ref = create_shifted_dems(0.6, -0.3, 2)
+    coregistration_ = coregistration.Coregistration(
+        {"method_name": "nuth_kaab_internal", "save_optional_outputs": False}
+    )
+    # The before and after elevation differences and their NMAD
+    # are only computed for these plots
+    monkeypatch.setattr(
+        coregistration_, "_save_elevation_diff_plot", failing_figure
     )
+    coregistration_.adapting_factor = (1.0, 1.0)
+    transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
 
-    # Test that the output splines are the same as ground_truth
-    # spline.tck is a tuple (t,c,k) containing the vector of knots,
-    # the B-spline coefficients, and the degree of the spline.
-    np.testing.assert_equal(gt_spline_1.tck[0], output_spline_1.tck[0])
-    np.testing.assert_equal(gt_spline_2.tck[0], output_spline_2.tck[0])
+    np.testing.assert_allclose(transform.x_offset, 0.6, atol=0.02)
+    np.testing.assert_allclose(transform.y_offset, -0.3, atol=0.02)
 
-    np.testing.assert_equal(gt_spline_1.tck[1], output_spline_1.tck[1])
-    np.testing.assert_equal(gt_spline_2.tck[1], output_spline_2.tck[1])
 
-    np.testing.assert_equal(gt_spline_1.tck[2], output_spline_1.tck[2])
-    np.testing.assert_equal(gt_spline_2.tck[2], output_spline_2.tck[2])
+@pytest.mark.unit_tests
+def test_nuth_kaab_stable_terrain():
+    """
+    Test the Nuth & Kaab coregistration on the stable terrain
+    Input data:
+    - Manually created smooth ref dem and the sec dem shifted
+      by a sub-pixel offset and an elevation bias, with a
+      "vegetation" area raised and labelled in a sec
+      classification layer
+    Validation data:
+    - The input offsets and bias
+    Validation process:
+    - Coregister the dems on the stable terrain labels
+    - Check that the offsets and bias are the input ones
+    - Check that a slope range keeps the offsets
+    - Check that an unknown layer and a wrong slope range
+      raise errors
+    - Checked functions : NuthKaabInternal's _coregister_dems_algorithm,
+      CoregistrationTemplate's compute_stable_terrain_mask
+    """
+    sec, ref = create_shifted_dems(0.6, -0.3, 2)
+    sec_im = sec["image"].data.copy()
+    layer = np.zeros(sec_im.shape + (1,), dtype=np.uint8)
+    layer[60:200, 40:160] = 1
+    sec_im[layer[:, :, 0] == 1] += 15
+    sec = dem_tools.create_dem(
+        sec_im,
+        transform=sec.georef_transform.data,
+        img_crs=CRS.from_epsg(32630),
+        classification_layer_masks={"map_arrays": layer, "names": ["Status"]},
+    )
+
+    cfg = {
+        "method_name": "nuth_kaab_internal",
+        "number_of_iterations": 6,
+        "stable_terrain": {"classification_layers": {"Status": [0]}},
+    }
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+    assert np.count_nonzero(coregistration_.stable_mask) == (
+        sec_im.size - 140 * 120
+    )
+    np.testing.assert_allclose(transform.x_offset, 0.6, atol=0.02)
+    np.testing.assert_allclose(transform.y_offset, -0.3, atol=0.02)
+    np.testing.assert_allclose(transform.z_offset, -2, atol=0.05)
+
+    cfg["stable_terrain"]["slope_range"] = [0, 30]
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    slope_transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+    assert np.count_nonzero(coregistration_.stable_mask) < (
+        sec_im.size - 140 * 120
+    )
+    np.testing.assert_allclose(slope_transform.x_offset, 0.6, atol=0.02)
+    np.testing.assert_allclose(slope_transform.y_offset, -0.3, atol=0.02)
+
+    cfg["stable_terrain"] = {"classification_layers": {"Landcover": [0]}}
+    coregistration_ = coregistration.Coregistration(cfg)
+    with pytest.raises(ValueError):
+        coregistration_._coregister_dems_algorithm(sec, ref)
+    cfg["stable_terrain"] = {"slope_range": [10, 0]}
+    with pytest.raises(ValueError):
+        _ = coregistration.Coregistration(cfg)
 
 
 @pytest.mark.unit_tests
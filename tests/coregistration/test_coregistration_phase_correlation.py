@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the
+phase correlation coregistration method.
+"""
+# pylint:disable=protected-access
+
+# Third party imports
+import numpy as np
+import pytest
+from json_checker import DictCheckerError
+from rasterio.crs import CRS
+from scipy.ndimage import gaussian_filter
+
+# Demcompare imports
+from demcompare import coregistration, dem_tools, img_tools
+
+
+def create_shifted_dems(x_offset, y_offset, z_offset):
+    """
+    Creates a rough ref dem and the sec dem shifted
+    by the input offsets
+
+    :param x_offset: x offset in pixels
+    :type x_offset: float
+    :param y_offset: y offset in pixels
+    :type y_offset: float
+    :param z_offset: elevation bias
+    :type z_offset: float
+    :return: sec and ref dems
+    :rtype: Tuple[xr.Dataset, xr.Dataset]
+    """
+    # Rough terrain of several scales, as the phase correlation
+    # relies on the whole spectrum of the dems
+    rng = np.random.default_rng(0)
+    terrain = (
+        sum(
+            50 * sigma * gaussian_filter(rng.normal(size=(296, 296)), sigma)
+            for sigma in [2, 4, 8, 16]
+        )
+        + 2 * np.arange(296)[:, np.newaxis]
+    )
+    ref_im = terrain[20:-20, 20:-20].astype(np.float32)
+    sec_im = (
+        img_tools.shift_image(terrain, x_offset, y_offset, "bicubic")[
+            20:-20, 20:-20
+        ]
+        + z_offset
+    ).astype(np.float32)
+    transform = np.array([600000.0, 30.0, 0.0, 5000000.0, 0.0, -30.0])
+    ref = dem_tools.create_dem(
+        ref_im, transform=transform, img_crs=CRS.from_epsg(32630)
+    )
+    sec = dem_tools.create_dem(
+        sec_im, transform=transform, img_crs=CRS.from_epsg(32630)
+    )
+    return sec, ref
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "correlation_image, decimation",
+    [("gradient", 1), ("hillshade", 1), ("gradient", 2)],
+)
+def test_phase_correlation(correlation_image, decimation):
+    """
+    Test the phase correlation coregistration
+    Input data:
+    - Manually created ref dem and the sec dem shifted
+      by a several pixels offset and an elevation bias
+    Validation data:
+    - The input offsets and bias
+    Validation process:
+    - Coregister the dems by phase correlation
+    - Check that the offsets and bias are the input ones
+    - Check that the coregistered dems have the same shape
+    - Check that an unknown correlation image raises a DictCheckerError
+    - Checked function : PhaseCorrelation's _coregister_dems_algorithm
+    """
+    sec, ref = create_shifted_dems(7.4, -5.2, 2)
+    cfg = {
+        "method_name": "phase_correlation",
+        "correlation_image": correlation_image,
+        "decimation": decimation,
+    }
+    coregistration_ = coregistration.Coregistration(cfg)
+    coregistration_.adapting_factor = (1.0, 1.0)
+    (
+        transform,
+        coreg_sec,
+        coreg_ref,
+    ) = coregistration_._coregister_dems_algorithm(sec, ref)
+
+    np.testing.assert_allclose(transform.x_offset, 7.4, atol=0.2)
+    np.testing.assert_allclose(transform.y_offset, -5.2, atol=0.2)
+    np.testing.assert_allclose(transform.z_offset, -2, atol=0.2)
+    assert coreg_sec["image"].shape == coreg_ref["image"].shape
+
+    cfg["correlation_image"] = "slope"
+    with pytest.raises(DictCheckerError):
+        _ = coregistration.Coregistration(cfg)
+
+
+@pytest.mark.unit_tests
+def test_nuth_kaab_phase_correlation_init():
+    """
+    Test the Nuth & Kaab offsets initialization by phase correlation
+    Input data:
+    - Manually created ref dem and the sec dem shifted
+      by a several pixels offset and an elevation bias
+    Validation data:
+    - The input offsets and bias
+    Validation process:
+    - Coregister the dems with Nuth & Kaab initialized by phase
+      correlation and a convergence tolerance
+    - Check that the offsets and bias are the input ones
+    - Check that fewer iterations are run than without initialization
+    - Checked function : NuthKaabInternal's _coregister_dems_algorithm
+    """
+    sec, ref = create_shifted_dems(7.4, -5.2, 2)
+    cfg = {
+        "method_name": "nuth_kaab_internal",
+        "number_of_iterations": 15,
+        "convergence_tolerance": 0.01,
+    }
+    iterations = []
+    for phase_correlation_init in [True, False]:
+        cfg["phase_correlation_init"] = phase_correlation_init
+        coregistration_ = coregistration.Coregistration(cfg)
+        coregistration_.adapting_factor = (1.0, 1.0)
+        transform, _, _ = coregistration_._coregister_dems_algorithm(sec, ref)
+        iterations.append(
+            len(coregistration_.convergence_results["iterations"])
+        )
+        if phase_correlation_init:
+            np.testing.assert_allclose(transform.x_offset, 7.4, atol=0.02)
+            np.testing.assert_allclose(transform.y_offset, -5.2, atol=0.02)
+            np.testing.assert_allclose(transform.z_offset, -2, atol=0.05)
+    assert iterations[0] < iterations[1]
@@ -32,6 +32,7 @@ import os
 # Third party imports
 import numpy as np
 import pytest
+import rasterio
 
 # Demcompare imports
 from demcompare import dataset_tools, dem_tools
@@ -258,3 +259,154 @@ def test_get_geoid_offset_error():
     with pytest.raises(ValueError):
         # Get geoid values
         dataset_tools._get_geoid_offset(dataset, geoid_path)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("epsg", [4326, 32630])
+def test_get_geoid_offset_upsampling(monkeypatch, epsg):
+    """
+    Test the _get_geoid_offset function on a DEM larger than
+    the geoid control grid
+    Input data:
+    - Manually created projected and geographic DEMs
+      crossing several geoid grid lines
+    Validation data:
+    - The geoid offset computed on every pixel
+    Validation process:
+    - Compute the offset on the control grid, and on every pixel
+      setting the control grid step to 1
+    - Check that they are equal up to GEOID_MAX_ERROR
+    - Check that the geoid grid is read once
+    - Checked function : dataset_tools's _get_geoid_offset
+    """
+    geoid_path = demcompare_path("geoid/egm96_15.gtx")
+    if epsg == 4326:
+        trans = np.array([5.0, 1 / 1200, 0.0, 45.0, 0.0, -1 / 1200])
+    else:
+        trans = np.array([600000.0, 90.0, 0.0, 5000000.0, 0.0, -90.0])
+    dataset = dem_tools.create_dem(
+        data=np.ones((700, 900), dtype=np.float32),
+        transform=trans,
+        img_crs=rasterio.crs.CRS.from_epsg(epsg),
+    )
+
+    dataset_tools._read_geoid.cache_clear()
+    output_arr_offset = dataset_tools._get_geoid_offset(dataset, geoid_path)
+    monkeypatch.setattr(dataset_tools, "GEOID_GRID_STEP", 1)
+    gt_arr_offset = dataset_tools._get_geoid_offset(dataset, geoid_path)
+
+    assert output_arr_offset.shape == (700, 900)
+    np.testing.assert_allclose(
+        gt_arr_offset,
+        output_arr_offset,
+        rtol=0,
+        atol=dataset_tools.GEOID_MAX_ERROR,
+    )
+    assert dataset_tools._read_geoid.cache_info().misses == 1
+
+
+@pytest.mark.unit_tests
+def test_classification_layer_dtype():
+    """
+    Test the classification layers compact storage functions
+    Input data:
+    - Manually created label ranges and classification layer maps
+    Validation data:
+    - Manually computed types, nodata labels and cast maps
+    Validation process:
+    - Check the types returned by get_classification_layer_dtype
+    - Check the nodata labels of get_classification_layer_nodata
+    - Check that cast_classification_layers converts the nodata labels
+    - Checked functions : dataset_tools's get_classification_layer_dtype,
+      get_classification_layer_nodata and cast_classification_layers
+    """
+    # Test the type of each label range
+    assert dataset_tools.get_classification_layer_dtype(0, 254) == np.uint8
+    assert dataset_tools.get_classification_layer_dtype(0, 255) == np.uint16
+    assert dataset_tools.get_classification_layer_dtype(-1, 3) == np.float32
+    assert dataset_tools.get_classification_layer_dtype(0, 65535) == np.float32
+
+    # Test the nodata label of each type
+    assert dataset_tools.get_classification_layer_nodata(np.uint8) == 255
+    assert dataset_tools.get_classification_layer_nodata(np.uint16) == 65535
+    assert np.isnan(dataset_tools.get_classification_layer_nodata(np.float32))
+
+    # Test that the nodata labels are converted by the cast
+    classif = np.array([[0, 2], [255, 1]], dtype=np.uint8)
+    np.testing.assert_array_equal(
+        dataset_tools.cast_classification_layers(classif, np.uint16),
+        np.array([[0, 2], [65535, 1]], dtype=np.uint16),
+    )
+    np.testing.assert_array_equal(
+        dataset_tools.cast_classification_layers(classif, np.float32),
+        np.array([[0, 2], [np.nan, 1]], dtype=np.float32),
+    )
+    np.testing.assert_array_equal(
+        dataset_tools.cast_classification_layers(
+            np.array([[0, 2], [np.nan, 1]], dtype=np.float32), np.uint8
+        ),
+        classif,
+    )
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("classif_interp", ["nearest", "mode"])
+def test_reproject_dataset_classification_layers(classif_interp):
+    """
+    Test the reproject_dataset function on several classification layers
+    Input data:
+    - Manually created dem with three label classification layers
+    - Manually created coarser dem grid
+    Validation data:
+    - Each classification layer reprojected alone
+      with the same resampling
+    Validation process:
+    - Reproject the dem on the coarser grid, warping the
+      classification layers in a single multi-band reprojection
+    - Check that the layers keep their type and are equal to the
+      layers reprojected one by one
+    - Checked function : dataset_tools's reproject_dataset
+    """
+    rng = np.random.default_rng(0)
+    img_crs = rasterio.crs.CRS.from_epsg(32630)
+    layers = rng.integers(0, 5, (60, 80, 3), dtype=np.uint8)
+    layers[:5, :5, 1] = 255
+    dataset = dem_tools.create_dem(
+        rng.normal(100, 10, (60, 80)).astype(np.float32),
+        transform=np.array([600000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0]),
+        img_crs=img_crs,
+        classification_layer_masks={
+            "map_arrays": layers,
+            "names": ["a", "b", "c"],
+        },
+    )
+    trans = np.array([600015.0, 25.0, 0.0, 4999985.0, 0.0, -25.0])
+    from_dataset = dem_tools.create_dem(
+        np.zeros((20, 30), dtype=np.float32),
+        transform=trans,
+        img_crs=img_crs,
+    )
+
+    output_dataset = dataset_tools.reproject_dataset(
+        dataset, from_dataset, classif_interp=classif_interp
+    )
+    output_layers = output_dataset["classification_layer_masks"].data
+    assert output_layers.dtype == np.uint8
+    assert output_layers.shape == (20, 30, 3)
+
+    for idx in range(3):
+        gt_layer = np.full((20, 30), 255, dtype=np.uint8)
+        rasterio.warp.reproject(
+            source=np.ascontiguousarray(layers[:, :, idx]),
+            destination=gt_layer,
+            src_transform=rasterio.Affine.from_gdal(
+                *dataset["georef_transform"].data
+            ),
+            src_crs=img_crs,
+            dst_transform=rasterio.Affine.from_gdal(*trans),
+            dst_crs=img_crs,
+            resampling=rasterio.warp.Resampling[classif_interp],
+            src_nodata=255,
+            dst_nodata=255,
+        )
+        np.testing.assert_array_equal(output_layers[:, :, idx], gt_layer)
@@ -25,6 +25,7 @@ dem_tools module.
 # pylint:disable = duplicate-code
 # Standard imports
 import os
+from tempfile import TemporaryDirectory
 
 # Third party imports
 import numpy as np
@@ -38,7 +39,11 @@ from demcompare.dem_tools import DEFAULT_NODATA
 from demcompare.helpers_init import read_config_file
 
 # Tests helpers
-from tests.helpers import RESULT_TOL, demcompare_test_data_path
+from tests.helpers import (
+    RESULT_TOL,
+    demcompare_test_data_path,
+    temporary_dir,
+)
 
 # Force protected access to test protected functions
 # pylint:disable=protected-access
@@ -394,3 +399,104 @@ def test_compute_dem_slope():
         output_slope["ref_slope"].data[:, :],
         rtol=RESULT_TOL,
     )
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "output_profile, gt_layout",
+    [
+        pytest.param(
+            {"tiled": True, "blocksize": 128, "compress": "deflate"},
+            None,
+            id="Tiled deflate GeoTIFF",
+        ),
+        pytest.param(
+            {"cog": True, "blocksize": 128, "compress": "zstd"},
+            "COG",
+            id="zstd COG",
+        ),
+    ],
+)
+def test_save_dem_output_profile(output_profile, gt_layout):
+    """
+    Test the save_dem function with an output profile
+    Input data:
+    - Ref dem present in the "srtm_test_data" test data directory
+    Validation data:
+    - The input dem data
+    Validation process:
+    - Save the dem with a tiled compressed output profile
+      and internal overviews
+    - Check the written compression, tiling, layout and overviews
+    - Check that the written data is the input one
+    - Checked function : dem_tools's save_dem
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+    dem = dem_tools.load_dem(cfg["input_ref"]["path"])
+
+    output_profile["overviews"] = True
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        dem_path = os.path.join(tmp_dir, "dem.tif")
+        dem_tools.save_dem(dem, dem_path, output_profile=output_profile)
+        # Only the output file is written
+        assert os.listdir(tmp_dir) == ["dem.tif"]
+        with rasterio.open(dem_path) as src:
+            assert src.profile["compress"] == output_profile["compress"]
+            assert src.profile["blockxsize"] == 128
+            assert src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") == gt_layout
+            assert src.overviews(1) == [2, 4, 8]
+            np.testing.assert_array_equal(src.read(1), dem["image"].data)
+
+
+@pytest.mark.unit_tests
+def test_compute_pixel_distances():
+    """
+    Test the compute_pixel_distances function
+    Input data:
+    - Manually created geographic and projected dems
+    Validation data:
+    - The orthodromic distances of every pixel to its previous
+      col and row pixels, computed on the full lon/lat grid
+    Validation process:
+    - Check that the distances of the projected dem are its resolution
+    - Check that the distances of the north-up geographic dem
+      are per row vectors equal to the full grid distances
+    - Checked function : dem_tools's compute_pixel_distances
+    """
+    data = np.ones((40, 50), dtype=np.float32)
+    dem = dem_tools.create_dem(
+        data,
+        transform=np.array([600000.0, 30.0, 0.0, 5000000.0, 0.0, -20.0]),
+        img_crs=rasterio.crs.CRS.from_epsg(32630),
+    )
+    assert dem_tools.compute_pixel_distances(dem) == (30.0, 20.0)
+
+    trans = np.array([5.0, 1 / 1200, 0.0, 60.0, 0.0, -1 / 1200])
+    dem = dem_tools.create_dem(
+        data, transform=trans, img_crs=rasterio.crs.CRS.from_epsg(4326)
+    )
+    distx, disty = dem_tools.compute_pixel_distances(dem)
+    assert distx.shape == (40, 1) and disty.shape == (40, 1)
+
+    # Full grid distances
+    lon, lat = np.meshgrid(
+        trans[0] + np.arange(50) * trans[1], trans[3] + np.arange(40) * trans[5]
+    )
+    gt_distx = dem_tools._get_orthodromic_distance(
+        lon, lat, np.roll(lon, 1, 1), lat
+    )
+    gt_disty = dem_tools._get_orthodromic_distance(
+        lon, lat, lon, np.roll(lat, 1, 0)
+    )
+    gt_distx[:, 0] = gt_distx[:, 1]
+    gt_disty[0] = gt_disty[1]
+    np.testing.assert_allclose(
+        np.broadcast_to(distx, (40, 50)), gt_distx, rtol=1e-5
+    )
+    np.testing.assert_allclose(
+        np.broadcast_to(disty, (40, 50)), gt_disty, rtol=1e-5
+    )
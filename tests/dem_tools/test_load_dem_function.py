@@ -276,3 +276,129 @@ def test_load_dem_with_roi_ground_coords():
     )
 
     assert gt_roi == ref.attrs["bounds"]
+
+
+@pytest.mark.unit_tests
+def test_load_dem_with_roi_window_read():
+    """
+    Test that the load_dem function only reads the
+    window covering the input ROI and its margin
+    Input data:
+    - Ref dem present in the "srtm_test_data" test
+      data directory.
+    Validation data:
+    - The full dem loaded without ROI
+    Validation process:
+    - Load the full dem and the dem with a pixel ROI and a margin
+    - Check that the loaded image is the ROI window enlarged by the margin
+    - Check that the image values and the transform are the ones
+      of the corresponding window of the full dem
+    - Check that the bounds are the ROI ones
+    - Checked function : dem_tools's load_dem
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+
+    full_dem = dem_tools.load_dem(cfg["input_ref"]["path"])
+    roi = {"x": 100, "y": 200, "w": 300, "h": 150}
+    margin = 5
+    dem = dem_tools.load_dem(
+        cfg["input_ref"]["path"], input_roi=roi, roi_margin=margin
+    )
+
+    # Test that the window enlarged by the margin has been read
+    assert dem["image"].shape == (150 + 2 * margin, 300 + 2 * margin)
+    np.testing.assert_array_equal(
+        dem["image"].data,
+        full_dem["image"].data[
+            200 - margin : 350 + margin, 100 - margin : 400 + margin
+        ],
+    )
+    # Test that the transform origin is the window one
+    gt_x, gt_y = rasterio.transform.xy(
+        rasterio.Affine.from_gdal(*full_dem.georef_transform.data),
+        200 - margin,
+        100 - margin,
+        offset="ul",
+    )
+    np.testing.assert_allclose(
+        [gt_x, gt_y],
+        dem.georef_transform.data[[0, 3]],
+        rtol=TRANSFORM_TOL,
+    )
+    # Test that the bounds are the ROI ones
+    window_bounds = rasterio.windows.bounds(
+        rasterio.windows.Window(100, 200, 300, 150),
+        rasterio.Affine.from_gdal(*full_dem.georef_transform.data),
+    )
+    np.testing.assert_allclose(window_bounds, dem.attrs["bounds"])
+
+    # Test that a ROI outside of the dem raises an error
+    with pytest.raises(ValueError):
+        _ = dem_tools.load_dem(
+            cfg["input_ref"]["path"],
+            input_roi={"left": 0.0, "bottom": 0.0, "right": 1.0, "top": 1.0},
+        )
+
+
+@pytest.mark.unit_tests
+def test_load_dem_classification_layers_dtype():
+    """
+    Test that the load_dem function stores the classification
+    layers labels with a compact type
+    Input data:
+    - Ref dem present in the "srtm_test_data" test
+      data directory and classification layer maps written from it
+    Validation process:
+    - Load the dem with uint8 maps of labels lower than 255
+    - Check that the classification layers are stored as uint8
+      with the map values
+    - Load the dem with a map using the 255 label
+    - Check that the classification layers are stored as uint16
+    - Load the dem with a map of non integer values
+    - Check that the classification layers are stored as float32
+    - Checked function : dem_tools's load_dem
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        with rasterio.open(cfg["input_ref"]["path"]) as src:
+            profile = src.profile
+            dem_image = src.read(1)
+        maps = {
+            "labels": (dem_image > 100).astype(np.uint8),
+            "labels_255": np.where(dem_image > 100, 255, 1).astype(np.uint8),
+            "values": dem_image.astype(np.float32) / 3,
+        }
+        for name, map_array in maps.items():
+            profile.update(dtype=map_array.dtype.name, nodata=None)
+            with rasterio.open(
+                os.path.join(tmp_dir, f"{name}.tif"), "w", **profile
+            ) as dst:
+                dst.write(map_array, 1)
+
+        for names, gt_dtype in [
+            (["labels"], np.uint8),
+            (["labels", "labels_255"], np.uint16),
+            (["labels", "values"], np.float32),
+        ]:
+            dem = dem_tools.load_dem(
+                cfg["input_ref"]["path"],
+                classification_layers={
+                    name: {"map_path": os.path.join(tmp_dir, f"{name}.tif")}
+                    for name in names
+                },
+            )
+            assert dem["classification_layer_masks"].dtype == gt_dtype
+            for idx, name in enumerate(names):
+                np.testing.assert_array_equal(
+                    dem["classification_layer_masks"].data[:, :, idx],
+                    maps[name].astype(gt_dtype),
+                )
@@ -410,3 +410,58 @@ def test_reproject_dems_without_intersection():
         _, _, _ = dem_tools.reproject_dems(sec_orig, ref_orig)
 
     assert error_info.value.args[0] == "ERROR: ROIs do not intersect"
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("sampling_source", ["sec", "ref"])
+def test_plan_dems_reprojection(sampling_source):
+    """
+    Test the plan_dems_reprojection function
+    Input data:
+    - Ref and sec dems present in the "srtm_test_data" test
+      data directory
+    Validation data:
+    - The dems reprojected by reproject_dems without plan
+    Validation process:
+    - Plan the reprojection of the dems
+    - Check that the planned shape, transform and adapting factor
+      are the ones of the reprojected dems
+    - Check that reproject_dems with the plan gives the same dems
+    - Checked functions : dem_tools's plan_dems_reprojection,
+      reproject_dems
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+
+    ref = dem_tools.load_dem(cfg["input_ref"]["path"])
+    sec = dem_tools.load_dem(
+        cfg["input_sec"]["path"], nodata=cfg["input_sec"]["nodata"]
+    )
+
+    plan = dem_tools.plan_dems_reprojection(sec, ref, sampling_source)
+    reproj_sec, reproj_ref, adapting_factor = dem_tools.reproject_dems(
+        sec, ref, sampling_source=sampling_source
+    )
+
+    assert plan["sampling_source"] == sampling_source
+    assert plan["shape"] == reproj_sec["image"].shape
+    assert plan["shape"] == reproj_ref["image"].shape
+    np.testing.assert_allclose(
+        plan["transform"].to_gdal(),
+        reproj_sec["georef_transform"].data,
+        rtol=TRANSFORM_TOL,
+    )
+    assert plan["adapting_factor"] == adapting_factor
+
+    planned_sec, planned_ref, _ = dem_tools.reproject_dems(
+        sec, ref, sampling_source=sampling_source, plan=plan
+    )
+    np.testing.assert_array_equal(
+        planned_sec["image"].data, reproj_sec["image"].data
+    )
+    np.testing.assert_array_equal(
+        planned_ref["image"].data, reproj_ref["image"].data
+    )
@@ -23,12 +23,17 @@ This module contains functions to test the
 methods in the matrix 2D metric class.
 """
 # pylint:disable=protected-access
+# Standard imports
+import os
+from tempfile import TemporaryDirectory
+
 # Third party imports
+import matplotlib.pyplot as mpl_pyplot
 import numpy as np
 import pytest
 
 from demcompare.metric import Metric
-from tests.helpers import RESULT_TOL
+from tests.helpers import RESULT_TOL, temporary_dir
 
 
 @pytest.mark.unit_tests
@@ -113,3 +118,52 @@ def test_hillshade():
     )
 
     np.testing.assert_allclose(output["image"].data, gt, rtol=RESULT_TOL)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("metric_name", ["hillshade", "svf"])
+def test_matrix_2d_metric_plot(metric_name, monkeypatch):
+    """
+    Test that the matrix 2D metrics figures are only built
+    if they are saved.
+    Input data:
+    - Manually computed data array with a nodata pixel
+    Validation data:
+    - The metric computed without plot
+    Validation process:
+    - Compute the metric without plot_path, pyplot figures
+      creation raising an error
+    - Compute the metric with plot_path
+    - Check that the plot is saved and that the metrics are equal
+    """
+    data = np.array(
+        [
+            [1982.0, 1967.0, 1950.0],
+            [2005.0, 1988.0, 1969.0],
+            [2012.0, 1990.0, 1967.0],
+        ],
+        dtype=np.float32,
+    )
+    no_data_location = np.zeros(data.shape, dtype=bool)
+    no_data_location[0, 0] = True
+
+    def failing_subplots(*args, **kwargs):
+        raise AssertionError("figure created without plot_path")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(mpl_pyplot, "subplots", failing_subplots)
+        metric_obj = Metric(metric_name)
+        metric_obj.no_data_location = no_data_location
+        output = metric_obj.compute_metric(data)
+
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        plot_path = os.path.join(tmp_dir, f"{metric_name}.png")
+        metric_obj = Metric(metric_name, params={"plot_path": plot_path})
+        metric_obj.no_data_location = no_data_location
+        plot_output = metric_obj.compute_metric(data)
+        assert os.path.isfile(plot_path)
+
+    np.testing.assert_array_equal(
+        output["image"].data, plot_output["image"].data
+    )
+    assert np.isnan(output["image"].data[0, 0])
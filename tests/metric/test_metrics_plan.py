@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the
+methods in the MetricsPlan class.
+"""
+
+# Third party imports
+import pytest
+
+from demcompare.metric.metrics_plan import MetricsPlan
+
+
+@pytest.mark.unit_tests
+def test_metrics_plan():
+    """
+    Test the MetricsPlan class.
+    Input data:
+    - Handcrafted input metrics list, as str and as dict
+      with and without the remove_outliers parameter
+    Validation data:
+    - Handcrafted outliers handling and input of each metric
+    Validation process:
+    - Create the MetricsPlan object
+    - Check the metrics order, outliers handling and inputs
+    - Check that the scalar metric objects are reused and that
+      the vector metric objects are created on each use
+    """
+    input_metrics = [
+        "mean",
+        {"nmad": {"remove_outliers": False}},
+        {"pdf": {"bin_step": 0.5, "remove_outliers": True}},
+        "slope-orientation-histogram",
+    ]
+    metrics_plan = MetricsPlan(input_metrics, remove_outliers=True)
+
+    assert list(metrics_plan.metrics) == [
+        "mean",
+        "nmad",
+        "pdf",
+        "slope-orientation-histogram",
+    ]
+    assert metrics_plan.remove_outliers_list == [True, False, True, True]
+    assert metrics_plan.inputs == {
+        "mean": (True, "1D"),
+        "nmad": (False, "1D"),
+        "pdf": (True, "1D"),
+        "slope-orientation-histogram": (True, "2D"),
+    }
+    # The input metrics are not modified
+    assert input_metrics[2] == {
+        "pdf": {"bin_step": 0.5, "remove_outliers": True}
+    }
+    assert metrics_plan.get_metric("mean") is metrics_plan.get_metric("mean")
+    pdf_metric = metrics_plan.get_metric("pdf")
+    assert pdf_metric is not metrics_plan.get_metric("pdf")
+    assert pdf_metric.bin_step == 0.5
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the
+streaming scalar metrics and their accumulators.
+"""
+
+# Third party imports
+import numpy as np
+import pytest
+
+from demcompare.metric import Metric
+from demcompare.metric.scalar_accumulator import QuantileSketch
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "metric_name",
+    [
+        "mean",
+        "max",
+        "min",
+        "std",
+        "rmse",
+        "median",
+        "nmad",
+        "sum",
+        "squared_sum",
+        "percentil_90",
+    ],
+)
+@pytest.mark.parametrize(
+    ["offset", "scale"],
+    [
+        pytest.param(5, 3, id="centered"),
+        pytest.param(1000, 0.5, id="large_offset_small_spread"),
+        pytest.param(3000, 5, id="elevations"),
+    ],
+)
+def test_streaming_metric(metric_name, offset, scale):
+    """
+    Test the scalar metrics accumulator interface.
+    Input data:
+    - Random data arrays with nan values, far from zero compared
+      to their spread or not, split in chunks accumulated in two
+      partial accumulators
+    Validation data:
+    - compute_metric of the metric on all the valid values
+    Validation process:
+    - Update two accumulators with every other chunk,
+      merge them and finalize the metric
+    - Check that the exact metrics are the same as compute_metric,
+      that the sketch median is within relative_accuracy of the
+      data spread and that the sketch nmad and percentil_90 are
+      within 2 * relative_accuracy relative error
+    - Check that an empty accumulator gives nan
+    """
+    rng = np.random.default_rng(0)
+    data = rng.normal(offset, scale, (400, 500))
+    data[rng.random(data.shape) < 0.1] = np.nan
+    valid_data = data[~np.isnan(data)]
+    metric_obj = Metric(metric_name)
+    assert metric_obj.STREAMING_COMPATIBLE
+    relative_accuracy = 1e-3
+
+    accumulators = [
+        metric_obj.create_accumulator(relative_accuracy) for _ in range(2)
+    ]
+    for idx, chunk in enumerate(np.array_split(data, 7, axis=0)):
+        metric_obj.update_accumulator(accumulators[idx % 2], chunk)
+    accumulator = metric_obj.merge_accumulators(*accumulators)
+    output = metric_obj.finalize_accumulator(accumulator)
+
+    gt_output = metric_obj.compute_metric(valid_data)
+    if metric_name == "median":
+        np.testing.assert_allclose(
+            output, gt_output, atol=relative_accuracy * scale
+        )
+    elif metric_obj.QUANTILE_SKETCH:
+        np.testing.assert_allclose(
+            output, gt_output, rtol=2 * relative_accuracy
+        )
+    else:
+        np.testing.assert_allclose(output, gt_output, rtol=1e-9)
+
+    empty_output = metric_obj.finalize_accumulator(
+        metric_obj.create_accumulator()
+    )
+    assert np.isnan(empty_output)
+
+
+@pytest.mark.unit_tests
+def test_quantile_sketch():
+    """
+    Test the QuantileSketch class.
+    Input data:
+    - Random data array with positive, negative and zero values
+    Validation data:
+    - np.percentile of the data
+    Validation process:
+    - Check that the sketch quantiles are within the relative
+      accuracy of the data quantiles
+    - Check that sketches of different accuracies are not merged
+    """
+    rng = np.random.default_rng(1)
+    data = np.concatenate(
+        (rng.lognormal(0, 2, 5000), -rng.lognormal(1, 1, 3000), np.zeros(50))
+    )
+    relative_accuracy = 1e-2
+    sketch = QuantileSketch(relative_accuracy).update(data)
+
+    assert sketch.count == data.size
+    for quantile in [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]:
+        np.testing.assert_allclose(
+            sketch.quantile(quantile),
+            np.percentile(data, 100 * quantile),
+            rtol=relative_accuracy,
+        )
+
+    with pytest.raises(ValueError):
+        sketch.merge(QuantileSketch(1e-3))
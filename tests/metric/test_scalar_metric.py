@@ -28,6 +28,7 @@ import numpy as np
 import pytest
 
 from demcompare.metric import Metric
+from demcompare.metric.grouped_data import GroupedData
 
 
 @pytest.mark.unit_tests
@@ -247,3 +248,54 @@ def test_percentil_90():
     output = metric_obj.compute_metric(data)
 
     np.testing.assert_equal(gt_output, output)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    "metric_name",
+    [
+        "mean",
+        "max",
+        "min",
+        "std",
+        "rmse",
+        "median",
+        "nmad",
+        "sum",
+        "squared_sum",
+        "percentil_90",
+    ],
+)
+def test_compute_grouped_metric(metric_name):
+    """
+    Test the scalar metrics class function compute_grouped_metric.
+    Input data:
+    - Random data array with nan values and its random label map,
+      with a class without values and pixels out of all the classes
+    Validation data:
+    - compute_metric of the metric on the values of each class
+    Validation process:
+    - Create the metric object and test compute_grouped_metric
+    - Check that the grouped metric is the metric of each class,
+      nan for the empty class
+    """
+    rng = np.random.default_rng(0)
+    data = rng.normal(5, 3, (30, 40)).astype(np.float32)
+    data[rng.random(data.shape) < 0.1] = np.nan
+    # Class 2 has no values, -1 is out of all the classes
+    label_map = rng.choice([-1, 0, 1, 3], size=data.shape)
+    nb_groups = 4
+    # Create metric object
+    metric_obj = Metric(metric_name)
+    assert metric_obj.GROUPED_COMPATIBLE
+
+    output = metric_obj.compute_grouped_metric(
+        GroupedData.from_label_map(data, label_map, nb_groups)
+    )
+
+    assert output.shape == (nb_groups,)
+    assert np.isnan(output[2])
+    for label in [0, 1, 3]:
+        class_data = data[label_map == label]
+        gt_output = metric_obj.compute_metric(class_data[~np.isnan(class_data)])
+        np.testing.assert_allclose(output[label], gt_output, rtol=1e-5)
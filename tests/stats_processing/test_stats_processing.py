@@ -37,7 +37,7 @@ import pytest
 
 # Demcompare imports
 import demcompare
-from demcompare import dem_tools
+from demcompare import dem_tools, stats_masks
 from demcompare.classification_layer import (
     ClassificationLayer,
     FusionClassificationLayer,
@@ -497,3 +497,73 @@ def test_statistics_output_dir():
             )
             is True
         )
+
+
+@pytest.mark.unit_tests
+def test_compute_stats_masks_computed_once(monkeypatch):
+    """
+    Test that the validity and outliers masks of the stats dem are
+    computed once for all the classification layers
+    Input data:
+    - Manually created dem with nan and nodata values and
+      its StatsProcessing object, with the global and Slope0 layers
+    Validation data:
+    - The masks of the StatsMasks functions
+    Validation process:
+    - Count the compute_nonan_mask and compute_outliers_free_mask calls
+      of the StatsMasks object
+    - Compute the stats of the global layer, then of all the layers
+    - Check that each mask has been computed once
+    - Check that the classification layers share the masks
+    - Checked function : StatsProcessing's compute_stats
+    """
+    rng = np.random.default_rng(0)
+    data = rng.normal(0, 5, (40, 50)).astype(np.float32)
+    data[:3, :] = np.nan
+    data[10, 10:20] = -9999
+    data[20, 20] = 100
+    dem = dem_tools.compute_dem_slope(
+        dem_tools.create_dem(data=data, nodata=-9999)
+    )
+    stats_processing = demcompare.StatsProcessing(
+        {
+            "remove_outliers": True,
+            "classification_layers": {
+                "Slope0": {"type": "slope", "ranges": [0, 10, 25, 50, 90]},
+            },
+        },
+        dem,
+    )
+    calls = {"compute_nonan_mask": 0, "compute_outliers_free_mask": 0}
+
+    def count_calls(function):
+        def counted_function(*args):
+            calls[function.__name__] += 1
+            return function(*args)
+
+        return counted_function
+
+    for name in calls:
+        monkeypatch.setattr(
+            stats_masks,
+            name,
+            count_calls(getattr(stats_masks, name)),
+        )
+
+    stats_processing.compute_stats(classification_layer=["global"])
+    stats_processing.compute_stats()
+
+    assert calls == {"compute_nonan_mask": 1, "compute_outliers_free_mask": 1}
+    for classif in stats_processing.classification_layers:
+        assert (
+            classif.outliers_free_mask
+            is stats_processing.stats_masks.outliers_free_mask
+        )
+    np.testing.assert_array_equal(
+        stats_processing.stats_masks.nonan_mask,
+        ~np.isnan(stats_processing.dem["image"].data)
+        * (
+            stats_processing.dem["image"].data
+            != stats_processing.dem.attrs["nodata"]
+        ),
+    )
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the
+methods in the demcompare_batch module.
+"""
+
+# Standard imports
+import csv
+import os
+from tempfile import TemporaryDirectory
+
+# Third party imports
+import numpy as np
+import pytest
+
+# Demcompare imports
+from demcompare.demcompare_batch import (
+    BATCH_SUMMARY_FILE,
+    run_batch,
+    verify_config,
+)
+from demcompare.helpers_init import read_config_file, save_config_file
+
+# Tests helpers
+from .helpers import demcompare_test_data_path, temporary_dir
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize(
+    ["dict_config", "expected_error"],
+    [
+        pytest.param(
+            {"input_sec": {"path": "a.tif"}},
+            "The secondary dems are given by input_secs",
+        ),
+        pytest.param(
+            {"input_secs": []},
+            "input_secs must be a non empty list",
+        ),
+        pytest.param(
+            {"input_secs": [{"nodata": -32768}]},
+            "Each input_secs dem must have a path",
+        ),
+        pytest.param(
+            {"input_secs": [{"path": "a/dem.tif"}, {"path": "b/dem.tif"}]},
+            "The input_secs names are not unique: ['dem', 'dem']",
+        ),
+        pytest.param(
+            {"input_secs": [{"path": "a.tif"}], "batch": {"nb_cpu": 0}},
+            "Number of CPUs is incorrect",
+        ),
+        pytest.param(
+            {"input_secs": [{"path": "a.tif"}], "batch": {"nb_cpu": 999999}},
+            "Number of CPUs in the config is more than available CPUs",
+        ),
+    ],
+)
+def test_verify_config(dict_config, expected_error):
+    """
+    Test the verify_config function
+    Input data:
+    - handcraft batch configuration dictionary
+    Validation data:
+    - handcraft error message
+    Validation process:
+    - Check that the config dictionary does contain error
+    - Checked function : verify_config
+    """
+
+    with pytest.raises(ValueError) as exc_info:
+        verify_config(dict_config)
+
+    assert str(exc_info.value) == expected_error
+
+
+@pytest.mark.end2end_tests
+@pytest.mark.functional_tests
+def test_run_batch():
+    """
+    Test the run_batch function with the "srtm_test_data" test root data
+    Input data:
+    - Input dems and configuration present in the
+      "srtm_test_data/input" test data directory, the sec dem
+      being given twice in input_secs with a missing dem
+    Validation data:
+    - Coregistration offsets of the "srtm_test_data/ref_output"
+      coregistration_results.json
+    Validation process:
+    - Run the batch on a temporary directory
+    - Check that each secondary dem has its outputs
+    - Check the summary table offsets, and the error of the missing dem
+      not stopping the batch
+    - Checked function : run_batch
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    test_cfg = read_config_file(test_cfg_path)
+    ref_coreg_results = read_config_file(
+        os.path.join(
+            test_data_path,
+            "ref_output/coregistration/coregistration_results.json",
+        )
+    )["coregistration_results"]
+
+    input_sec = test_cfg.pop("input_sec")
+    test_cfg["input_secs"] = [
+        input_sec,
+        dict(input_sec, name="missing", path="missing_dem.tif"),
+        dict(input_sec, name="copy"),
+    ]
+    test_cfg.pop("statistics")
+
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        test_cfg["output_dir"] = tmp_dir
+        tmp_cfg_file = os.path.join(tmp_dir, "test_config.json")
+        save_config_file(tmp_cfg_file, test_cfg)
+
+        summary = run_batch(tmp_cfg_file)
+
+        assert [row["name"] for row in summary] == [
+            "srtm_blurred_and_shifted",
+            "missing",
+            "copy",
+        ]
+        for idx in [0, 2]:
+            assert summary[idx]["error"] is None
+            np.testing.assert_allclose(
+                [summary[idx]["dx"], summary[idx]["dy"]],
+                [
+                    ref_coreg_results["dx"]["total_offset"],
+                    ref_coreg_results["dy"]["total_offset"],
+                ],
+            )
+            assert os.path.isfile(
+                os.path.join(
+                    tmp_dir,
+                    summary[idx]["name"],
+                    "coregistration",
+                    "coregistration_results.json",
+                )
+            )
+        assert summary[1]["error"] is not None
+        assert "dx" not in summary[1]
+
+        with open(
+            os.path.join(tmp_dir, BATCH_SUMMARY_FILE), "r", encoding="utf-8"
+        ) as csv_file:
+            csv_summary = list(csv.DictReader(csv_file))
+        assert [row["name"] for row in csv_summary] == [
+            row["name"] for row in summary
+        ]
+        assert float(csv_summary[2]["dx"]) == summary[2]["dx"]
@@ -283,3 +283,280 @@ def test_compute_gdal_translate_bounds_gironde_dir():
     np.testing.assert_allclose(uly, gt_uly, rtol=BOUNDS_TOL)
     np.testing.assert_allclose(lrx, gt_lrx, rtol=BOUNDS_TOL)
     np.testing.assert_allclose(lry, gt_lry, rtol=BOUNDS_TOL)
+
+
+@pytest.mark.unit_tests
+def test_get_output_creation_options():
+    """
+    Test the get_output_creation_options function
+    Input data:
+    - Manually created output profiles
+    Validation data:
+    - Manually computed drivers and creation options
+    Validation process:
+    - Check the driver and creation options of the default,
+      tiled compressed GeoTIFF, COG and lerc profiles
+    - Check that an invalid profile raises a ValueError
+    - Checked function : img_tools's get_output_creation_options
+    """
+    # Default profile: plain GeoTIFF
+    assert img_tools.get_output_creation_options(None, np.float32) == (
+        "GTiff",
+        {"bigtiff": "IF_SAFER"},
+    )
+    # Tiled and compressed GeoTIFF with automatic predictors
+    driver, options = img_tools.get_output_creation_options(
+        {"tiled": True, "blocksize": 256, "compress": "DEFLATE"}, np.float32
+    )
+    assert driver == "GTiff"
+    assert options == {
+        "bigtiff": "IF_SAFER",
+        "compress": "deflate",
+        "num_threads": "ALL_CPUS",
+        "predictor": 3,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+    }
+    _, options = img_tools.get_output_creation_options(
+        {"compress": "zstd"}, np.uint8
+    )
+    assert options["predictor"] == 2
+    # COG with overviews
+    driver, options = img_tools.get_output_creation_options(
+        {"cog": True, "compress": "zstd", "overviews": True}, np.float32
+    )
+    assert driver == "COG"
+    assert options["predictor"] == "FLOATING_POINT"
+    assert options["overviews"] == "AUTO"
+    assert options["blocksize"] == 512
+    # Lerc compression has no predictor
+    _, options = img_tools.get_output_creation_options(
+        {"compress": "lerc", "max_z_error": 0.01}, np.float32
+    )
+    assert "predictor" not in options
+    assert options["max_z_error"] == 0.01
+
+    # Invalid profiles
+    with pytest.raises(ValueError):
+        img_tools.get_output_creation_options({"compres": "zstd"}, np.float32)
+    with pytest.raises(ValueError):
+        img_tools.get_output_creation_options({"compress": "jpeg"}, np.float32)
+    with pytest.raises(ValueError):
+        img_tools.get_output_creation_options({"blocksize": 100}, np.float32)
+
+
+@pytest.mark.unit_tests
+def test_compute_overview_factors():
+    """
+    Test the compute_overview_factors function
+    Input data:
+    - Manually created raster shapes
+    Validation data:
+    - Manually computed overview factors
+    Validation process:
+    - Check that the overviews are decimated down to one block
+    - Checked function : img_tools's compute_overview_factors
+    """
+    assert img_tools.compute_overview_factors((5000, 300), 512) == [
+        2,
+        4,
+        8,
+        16,
+    ]
+    assert not img_tools.compute_overview_factors((512, 512), 512)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("shape", [(300, 500), (1, 500), (20, 20)])
+def test_compute_on_control_grid(shape):
+    """
+    Test the compute_on_control_grid function
+    Input data:
+    - A smooth function and a function with derivatives
+      discontinuities along a row and a col
+    Validation data:
+    - The functions computed on every pixel
+    Validation process:
+    - Compute the functions on a control grid upsampled
+      by blocks of rows
+    - Check that the two values tuple is returned
+    - Check that the values are equal to the values computed
+      on every pixel up to the maximum error
+    - Checked function : img_tools's compute_on_control_grid
+    """
+
+    def _compute_values(rows, cols):
+        smooth = np.sin(rows / 100) * np.cos(cols / 150)
+        kinked = 0.1 * np.abs(rows - 150.5) + 0.05 * np.abs(cols - 233.2)
+        return smooth, kinked
+
+    rows = np.arange(shape[0]) + 10
+    cols = np.arange(shape[1])
+    smooth, kinked = img_tools.compute_on_control_grid(
+        _compute_values, rows, cols, max_error=1e-3, block_rows=64
+    )
+
+    gt_smooth, gt_kinked = _compute_values(
+        *np.meshgrid(rows, cols, indexing="ij")
+    )
+    assert smooth.shape == shape and kinked.shape == shape
+    np.testing.assert_allclose(smooth, gt_smooth, rtol=0, atol=1e-3)
+    np.testing.assert_allclose(kinked, gt_kinked, rtol=0, atol=1e-3)
+
+
+@pytest.mark.unit_tests
+def test_compute_surface_normal_per_row_resolution():
+    """
+    Test the compute_surface_normal function with per row resolutions
+    Input data:
+    - A manually created plane
+    Validation data:
+    - The normal computed with scalar resolutions
+    Validation process:
+    - Compute the normal with constant (row, 1) resolution vectors
+    - Check that it is equal to the normal with scalar resolutions
+    - Checked function : img_tools's compute_surface_normal
+    """
+    rows, cols = np.meshgrid(np.arange(20), np.arange(30), indexing="ij")
+    data = 2.0 * rows + 3.0 * cols
+    normal = img_tools.compute_surface_normal(data, 30.0, -20.0)
+    row_normal = img_tools.compute_surface_normal(
+        data, np.full((20, 1), 30.0), np.full((20, 1), -20.0)
+    )
+    np.testing.assert_allclose(row_normal, normal, rtol=1e-12)
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("method", ["bilinear", "bicubic", "fourier"])
+def test_shift_image(method):
+    """
+    Test the shift_image function
+    Input data:
+    - A manually created smooth periodic image with a nan value
+    Validation data:
+    - The image function evaluated at the shifted positions
+    Validation process:
+    - Shift the image by a sub-pixel translation
+    - Check that the shifted values are close to the function
+      values inside of the image
+    - Check that the nan value is propagated to its neighbours
+    - Check that an integer shift moves the pixels
+    - Checked function : img_tools's shift_image
+    """
+
+    def _compute_values(rows, cols):
+        return np.sin(2 * np.pi * rows / 40) + np.cos(2 * np.pi * cols / 50)
+
+    rows, cols = np.meshgrid(np.arange(40), np.arange(50), indexing="ij")
+    image = _compute_values(rows, cols)
+
+    shifted = img_tools.shift_image(image, 0.4, -0.3, method)
+
+    gt_shifted = _compute_values(rows - 0.3, cols + 0.4)
+    inside = (slice(3, -3), slice(3, -3))
+    atol = 1e-2 if method == "bilinear" else 1e-3
+    np.testing.assert_allclose(
+        shifted[inside], gt_shifted[inside], rtol=0, atol=atol
+    )
+
+    # The nan value is propagated to the pixels interpolated from it
+    image[20, 25] = np.nan
+    shifted = img_tools.shift_image(image, 0.4, -0.3, method)
+    assert np.isnan(shifted[20, 24]) and np.isnan(shifted[21, 25])
+    assert np.isfinite(shifted[10, 10])
+
+    np.testing.assert_allclose(
+        img_tools.shift_image(image, 2, -1, method)[1:, :-2],
+        image[:-1, 2:],
+        rtol=0,
+        atol=1e-12,
+    )
+
+
+@pytest.mark.unit_tests
+def test_shift_image_nearest_labels():
+    """
+    Test the shift_image function on (row, col, indicator) labels
+    Input data:
+    - Manually created uint8 labels layers
+    Validation data:
+    - The labels of the nearest shifted pixels, the fill value
+      outside of the layers
+    Validation process:
+    - Shift the labels with the nearest method and a fill value
+    - Check the labels dtype and values
+    - Checked function : img_tools's shift_image
+    """
+    labels = np.arange(4 * 5 * 2, dtype=np.uint8).reshape((4, 5, 2))
+    shifted = img_tools.shift_image(
+        labels, 1.4, -0.6, "nearest", fill_value=255
+    )
+    assert shifted.dtype == np.uint8
+    np.testing.assert_array_equal(shifted[1:, :-1], labels[:-1, 1:])
+    assert (shifted[0] == 255).all() and (shifted[:, -1] == 255).all()
+
+    with pytest.raises(ValueError):
+        img_tools.shift_image(labels, 1, 1, "spline")
+
+
+@pytest.mark.unit_tests
+def test_compute_block_mean():
+    """
+    Test the compute_block_mean function
+    Input data:
+    - A manually created image with nan values
+    Validation data:
+    - Manually computed blocks means
+    Validation process:
+    - Decimate the image by 2
+    - Check the blocks means ignoring the nan values, the nan
+      block without valid value and the dropped last row and col
+    - Checked function : img_tools's compute_block_mean
+    """
+    image = np.array(
+        [
+            [1, 3, np.nan, np.nan, 7],
+            [5, 7, np.nan, np.nan, 7],
+            [2, np.nan, 0, 4, 7],
+            [7, 7, 7, 7, 7],
+            [7, 7, 7, 7, 7],
+        ],
+        dtype=np.float32,
+    )
+    gt_block_mean = np.array([[4, np.nan], [16 / 3, 4.5]])
+    np.testing.assert_array_equal(
+        img_tools.compute_block_mean(image, 2), gt_block_mean
+    )
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("col_shift, row_shift", [(4.4, -3.2), (-7, 2)])
+def test_compute_phase_correlation_shift(col_shift, row_shift):
+    """
+    Test the compute_phase_correlation_shift function
+    Input data:
+    - A manually created smooth periodic image and its
+      shifted copy
+    Validation data:
+    - The input shift
+    Validation process:
+    - Estimate the shift without and with upsampling
+    - Check the integer and the sub-pixel shifts
+    - Checked function : img_tools's compute_phase_correlation_shift
+    """
+    rows, cols = np.meshgrid(np.arange(200), np.arange(240), indexing="ij")
+    image = np.sin(rows / 7) * np.cos(cols / 11) + 0.3 * np.sin(
+        rows / 3 + cols / 5
+    )
+    shifted = img_tools.shift_image(image, col_shift, row_shift, "fourier")
+
+    np.testing.assert_array_equal(
+        img_tools.compute_phase_correlation_shift(shifted, image),
+        (np.round(col_shift), np.round(row_shift)),
+    )
+    np.testing.assert_allclose(
+        img_tools.compute_phase_correlation_shift(shifted, image, 20),
+        (col_shift, row_shift),
+        atol=0.05,
+    )
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf8
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the lazy chunked mode
+of demcompare (lazy_tools module), comparing it to the in-memory mode.
+"""
+
+# Standard imports
+import os
+from tempfile import TemporaryDirectory
+
+# Third party imports
+import numpy as np
+import pytest
+import rasterio
+
+# Demcompare imports
+from demcompare import dataset_tools, dem_tools, lazy_tools
+from demcompare.dem_processing import DemProcessing
+from demcompare.helpers_init import read_config_file
+
+# Tests helpers
+from .helpers import demcompare_test_data_path, temporary_dir
+
+pytest.importorskip("dask")
+
+
+@pytest.mark.unit_tests
+def test_load_dem_lazy():
+    """
+    Test the load_dem function with chunks
+    Input data:
+    - Ref DEM of "srtm_test_data" and a classification
+      layer map written from it
+    Validation data:
+    - The same DEM and classification layer loaded in memory
+    Validation process:
+    - Load the DEM in memory and lazily with chunks
+    - Check that the lazy image and classification layer masks
+      are dask arrays with the input chunks
+    - Check that they are equal to the in-memory ones
+    - Checked function : dem_tools's load_dem
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        # Write a classification layer map of the ref dem
+        map_path = os.path.join(tmp_dir, "classif_map.tif")
+        with rasterio.open(cfg["input_ref"]["path"]) as src:
+            profile = src.profile
+            profile.update(dtype="uint8", nodata=None)
+            with rasterio.open(map_path, "w", **profile) as dst:
+                dst.write((src.read(1) > 100).astype(np.uint8), 1)
+        classification_layers = {"Status": {"map_path": map_path}}
+
+        dem = dem_tools.load_dem(
+            cfg["input_ref"]["path"],
+            classification_layers=classification_layers,
+        )
+        lazy_dem = dem_tools.load_dem(
+            cfg["input_ref"]["path"],
+            classification_layers=classification_layers,
+            chunks=(100, 130),
+        )
+
+        assert lazy_tools.is_lazy_array(lazy_dem["image"].data)
+        assert lazy_dem["image"].data.chunksize == (100, 130)
+        assert lazy_tools.is_lazy_array(
+            lazy_dem["classification_layer_masks"].data
+        )
+        np.testing.assert_array_equal(
+            dem["image"].data, lazy_dem["image"].values
+        )
+        np.testing.assert_array_equal(
+            dem["classification_layer_masks"].data,
+            lazy_dem["classification_layer_masks"].values,
+        )
+
+
+@pytest.mark.unit_tests
+def test_load_dem_lazy_no_compute():
+    """
+    Test that the load_dem function with chunks does not read the DEM
+    Input data:
+    - Ref DEM of "srtm_test_data"
+    Validation data:
+    - None
+    Validation process:
+    - Load the DEM lazily with chunks while counting the dask computes
+    - Check that no dask graph is computed at load time,
+      the all nodata check being skipped in lazy mode
+    - Checked function : dem_tools's load_dem
+    """
+    # pylint:disable=import-outside-toplevel
+    from dask.callbacks import Callback
+
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    cfg = read_config_file(
+        os.path.join(test_data_path, "input/test_config.json")
+    )
+
+    computes = []
+    with Callback(start=computes.append):
+        lazy_dem = dem_tools.load_dem(
+            cfg["input_ref"]["path"], nodata=-32768, chunks=(100, 130)
+        )
+
+    assert lazy_tools.is_lazy_array(lazy_dem["image"].data)
+    assert not computes
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("sampling_source", ["sec", "ref"])
+def test_lazy_dems_diff_and_slope(sampling_source):
+    """
+    Test the lazy reproject_dems, alti-diff and compute_dem_slope
+    Input data:
+    - Ref and sec DEMs of "srtm_test_data"
+    Validation data:
+    - The same DEMs loaded, reprojected, differenced and
+      their slope computed in memory
+    Validation process:
+    - Load the DEMs in memory and lazily with chunks
+    - Reproject them, compute their difference and slope
+    - Check that the lazy results are dask arrays
+    - Check that they are equal to the in-memory ones
+    - Save the lazy difference and check the written file
+    - Checked functions : dem_tools's reproject_dems,
+      compute_dem_slope and save_dem, AltiDiff's process_dem
+    """
+    # Get "srtm_test_data" test root data directory absolute path
+    test_data_path = demcompare_test_data_path("srtm_test_data")
+    # Load "srtm_test_data" demcompare config from input/test_config.json
+    test_cfg_path = os.path.join(test_data_path, "input/test_config.json")
+    cfg = read_config_file(test_cfg_path)
+
+    results = []
+    for chunks in [None, (100, 130)]:
+        ref = dem_tools.load_dem(cfg["input_ref"]["path"], chunks=chunks)
+        sec = dem_tools.load_dem(
+            cfg["input_sec"]["path"],
+            nodata=cfg["input_sec"]["nodata"],
+            chunks=chunks,
+        )
+        reproj_sec, reproj_ref, _ = dem_tools.reproject_dems(
+            sec, ref, sampling_source=sampling_source
+        )
+        diff = DemProcessing("alti-diff").process_dem(reproj_ref, reproj_sec)
+        slope = dem_tools.compute_dem_slope(reproj_ref)["ref_slope"]
+        results.append((reproj_sec, reproj_ref, diff, slope))
+
+    for data, lazy_data in zip(results[0][:3], results[1][:3]):
+        assert lazy_tools.is_lazy_array(lazy_data["image"].data)
+        np.testing.assert_array_equal(
+            data["image"].data, lazy_data["image"].values
+        )
+    assert lazy_tools.is_lazy_array(results[1][3].data)
+    np.testing.assert_array_equal(results[0][3].data, results[1][3].values)
+
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        diff_path = os.path.join(tmp_dir, "diff.tif")
+        dem_tools.save_dem(results[1][2], diff_path)
+        with rasterio.open(diff_path) as src:
+            np.testing.assert_array_equal(
+                results[0][2]["image"].data, src.read(1)
+            )
+
+
+@pytest.mark.unit_tests
+def test_lazy_reproject_classification_layers():
+    """
+    Test the lazy multi-band reprojection of classification layers
+    Input data:
+    - Manually created dem with three label classification layers,
+      in memory and lazy
+    Validation data:
+    - The classification layers reprojected in memory
+    Validation process:
+    - Reproject the lazy dem on a coarser grid
+    - Check that the lazy layers are equal to the in-memory ones
+    - Checked function : dataset_tools's reproject_dataset,
+      lazy_tools's reproject_lazy
+    """
+    rng = np.random.default_rng(0)
+    img_crs = rasterio.crs.CRS.from_epsg(32630)
+    layers = rng.integers(0, 5, (60, 80, 3), dtype=np.uint8)
+    datasets = [
+        dem_tools.create_dem(
+            rng.normal(100, 10, (60, 80)).astype(np.float32),
+            transform=np.array([600000.0, 10.0, 0.0, 5000000.0, 0.0, -10.0]),
+            img_crs=img_crs,
+            classification_layer_masks={
+                "map_arrays": layers,
+                "names": ["a", "b", "c"],
+            },
+        )
+        for _ in range(2)
+    ]
+    datasets[1] = datasets[1].chunk({"row": 25, "col": 30})
+    from_dataset = dem_tools.create_dem(
+        np.zeros((20, 30), dtype=np.float32),
+        transform=np.array([600015.0, 25.0, 0.0, 4999985.0, 0.0, -25.0]),
+        img_crs=img_crs,
+    )
+
+    output_layers, lazy_output_layers = [
+        dataset_tools.reproject_dataset(dataset, from_dataset)[
+            "classification_layer_masks"
+        ].data
+        for dataset in datasets
+    ]
+    assert lazy_tools.is_lazy_array(lazy_output_layers)
+    np.testing.assert_array_equal(output_layers, lazy_output_layers.compute())
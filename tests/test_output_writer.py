@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf8
+# Disable the protected-access to test the functions
+# pylint:disable=protected-access
+#
+# Copyright (c) 2023 Centre National d'Etudes Spatiales (CNES).
+#
+# This file is part of demcompare
+# (see https://github.com/CNES/demcompare).
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+This module contains functions to test the OutputWriter class
+writing the outputs in the background.
+"""
+
+# Standard imports
+import os
+from tempfile import TemporaryDirectory
+
+# Third party imports
+import numpy as np
+import pytest
+import rasterio
+
+# Demcompare imports
+from demcompare import dem_tools
+from demcompare.output_writer import OutputWriter, write_output
+
+# Tests helpers
+from .helpers import temporary_dir
+
+
+@pytest.mark.unit_tests
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_output_writer(max_workers):
+    """
+    Test the OutputWriter writings
+    Input data:
+    - Manually created dems
+    Validation data:
+    - The same dems
+    Validation process:
+    - Submit the saving of the dems and of their plots
+    - Join the writings
+    - Check that the written dems are equal to the input ones
+      and that the plots are written
+    - Checked functions : OutputWriter's submit, join
+    """
+    with TemporaryDirectory(dir=temporary_dir()) as tmp_dir:
+        dems = [
+            dem_tools.create_dem(
+                np.full((20, 30), idx, dtype=np.float32),
+                transform=np.array(
+                    [600000.0, 30.0, 0.0, 5000000.0, 0.0, -30.0]
+                ),
+                img_crs=rasterio.crs.CRS.from_epsg(32630),
+            )
+            for idx in range(5)
+        ]
+        with OutputWriter(max_workers) as output_writer:
+            for idx, dem in enumerate(dems):
+                output_writer.submit(
+                    dem_tools.save_dem,
+                    dem,
+                    os.path.join(tmp_dir, f"dem_{idx}.tif"),
+                )
+                write_output(
+                    output_writer,
+                    dem_tools.compute_and_save_image_plots,
+                    dem,
+                    os.path.join(tmp_dir, f"dem_{idx}.png"),
+                )
+            output_writer.join()
+
+            for idx, dem in enumerate(dems):
+                with rasterio.open(
+                    os.path.join(tmp_dir, f"dem_{idx}.tif")
+                ) as src:
+                    np.testing.assert_array_equal(src.read(1), dem["image"])
+                assert os.path.isfile(os.path.join(tmp_dir, f"dem_{idx}.png"))
+
+
+@pytest.mark.unit_tests
+def test_output_writer_errors():
+    """
+    Test the OutputWriter errors
+    Input data:
+    - A failing writing function
+    Validation process:
+    - Check that a negative number of writers raises a ValueError
+    - Check that the error of a background writing is raised on join
+    - Check that a successful writing after it is still done
+    - Checked functions : OutputWriter's __init__, submit, join
+    """
+    with pytest.raises(ValueError):
+        OutputWriter(-1)
+
+    def failing_writing():
+        raise OSError("writing error")
+
+    written = []
+    output_writer = OutputWriter(1)
+    output_writer.submit(failing_writing)
+    with pytest.raises(OSError, match="writing error"):
+        output_writer.join()
+    output_writer.submit(written.append, 1)
+    output_writer.join()
+    output_writer.shutdown()
+    assert written == [1]
+
+
+@pytest.mark.unit_tests
+def test_output_writer_computation_error(caplog):
+    """
+    Test the OutputWriter context manager on a computation error
+    Input data:
+    - A failing writing function and a failing computation
+    Validation process:
+    - Submit the failing writing and raise an error in the block
+    - Check that the computation error is raised, that the writing
+      error is logged and that the writing threads are stopped
+    - Checked functions : OutputWriter's __exit__, shutdown
+    """
+
+    def failing_writing():
+        raise OSError("writing error")
+
+    with pytest.raises(RuntimeError, match="computation error"):
+        with OutputWriter(1) as output_writer:
+            output_writer.submit(failing_writing)
+            raise RuntimeError("computation error")
+
+    assert "Output writing failed: writing error" in caplog.text
+    assert output_writer._executor._shutdown
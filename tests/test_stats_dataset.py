@@ -30,6 +30,9 @@ import numpy as np
 # Third party imports
 import pytest
 
+# Demcompare imports
+from demcompare.stats_dataset import StatsDataset
+
 
 @pytest.mark.unit_tests
 def test_add_classif_layer_and_mode_stats_names(initialize_stats_dataset):
@@ -308,3 +311,59 @@ def test_add_classif_layer_and_mode_stats_slope_layer(
         slope_dataset.image_by_class_exclusion.data[:, :, class_idx],
         input_stats_slope_exclusion[class_idx]["dz_values"],
     )
+
+
+@pytest.mark.unit_tests
+def test_add_classif_layer_and_mode_stats_class_labels():
+    """
+    Test the add_classif_layer_and_mode_stats function with the
+    class labels map of a mode instead of the dz_values by class
+    Input data:
+    - Handcrafted image and class labels map
+    Validation data:
+    - Image by class computed with np.where for each class
+    Validation process:
+    - Check that only the 2D labels map is stored on the dataset
+    - Check the image by class materialized by
+      get_classification_layer_image_by_class, for one class
+      and for all the classes
+    - Checked function : StatsDataset's
+      add_classif_layer_and_mode_stats and
+      get_classification_layer_image_by_class
+    """
+    image = np.array([[1.0, 2.0, np.nan], [4.0, 5.0, 6.0]], dtype=np.float32)
+    class_labels = np.array([[0, 1, -1], [2, -1, 1]], dtype=np.int8)
+    input_stats = [
+        {"mean": 1.0, "nbpts": 1, "class_name": "a:0"},
+        {"mean": 4.0, "nbpts": 2, "class_name": "b:1"},
+        {"mean": 4.0, "nbpts": 1, "class_name": "c:2"},
+    ]
+    stats_dataset = StatsDataset(image)
+    stats_dataset.add_classif_layer_and_mode_stats(
+        classif_name="layer",
+        input_stats=input_stats,
+        mode_name="intersection",
+        class_labels=class_labels,
+    )
+
+    dataset = stats_dataset.get_classification_layer_dataset("layer")
+    assert "image_by_class_intersection" not in dataset
+    assert dataset["labels_by_class_intersection"].dims == ("row", "col")
+    assert dataset.attrs["stats_by_class_intersection"][1] == input_stats[1]
+
+    gt_image_by_class = np.stack(
+        [np.where(class_labels == idx, image, np.nan) for idx in range(3)],
+        axis=2,
+    )
+    np.testing.assert_equal(
+        stats_dataset.get_classification_layer_image_by_class(
+            "layer", mode="intersection", classif_class=1
+        ),
+        gt_image_by_class[:, :, 1],
+    )
+    np.testing.assert_equal(
+        stats_dataset.get_classification_layer_image_by_class(
+            "layer", mode="intersection"
+        ),
+        gt_image_by_class,
+    )